@@ -0,0 +1,134 @@
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import importlib
+import json
+import tkinter as tk
+from tkinter import ttk, messagebox
+
+from db import connection, shards, write_queue
+from db.executor import QueryExecutor
+from db.reference import registry
+from form import diagnostics_form
+
+IMPORTED = time.perf_counter()
+
+# Единое окно приложения: формы на вкладках. Окно показывается сразу, а модуль
+# формы импортируется и форма создаётся при первом переходе на её вкладку
+# (первая вкладка - сразу после первой отрисовки окна). Справочники
+# загружаются в фоне с самого запуска; формы читают свои записи тоже в фоне.
+
+# (заголовок вкладки, модуль, класс формы)
+TABS = (
+    ("Книги", "books_form", "BooksForm"),
+    ("Читатели", "form.readers_form", "ReadersForm"),
+    ("Тематики", "form.themes_form", "ThemesForm"),
+    ("Библиотеки", "form.libraries_form", "LibrariesForm"),
+    ("Издательства", "form.publishers_form", "PublishersForm"),
+    ("Отчёты", "form.report_form", "ReportForm"),
+)
+
+
+class Launcher(ttk.Notebook):
+    # on_form(номер вкладки, форма) - вызывается, когда форма создана
+
+    def __init__(self, master, on_form=None):
+        super().__init__(master)
+        self.on_form = on_form
+        self.forms = {}
+        self.pages = []
+        for title, _, _ in TABS:
+            page = ttk.Frame(self)
+            ttk.Label(page, text="Загрузка...").pack(padx=40, pady=40)
+            self.add(page, text=title)
+            self.pages.append(page)
+        self.bind("<<NotebookTabChanged>>", self.tab_changed)
+        self.executor = QueryExecutor(self)
+        self.executor.submit(registry.refresh, errback=self.show_db_error)
+        # Граница просрочки в сводках сдвигается здесь, а не при их чтении
+        self.executor.submit(shards.get_router().refresh_overdue, errback=self.show_db_error)
+        self.tab_changed()
+
+    def show_db_error(self, error):
+        messagebox.showerror("Ошибка базы данных", str(error))
+
+    def tab_changed(self, event=None):
+        index = self.index(self.select())
+        if index not in self.forms:
+            # after_idle + after(0): сначала Tk дорисует окно и вкладку
+            self.after_idle(lambda: self.after(0, self.build, index))
+
+    def build(self, index):
+        if index in self.forms:
+            return
+        _, module_name, class_name = TABS[index]
+        page = self.pages[index]
+        form_class = getattr(importlib.import_module(module_name), class_name)
+        for child in page.winfo_children():
+            child.destroy()
+        form = self.forms[index] = form_class(page)
+        form.pack(padx=10, pady=10)
+        if self.on_form:
+            self.on_form(index, form)
+
+
+def measure_startup(root, app):
+    # Время запуска (мс от начала импорта app.py): импорт, первая отрисовка
+    # окна, создание первой формы. Результат - JSON в stdout, затем выход.
+    marks = {"import_ms": round((IMPORTED - STARTED) * 1000, 1)}
+
+    def mark(name):
+        marks.setdefault(name, round((time.perf_counter() - STARTED) * 1000, 1))
+
+    def painted(event):
+        mark("first_paint_ms")
+
+    def formed(index, form):
+        mark("first_form_ms")
+        print(json.dumps(marks))
+        root.after_idle(root.destroy)
+    root.bind("<Expose>", painted, add="+")
+    app.on_form = formed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Библиотека")
+    parser.add_argument("--db", help="файл БД (по умолчанию db/library.db)")
+    parser.add_argument("--group-commit", action="store_true",
+                        help="сохранять через очередь записи с групповым commit (db/write_queue.py)")
+    parser.add_argument("--synchronous", choices=write_queue.SYNCHRONOUS_LEVELS, default=write_queue.SYNCHRONOUS,
+                        help="PRAGMA synchronous очереди записи")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="измерить время запуска, вывести JSON и выйти")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.db:
+        connection.configure(args.db)
+    if args.group_commit:
+        write_queue.configure(synchronous=args.synchronous)
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        if not args.startup_time:
+            raise
+        # Нет дисплея: измеримо только время импорта
+        print(json.dumps({"import_ms": round((IMPORTED - STARTED) * 1000, 1), "error": str(e)}))
+        return
+    root.title("Библиотека")
+    diagnostics_form.install(root)
+    app = Launcher(root)
+    app.pack(fill="both", expand=True)
+    if args.startup_time:
+        measure_startup(root, app)
+    root.mainloop()
+    # Дождаться commit операций, ещё стоящих в очереди записи
+    write_queue.close_all()
+
+
+if __name__ == "__main__":
+    main()
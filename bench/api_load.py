@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from bench import datagen
+
+# Нагрузочная проверка db/api.py: CLIENTS клиентов asyncio с соединениями
+# keep-alive в течение DURATION секунд шлют смесь запросов - поиск книг,
+# карточка книги (повторно - с If-None-Match), поиск и карточка читателя,
+# изредка выдача и возврат книги. Итог - запросов в секунду, задержки p50/p99
+# по видам запросов и доля ответов 304. Сервер по умолчанию запускается
+# отдельным процессом на копии синтетической базы (записи её меняют).
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CLIENTS = 16
+DURATION = 10.0
+# Доля запросов каждого вида (записи - пара выдача + возврат)
+MIX = (
+    ("books_search", 0.30),
+    ("book", 0.30),
+    ("readers_search", 0.15),
+    ("reader", 0.20),
+    ("loan", 0.05),
+)
+
+
+def sample(db_path, count=500):
+    # Коды книг и читателей и слова названий для запросов
+    conn = sqlite3.connect(db_path)
+    rnd = random.Random(1)
+    books = conn.execute("SELECT library_id, book_id FROM books WHERE quantity > 0 ORDER BY random() LIMIT ?",
+                         (count,)).fetchall()
+    readers = [row[0] for row in conn.execute("SELECT reader_id FROM readers ORDER BY random() LIMIT ?",
+                                              (count,))]
+    words = sorted({word for (title,) in conn.execute("SELECT title FROM books LIMIT ?", (count,))
+                    for word in title.split() if len(word) >= 4})
+    surnames = sorted({name.split()[0] for (name,) in conn.execute("SELECT full_name FROM readers LIMIT ?",
+                                                                   (count,))})
+    conn.close()
+    return rnd, books, readers, words, surnames
+
+
+class Client:
+    # Одно соединение keep-alive; запросы по очереди, как у киоска
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+        self.etags = {}
+
+    async def request(self, method, path, body=None, conditional=False):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = b"" if body is None else json.dumps(body).encode("utf-8")
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(payload)}"]
+        if conditional and path in self.etags:
+            lines.append(f"If-None-Match: {self.etags[path]}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if "etag" in headers:
+            self.etags[path] = headers["etag"]
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def client_loop(host, port, data, mix, deadline, results):
+    rnd, books, readers, words, surnames = data
+    kinds = [kind for kind, _ in mix]
+    weights = [weight for _, weight in mix]
+    client = Client(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            kind = rnd.choices(kinds, weights)[0]
+            started = time.perf_counter()
+            if kind == "books_search":
+                query = urllib.parse.urlencode({"q": rnd.choice(words), "limit": 20})
+                statuses = [await client.request("GET", "/books?" + query)]
+            elif kind == "book":
+                library_id, book_id = rnd.choice(books)
+                statuses = [await client.request("GET", f"/books/{library_id}/{book_id}", conditional=True)]
+            elif kind == "readers_search":
+                query = urllib.parse.urlencode({"q": rnd.choice(surnames), "limit": 20})
+                statuses = [await client.request("GET", "/readers?" + query)]
+            elif kind == "reader":
+                statuses = [await client.request("GET", f"/readers/{rnd.choice(readers)}", conditional=True)]
+            else:
+                library_id, book_id = rnd.choice(books)
+                loan = {"library_id": library_id, "book_id": book_id, "reader_id": rnd.choice(readers)}
+                statuses = [await client.request("POST", "/loans", loan)]
+                if statuses[0] == 201:
+                    statuses.append(await client.request("POST", "/loans/return", loan))
+            results.append((kind, time.perf_counter() - started, statuses))
+    finally:
+        client.close()
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def report(results, elapsed):
+    requests = sum(len(statuses) for _, _, statuses in results)
+    statuses = [status for _, _, group in results for status in group]
+    errors = sum(1 for status in statuses if status >= 500)
+    print(f"{requests} запросов за {elapsed:.1f} с: {requests / elapsed:.0f} запросов/с, "
+          f"304: {statuses.count(304) / max(requests, 1):.0%}, ошибок 5xx: {errors}")
+    print(f"{'':16} {'запросов':>9} {'p50, мс':>9} {'p99, мс':>9}")
+    summary = {"rps": round(requests / elapsed, 1), "not_modified": statuses.count(304), "errors": errors}
+    for kind, _ in MIX + (("всего", 0),):
+        times = [seconds for name, seconds, _ in results if kind in (name, "всего")]
+        p50, p99 = percentile(times, 0.5) * 1000, percentile(times, 0.99) * 1000
+        print(f"{kind:16} {len(times):9} {p50:9.2f} {p99:9.2f}")
+        summary[kind] = {"count": len(times), "p50_ms": round(p50, 2), "p99_ms": round(p99, 2)}
+    return summary
+
+
+async def load(host, port, data, mix, clients, duration):
+    results = []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(host, port, data, mix, deadline, results) for _ in range(clients)))
+    return results, time.perf_counter() - started
+
+
+def start_server(db_path, readers, group_commit=False):
+    # Сервер на свободном порту; адрес - из строки "API: http://host:port/"
+    command = [sys.executable, "-m", "db.api", "--db", db_path, "--port", "0",
+               "--readers", str(readers), "--no-profiling"]
+    if group_commit:
+        command.append("--group-commit")
+    process = subprocess.Popen(command, cwd=ROOT_DIR, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("API: "):
+        process.kill()
+        raise SystemExit("Сервер API не запустился")
+    url = urllib.parse.urlsplit(line.split()[1])
+    return process, url.hostname, url.port
+
+
+def run(db_path, clients=CLIENTS, duration=DURATION, readers=4, url=None, writes=True, group_commit=False):
+    # writes=False - без выдач: данные не меняются, повторные запросы карточек получают 304
+    data = sample(db_path)
+    mix = MIX if writes else tuple(item for item in MIX if item[0] != "loan")
+    process = None
+    if url:
+        url = urllib.parse.urlsplit(url)
+        host, port = url.hostname, url.port
+    else:
+        process, host, port = start_server(db_path, readers, group_commit)
+    try:
+        results, elapsed = asyncio.run(load(host, port, data, mix, clients, duration))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    print(f"{clients} клиентов, {duration:.0f} с" + ("" if writes else ", без выдач"))
+    return report(results, elapsed)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка HTTP/JSON API")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--db", help="база (по умолчанию - копия bench/data/books_<rows>.db)")
+    parser.add_argument("--url", help="адрес запущенного сервера; --db - та же база, для выбора запросов")
+    parser.add_argument("--clients", type=int, default=CLIENTS)
+    parser.add_argument("--duration", type=float, default=DURATION)
+    parser.add_argument("--readers", type=int, default=4, help="потоков чтения сервера")
+    parser.add_argument("--no-writes", action="store_true", help="только чтение (без выдач и возвратов)")
+    parser.add_argument("--group-commit", action="store_true", help="сервер с очередью записи (db/write_queue.py)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_path = args.db
+    temp_dir = None
+    if db_path is None:
+        source = os.path.join(DATA_DIR, f"books_{args.rows}.db")
+        if not os.path.exists(source):
+            os.makedirs(DATA_DIR, exist_ok=True)
+            print(f"Генерация {source} ...")
+            datagen.generate(source, args.rows)
+        temp_dir = tempfile.mkdtemp(prefix="api_load_")
+        db_path = os.path.join(temp_dir, "library.db")
+        # backup, а не копия файла: в копию попадут и страницы из WAL
+        with sqlite3.connect(source) as src, sqlite3.connect(db_path) as dst:
+            src.backup(dst)
+    try:
+        run(db_path, args.clients, args.duration, args.readers, args.url, not args.no_writes,
+            args.group_commit)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
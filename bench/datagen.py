@@ -0,0 +1,182 @@
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+from array import array
+from itertools import accumulate
+
+from db import init_db, migrations
+
+# Синтетическая база с реалистичными распределениями:
+# популярность авторов, издательств и книг - по закону Ципфа,
+# размеры филиалов неравные, большинство выдач давно возвращено.
+
+BATCH_SIZE = 50000
+
+WORDS = (
+    "война мир история жизнь время любовь путь дом город море лес ночь день свет "
+    "тайна тень сердце душа слово память дорога звезда река земля небо огонь ветер "
+    "книга сад остров берег страна люди герой мастер капитан доктор сказка песня "
+    "закон право экономика физика химия математика биология медицина техника "
+    "программирование алгоритмы данные системы сети философия психология искусство "
+    "музыка театр кино поэзия проза рассказы повести очерки письма дневник "
+    "последний первый новый старый тихий белый чёрный красный золотой далёкий"
+).split()
+
+SURNAMES = (
+    "Иванов Петров Сидоров Смирнов Кузнецов Попов Васильев Соколов Михайлов Новиков "
+    "Фёдоров Морозов Волков Алексеев Лебедев Семёнов Егоров Павлов Козлов Степанов "
+    "Николаев Орлов Андреев Макаров Никитин Захаров Зайцев Соловьёв Борисов Яковлев"
+).split()
+
+INITIALS = "АБВГДЕЖЗИКЛМНОПРСТУФЭЮЯ"
+
+PLACES = ("Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань",
+          "Нижний Новгород", "Самара", "Ростов-на-Дону", "Минск", "Киев")
+
+THEMES = ("Художественная литература", "Детская литература", "История", "Философия",
+          "Психология", "Экономика", "Право", "Математика", "Физика", "Химия", "Биология",
+          "Медицина", "Техника", "Информатика", "Искусство", "Музыка", "Языкознание",
+          "Справочники", "Путешествия", "Кулинария")
+
+TODAY = datetime.date(2025, 1, 1)
+
+
+def zipf_weights(n, s=1.1):
+    return list(accumulate(1.0 / (k ** s) for k in range(1, n + 1)))
+
+
+def person_name(rnd):
+    return (f"{rnd.choice(SURNAMES)} {rnd.choice(INITIALS)}.{rnd.choice(INITIALS)}."
+            + ("" if rnd.random() < 0.7 else f" {rnd.randint(1, 999)}"))
+
+
+def title(rnd):
+    words = rnd.sample(WORDS, rnd.choice((1, 2, 2, 3, 3, 4)))
+    text = " ".join(words).capitalize()
+    return text if rnd.random() < 0.8 else f"{text}. Том {rnd.randint(1, 5)}"
+
+
+def _insert_batches(conn, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+    conn.commit()
+
+
+def generate(path, books, readers=None, subscriptions=None, libraries=20, seed=1, log=print):
+    readers = readers if readers is not None else max(books // 5, 10)
+    subscriptions = subscriptions if subscriptions is not None else books * 2
+    rnd = random.Random(seed)
+    started = time.perf_counter()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    # Сначала таблицы без индексов и триггеров: данные согласованы генератором,
+    # а индексы дешевле построить один раз после загрузки
+    init_db.create_schema(conn)
+
+    _insert_batches(conn, "INSERT INTO libraries (library_id, name, address) VALUES (?, ?, ?)",
+                    ((i, f"Филиал №{i}", f"{rnd.choice(PLACES)}, ул. {rnd.choice(WORDS).capitalize()}, {i}")
+                     for i in range(1, libraries + 1)))
+    _insert_batches(conn, "INSERT INTO themes (theme_id, name) VALUES (?, ?)",
+                    ((i, name) for i, name in enumerate(THEMES, 1)))
+    _insert_batches(conn, "INSERT INTO readers (reader_id, full_name, address, phone) VALUES (?, ?, ?, ?)",
+                    ((i, person_name(rnd), f"{rnd.choice(PLACES)}, д. {rnd.randint(1, 200)}",
+                      f"+7{9000000000 + i}") for i in range(1, readers + 1)))
+    log(f"справочники и читатели: {time.perf_counter() - started:.1f} с")
+
+    # Книги: филиал (крупные филиалы получают больше книг) и число экземпляров
+    library_of = array("H", rnd.choices(range(1, libraries + 1), cum_weights=zipf_weights(libraries, 0.8), k=books))
+    copies = array("B", (min(1 + int(rnd.expovariate(0.7)), 20) for _ in range(books)))
+    on_loan = array("B", bytes(books))
+
+    # Выдачи: популярные книги берут чаще; 90% давно возвращены
+    def subscription_rows():
+        for _ in range(subscriptions):
+            i = int(books * rnd.random() ** 3)
+            issue = TODAY - datetime.timedelta(days=rnd.randint(0, 3 * 365))
+            return_date = (issue + datetime.timedelta(days=rnd.randint(1, 60))).isoformat()
+            if rnd.random() < 0.1 and on_loan[i] < copies[i]:
+                on_loan[i] += 1
+                return_date = None
+            yield (library_of[i], i + 1, rnd.randint(1, readers), issue.isoformat(),
+                   return_date, round(rnd.choice((0, 0, 0, 50, 100, 200)), 2))
+
+    _insert_batches(conn, """
+        INSERT OR IGNORE INTO subscriptions (library_id, book_id, reader_id, issue_date, return_date, advance)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, subscription_rows())
+    log(f"выдачи: {time.perf_counter() - started:.1f} с")
+
+    # book_id = номер книги в общей нумерации: уникален и внутри филиала
+    authors = [person_name(rnd) for _ in range(max(books // 20, 50))]
+    author_weights = zipf_weights(len(authors))
+    publishers = [f"Издательство «{rnd.choice(WORDS).capitalize()} {k}»" for k in range(1, 501)]
+    publisher_weights = zipf_weights(len(publishers))
+    # Книги ссылаются на справочник publishers по коду (номер в списке)
+    _insert_batches(conn, "INSERT INTO publishers (publisher_id, name) VALUES (?, ?)",
+                    enumerate(publishers, 1))
+    theme_weights = zipf_weights(len(THEMES), 0.7)
+
+    def book_rows():
+        for i in range(books):
+            yield (library_of[i], i + 1,
+                   rnd.choices(range(1, len(THEMES) + 1), cum_weights=theme_weights)[0],
+                   rnd.choices(authors, cum_weights=author_weights)[0],
+                   title(rnd),
+                   rnd.choices(range(1, len(publishers) + 1), cum_weights=publisher_weights)[0],
+                   rnd.choice(PLACES),
+                   min(2024, int(rnd.triangular(1900, 2025, 2015))),
+                   copies[i] - on_loan[i])
+
+    _insert_batches(conn, """
+        INSERT INTO books (library_id, book_id, theme_id, author, title, publisher_id,
+                           publish_place, publish_year, quantity)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, book_rows())
+    log(f"книги: {time.perf_counter() - started:.1f} с")
+
+    init_db.create_indexes(conn)
+    init_db.create_triggers(conn)
+    init_db.create_views(conn)
+    init_db.rebuild_search_index(conn)
+    init_db.rebuild_stats(conn)
+    migrations.migrate(conn, log=lambda _: None)   # схема уже новая: только user_version
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+    log(f"индексы: {time.perf_counter() - started:.1f} с")
+    return path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Генерация синтетической базы библиотеки")
+    parser.add_argument("path")
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--readers", type=int)
+    parser.add_argument("--subscriptions", type=int)
+    parser.add_argument("--libraries", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    generate(args.path, args.books, args.readers, args.subscriptions, args.libraries, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from bench import datagen
+from db import connection
+from db.connection import immediate
+from db.write_queue import MAX_DELAY_MS, SYNCHRONOUS_LEVELS, WriteQueue
+
+# Записей в секунду: commit на каждое сохранение против очереди записи с
+# групповым commit (db/write_queue.py) при разных PRAGMA synchronous.
+# Операция - сохранение карточки читателя (INSERT в readers, как ReadersForm).
+#   по одной   - THREADS потоков, у каждого своё соединение и commit на запись;
+#   очередь    - THREADS потоков ставят запись в очередь и ждут её future
+#                (клерки, каждый ждёт подтверждения);
+#   очередь, пакет - один поток ставит все записи и ждёт всех (массовые операции).
+# Каждый прогон - на свежей копии базы.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+THREADS = 8
+PER_THREAD = 250
+
+
+def save_reader(conn, n):
+    conn.execute("INSERT INTO readers (full_name, address, phone) VALUES (?, ?, ?)",
+                 (f"Очередев О.О. {n}", "Москва", f"+7800{n:07d}"))
+
+
+def run_threads(threads, per_thread, work, open_conn=lambda: None):
+    # work(соединение потока или None, номер записи); возвращает секунды
+    start = threading.Barrier(threads + 1)
+
+    def worker(t):
+        conn = open_conn()
+        start.wait()
+        for i in range(per_thread):
+            work(conn, t * per_thread + i)
+        if conn is not None:
+            conn.close()
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def direct(db_path, synchronous, threads, per_thread):
+    def open_conn():
+        conn = connection.connect(db_path)
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+        return conn
+
+    def work(conn, n):
+        with immediate(conn):
+            save_reader(conn, n)
+    return run_threads(threads, per_thread, work, open_conn), threads * per_thread
+
+
+def queued(db_path, synchronous, threads, per_thread, max_delay_ms):
+    write_queue = WriteQueue(db_path, max_delay_ms, synchronous=synchronous)
+    seconds = run_threads(threads, per_thread, lambda conn, n: write_queue.submit(save_reader, n).result())
+    write_queue.close()
+    return seconds, write_queue.commits
+
+
+def queued_bulk(db_path, synchronous, threads, per_thread, max_delay_ms):
+    write_queue = WriteQueue(db_path, max_delay_ms, synchronous=synchronous)
+    started = time.perf_counter()
+    futures = [write_queue.submit(save_reader, n) for n in range(threads * per_thread)]
+    for future in futures:
+        future.result()
+    seconds = time.perf_counter() - started
+    write_queue.close()
+    return seconds, write_queue.commits
+
+
+MODES = (
+    ("по одной", lambda db, sync, args: direct(db, sync, args.threads, args.per_thread)),
+    ("очередь", lambda db, sync, args: queued(db, sync, args.threads, args.per_thread, args.delay_ms)),
+    ("очередь, пакет", lambda db, sync, args: queued_bulk(db, sync, args.threads, args.per_thread,
+                                                          args.delay_ms)),
+)
+
+
+def copy_db(source, target):
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+
+
+def run(source, args):
+    total = args.threads * args.per_thread
+    print(f"{total} сохранений, {args.threads} потоков, ожидание группы {args.delay_ms} мс")
+    print(f"{'synchronous':12} {'режим':16} {'записей/с':>10} {'commit':>7} {'записей/commit':>15}")
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="group_commit_") as temp_dir:
+        for synchronous in args.synchronous:
+            for name, mode in MODES:
+                db_path = os.path.join(temp_dir, f"{synchronous}_{len(results)}.db")
+                copy_db(source, db_path)
+                seconds, commits = mode(db_path, synchronous, args)
+                rate = total / seconds
+                results[(synchronous, name)] = rate
+                print(f"{synchronous:12} {name:16} {rate:10.0f} {commits:7} {total / commits:15.1f}")
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Групповой commit: записей в секунду")
+    parser.add_argument("--db", help="исходная база (по умолчанию bench/data/books_10000.db)")
+    parser.add_argument("--threads", type=int, default=THREADS)
+    parser.add_argument("--per-thread", type=int, default=PER_THREAD)
+    parser.add_argument("--delay-ms", type=float, default=MAX_DELAY_MS, help="ожидание попутчиков группы, мс")
+    parser.add_argument("--synchronous", nargs="+", choices=SYNCHRONOUS_LEVELS, default=["NORMAL", "FULL"])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    connection.PROFILING = False
+    source = args.db
+    if source is None:
+        source = os.path.join(DATA_DIR, "books_10000.db")
+        if not os.path.exists(source):
+            os.makedirs(DATA_DIR, exist_ok=True)
+            datagen.generate(source, 10000)
+    run(source, args)
+
+
+if __name__ == "__main__":
+    main()
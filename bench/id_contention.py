@@ -0,0 +1,65 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+from bench import datagen
+from books_form import BooksForm
+from db import connection
+
+# Проверка выдачи кодов книг под конкуренцией: несколько процессов одновременно
+# добавляют книги в одну библиотеку через BooksForm.write_book. Все коды должны
+# быть разными, а ни одна вставка - не упасть на PRIMARY KEY.
+
+
+def writer(db_path, library_id, count, start_event):
+    connection.configure(db_path)
+    start_event.wait()
+    ids = []
+    for i in range(count):
+        values = (None, "Конкурентов К.К.", f"Параллельная книга {os.getpid()}-{i}", None, None, None, 1,
+                  library_id, None)
+        ids.append(BooksForm.write_book(values, True))
+    return ids
+
+
+def run(db_path, processes, per_process, library_id=1):
+    manager = multiprocessing.Manager()
+    start_event = manager.Event()
+    with multiprocessing.Pool(processes) as pool:
+        results = [pool.apply_async(writer, (db_path, library_id, per_process, start_event))
+                   for _ in range(processes)]
+        started = time.perf_counter()
+        start_event.set()
+        ids = [book_id for result in results for book_id in result.get()]
+        elapsed = time.perf_counter() - started
+
+    total = processes * per_process
+    duplicates = total - len(set(ids))
+    print(f"{processes} процессов x {per_process} книг: {total} вставок за {elapsed:.2f} с "
+          f"({total / elapsed:.0f} вставок/с), повторов кодов: {duplicates}")
+    return duplicates == 0 and len(ids) == total
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Конкурентная выдача кодов книг")
+    parser.add_argument("--db", help="база (по умолчанию - новая синтетическая на 10000 книг)")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--per-process", type=int, default=200)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_path = args.db
+    if db_path is None:
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+        os.makedirs(data_dir, exist_ok=True)
+        db_path = os.path.join(data_dir, "id_contention.db")
+        datagen.generate(db_path, 10000, log=lambda _: None)
+    ok = run(db_path, args.processes, args.per_process)
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import os
+import re
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from bench import datagen
+from db import connection, migrations
+
+# Справочник издательств (миграция 3): размер базы и задержка фильтра по
+# издательству до и после. До - books.publisher TEXT без индекса, фильтр
+# WHERE publisher = ?; после - books.publisher_id с индексом
+# idx_books_publisher, фильтр WHERE publisher_id = ? (как BooksForm) и
+# старый запрос через представление books_compat. Запрос - первая страница
+# списка формы (ORDER BY title, library_id, book_id LIMIT PAGE) и число книг.
+# Издательства - самое частое, медианное и редкое (распределение Ципфа).
+# База старой схемы мигрирует на копии; база новой схемы (datagen) для
+# замера "до" переводится обратно на текстовый столбец.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+PAGE = 50
+REPEAT = 20
+COLUMNS = "library_id, book_id, theme_id, author, title, publish_place, publish_year, quantity"
+
+
+def copy_db(source, target):
+    # backup, а не копия файла: в копию попадут и страницы из WAL
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+
+
+def has_publisher_text(conn):
+    return "publisher" in [row[1] for row in conn.execute("PRAGMA table_info(books)")]
+
+
+def denormalize(conn):
+    # Обратно к схеме до миграции 3: издательство - текст в каждой книге.
+    # Триггеры и представления читают publisher_id - для замера они не нужны.
+    objects = conn.execute("""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE (type IN ('trigger', 'view') OR (type = 'index' AND tbl_name = 'books')) AND sql IS NOT NULL
+    """).fetchall()
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'books'").fetchone()[0]
+    sql = re.sub(r",\s*FOREIGN KEY \(publisher_id\)[^,)]*\([^)]*\)", "", sql)
+    sql = re.sub(r"publisher_id INTEGER", "publisher TEXT", sql).replace("CREATE TABLE books", "CREATE TABLE books_old", 1)
+    conn.execute("PRAGMA foreign_keys = OFF")
+    with conn:
+        for obj_type, name, _ in objects:
+            conn.execute(f"DROP {obj_type.upper()} IF EXISTS {name}")
+        conn.execute(sql)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(books_old)")]
+        conn.execute(f"""
+            INSERT INTO books_old ({', '.join(columns)})
+            SELECT {', '.join('p.name' if c == 'publisher' else 'b.' + c for c in columns)}
+            FROM books b LEFT JOIN publishers p ON p.publisher_id = b.publisher_id
+        """)
+        conn.execute("DROP TABLE books")
+        conn.execute("ALTER TABLE books_old RENAME TO books")
+        for obj_type, name, sql in objects:
+            if obj_type == "index" and name != "idx_books_publisher":
+                conn.execute(sql)
+        conn.execute("PRAGMA user_version = 2")
+
+
+def sizes(conn):
+    # После VACUUM: размер файла, таблица books и её индексы (dbstat), МБ
+    conn.execute("VACUUM")
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    total = conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+    indexes = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'books'")]
+    by_name = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+    index_size = sum(by_name.get(name, 0) for name in indexes) + by_name.get("sqlite_autoindex_books_1", 0)
+    return {"file": total / 2 ** 20, "books": by_name.get("books", 0) / 2 ** 20, "indexes": index_size / 2 ** 20}
+
+
+def sample_publishers(conn, column, source):
+    # Самое частое, медианное и редкое издательство: (значение для фильтра, книг)
+    counts = conn.execute(f"""
+        SELECT {column}, COUNT(*) AS n FROM {source} WHERE {column} IS NOT NULL
+        GROUP BY {column} ORDER BY n DESC, {column}
+    """).fetchall()
+    return {"частое": counts[0], "медианное": counts[len(counts) // 2], "редкое": counts[-1]}
+
+
+def latency(conn, source, condition, value, repeat=REPEAT):
+    # Медиана, мс: первая страница списка и число книг издательства
+    page = f"SELECT {COLUMNS} FROM {source} WHERE {condition} ORDER BY title, library_id, book_id LIMIT {PAGE}"
+    count = f"SELECT COUNT(*) FROM {source} WHERE {condition}"
+    result = []
+    for query in (page, count):
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(query, (value,)).fetchall()
+            times.append(time.perf_counter() - started)
+        result.append(statistics.median(times) * 1000)
+    return result
+
+
+def report(title, size, rows):
+    print(f"{title}: файл {size['file']:.1f} МБ, books {size['books']:.1f} МБ, индексы books {size['indexes']:.1f} МБ")
+    print(f"  {'издательство':14} {'книг':>8} {'страница, мс':>13} {'COUNT, мс':>10}")
+    for name, books, (page, count) in rows:
+        print(f"  {name:14} {books:8} {page:13.2f} {count:10.2f}")
+
+
+def run(source, repeat=REPEAT):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="publishers_") as temp_dir:
+        db_path = os.path.join(temp_dir, "library.db")
+        copy_db(source, db_path)
+        conn = connection.connect(db_path)
+        if not has_publisher_text(conn):
+            print("Схема уже новая: для замера \"до\" издательство возвращается в books текстом")
+            denormalize(conn)
+
+        size = sizes(conn)
+        sample = sample_publishers(conn, "publisher", "books")
+        rows = [(name, books, latency(conn, "books", "publisher = ?", value, repeat))
+                for name, (value, books) in sample.items()]
+        report("До (books.publisher TEXT)", size, rows)
+        results["before"] = (size, rows)
+
+        started = time.perf_counter()
+        migrations.migrate(conn, log=lambda _: None)
+        print(f"Миграция: {time.perf_counter() - started:.1f} с")
+        size = sizes(conn)
+        ids = dict(conn.execute("SELECT name, publisher_id FROM publishers"))
+        rows = [(name, books, latency(conn, "books_compat", "publisher_id = ?", ids[value], repeat))
+                for name, (value, books) in sample.items()]
+        report("После (books.publisher_id, idx_books_publisher)", size, rows)
+        results["after"] = (size, rows)
+        rows = [(name, books, latency(conn, "books_compat", "publisher = ?", value, repeat))
+                for name, (value, books) in sample.items()]
+        report("После, старый запрос через books_compat", size, rows)
+        results["compat"] = (size, rows)
+        conn.close()
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Справочник издательств: размер базы и фильтр по издательству")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--db", help="исходная база (по умолчанию bench/data/books_<rows>.db); не меняется")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    connection.PROFILING = False
+    source = args.db
+    if source is None:
+        source = os.path.join(DATA_DIR, f"books_{args.rows}.db")
+        if not os.path.exists(source):
+            os.makedirs(DATA_DIR, exist_ok=True)
+            datagen.generate(source, args.rows)
+    run(source, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import gc
+import os
+import random
+import sqlite3
+import time
+import tracemalloc
+
+from bench import datagen
+from books_form import BOOK_COLUMNS
+from db.row_store import RowStore
+
+# Память загруженных строк книг: список кортежей (fetchall, как раньше в
+# кэшах форм) против db.row_store.RowStore. Память - по tracemalloc: сколько
+# занимает результат (current) и пик во время загрузки (peak). Обход и
+# чтения по номеру - как при показе страниц и уточнении поиска.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def measure(load):
+    # Время - без tracemalloc (он замедляет выделение памяти в разы), память - отдельной загрузкой
+    gc.collect()
+    started = time.perf_counter()
+    rows = load()
+    elapsed = time.perf_counter() - started
+    del rows
+    gc.collect()
+    tracemalloc.start()
+    rows = load()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, current, peak, elapsed
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def run(db_path, limit):
+    conn = sqlite3.connect(db_path)
+    query = f"SELECT {', '.join(BOOK_COLUMNS)} FROM books_compat ORDER BY title, library_id, book_id LIMIT ?"
+    loaders = {
+        "кортежи (fetchall)": lambda: conn.execute(query, (limit,)).fetchall(),
+        "RowStore": lambda: RowStore.from_cursor(conn.execute(query, (limit,))),
+    }
+    print(f"{'':20} {'строк':>9} {'память, МБ':>11} {'пик, МБ':>9} {'байт/строку':>12} "
+          f"{'загрузка, с':>12} {'обход, с':>9} {'10^5 чтений, с':>15}")
+    results = {}
+    for name, load in loaders.items():
+        rows, current, peak, elapsed = measure(load)
+        rnd = random.Random(1)
+        indexes = [rnd.randrange(len(rows)) for _ in range(100000)]
+        scan = timed(lambda: sum(1 for _ in rows))
+        lookup = timed(lambda: [rows[i] for i in indexes])
+        results[name] = current
+        print(f"{name:20} {len(rows):9} {current / 2 ** 20:11.1f} {peak / 2 ** 20:9.1f} "
+              f"{current / max(len(rows), 1):12.1f} {elapsed:12.2f} {scan:9.2f} {lookup:15.3f}")
+        del rows
+    tuples, store = results.values()
+    print(f"RowStore меньше в {tuples / max(store, 1):.1f} раза")
+    conn.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Память загруженных строк: кортежи против RowStore")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--db", help="база (по умолчанию bench/data/books_<rows>.db, создаётся)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_path = args.db
+    if db_path is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        db_path = os.path.join(DATA_DIR, f"books_{args.rows}.db")
+        if not os.path.exists(db_path):
+            print(f"Генерация {db_path} ...")
+            datagen.generate(db_path, args.rows)
+    run(db_path, args.rows)
+
+
+if __name__ == "__main__":
+    main()
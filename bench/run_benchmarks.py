@@ -0,0 +1,463 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+
+from bench import datagen
+from books_form import BOOK_COLUMNS, BooksForm
+from db import circulation, connection, init_db, reports, search, snapshot, stats
+from db.book_ids import peek_next_book_id
+from db.record_source import RecordSource
+from db.reference import ReferenceData
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Каждый бенчмарк - функция(ctx, iterations) -> список длительностей одной операции (с).
+# Запросы берутся из тех же мест, что использует приложение: RecordSource,
+# db.search, статические методы записи форм.
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def timed(func, iterations):
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    return {
+        "iterations": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+        "median_ms": round(statistics.median(ordered) * 1000, 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+        "min_ms": round(ordered[0] * 1000, 4),
+        "ops_per_sec": round(len(ordered) / sum(ordered), 1) if sum(ordered) else None,
+    }
+
+
+class Context:
+    def __init__(self, db_path, seed=1):
+        self.db_path = db_path
+        self.rnd = random.Random(seed)
+        self.conn = connection.get_connection(db_path)
+        self.library_ids = [r[0] for r in self.conn.execute("SELECT library_id FROM libraries")]
+        self.book_keys = self.conn.execute(
+            "SELECT library_id, book_id FROM books WHERE quantity > 0 ORDER BY random() LIMIT 1000").fetchall()
+        self.reader_ids = [r[0] for r in self.conn.execute(
+            "SELECT reader_id FROM readers ORDER BY random() LIMIT 1000")]
+        self.titles = [r[0] for r in self.conn.execute("SELECT title FROM books ORDER BY random() LIMIT 100")]
+        self.publisher_id = self.conn.execute("SELECT MIN(publisher_id) FROM publishers").fetchone()[0]
+
+    def books_source(self):
+        return RecordSource("books_compat", BOOK_COLUMNS, ("title", "library_id", "book_id"))
+
+    def found_books_source(self):
+        return RecordSource(search.BOOKS_HITS, BOOK_COLUMNS + ("rank",), ("rank", "library_id", "book_id"))
+
+
+# ---------- Чтение (BooksForm / ReadersForm) ----------
+
+@benchmark("books_load_first_page")
+def bench_load(ctx, iterations):
+    source = ctx.books_source()
+    return timed(source.reset, iterations)
+
+
+@benchmark("books_next_500_records")
+def bench_next(ctx, iterations):
+    source = ctx.books_source()
+    source.reset()
+
+    def step():
+        for _ in range(500):
+            source.next()
+    return timed(step, iterations)
+
+
+@benchmark("books_last_page")
+def bench_last(ctx, iterations):
+    source = ctx.books_source()
+    source.reset()
+    return timed(source.last, iterations)
+
+
+@benchmark("books_count")
+def bench_count(ctx, iterations):
+    def count():
+        source = ctx.books_source()
+        source.count()
+    return timed(count, iterations)
+
+
+@benchmark("books_search_fts")
+def bench_search_fts(ctx, iterations):
+    source = ctx.found_books_source()
+    return timed(lambda: source.reset("", (search.match_phrase(ctx.rnd.choice(datagen.WORDS)),)), iterations)
+
+
+@benchmark("books_search_like_short")
+def bench_search_like(ctx, iterations):
+    # Запрос короче MIN_QUERY_LENGTH: BooksForm.search идёт через LIKE
+    source = ctx.books_source()
+    return timed(lambda: source.reset("title LIKE ?", ("%" + ctx.rnd.choice(datagen.WORDS)[:2] + "%",)),
+                 iterations)
+
+
+def _typing_prefixes(ctx):
+    title = ctx.rnd.choice(ctx.titles)
+    return [title[:i] for i in range(search.MIN_QUERY_LENGTH, len(title) + 1)]
+
+
+@benchmark("books_search_typing_uncached")
+def bench_typing_uncached(ctx, iterations):
+    # Живой поиск без кэша: запрос на каждую букву названия
+    source = RecordSource(search.BOOKS_HITS, BOOK_COLUMNS + ("rank",), ("rank", "library_id", "book_id"),
+                          page_size=search.RESULT_PAGE_SIZE)
+
+    def typing():
+        for text in _typing_prefixes(ctx):
+            source.reset("", (search.match_phrase(text),))
+    return timed(typing, iterations)
+
+
+@benchmark("books_search_typing_cached")
+def bench_typing_cached(ctx, iterations):
+    # То же через CachedSearch (как в BooksForm): уточнение отбирается в памяти
+    source = RecordSource(search.BOOKS_HITS, BOOK_COLUMNS + ("rank",), ("rank", "library_id", "book_id"),
+                          page_size=search.RESULT_PAGE_SIZE)
+    books_search = search.CachedSearch(source, "books", ("title", "author", "publisher"))
+
+    def typing():
+        search.cache.clear()
+        for text in _typing_prefixes(ctx):
+            books_search.run(text)
+    return timed(typing, iterations)
+
+
+@benchmark("readers_search_fts")
+def bench_search_readers(ctx, iterations):
+    source = RecordSource(search.READERS_HITS, ("reader_id", "full_name", "address", "phone", "rank"),
+                          ("rank", "reader_id"))
+    return timed(lambda: source.reset("", (search.match_phrase(ctx.rnd.choice(datagen.SURNAMES)),)),
+                 iterations)
+
+
+@benchmark("books_next_id")
+def bench_next_id(ctx, iterations):
+    # Подсказка кода в BooksForm.get_next_book_id
+    return timed(lambda: peek_next_book_id(ctx.conn, ctx.rnd.choice(ctx.library_ids)), iterations)
+
+
+@benchmark("reference_lookup_cached")
+def bench_reference(ctx, iterations):
+    # Показ записи в BooksForm: проверка актуальности справочников и поиск по id
+    registry = ReferenceData(ctx.db_path)
+    registry.refresh()
+
+    def lookup():
+        registry.libraries.index_of(ctx.rnd.choice(ctx.library_ids))
+        registry.themes.id_of("")
+    return timed(lookup, iterations)
+
+
+@benchmark("stats_library_lookup")
+def bench_stats_lookup(ctx, iterations):
+    # Панель статистики: строка сводной таблицы по ключу
+    return timed(lambda: stats.library_stats(ctx.conn, ctx.rnd.choice(ctx.library_ids)), iterations)
+
+
+@benchmark("stats_recompute_group_by")
+def bench_stats_recompute(ctx, iterations):
+    # Для сравнения: те же счётчики по всем библиотекам через GROUP BY по данным
+    return timed(lambda: ctx.conn.execute(init_db.stats_query("library_id")).fetchall(), iterations)
+
+
+# ---------- Запись ----------
+
+def _book_values(ctx, library_id, book_id):
+    return (1, "Бенчмарков Б.Б.", "Тестовая книга " + ctx.rnd.choice(datagen.WORDS), ctx.publisher_id,
+            "Москва", 2020, 3, library_id, book_id)
+
+
+@benchmark("books_save_insert_update_delete")
+def bench_save(ctx, iterations):
+    library_id = ctx.library_ids[0]
+    base = ctx.conn.execute("SELECT MAX(book_id) FROM books").fetchone()[0] + 1000
+    counter = iter(range(base, base + iterations))
+
+    def save_cycle():
+        book_id = next(counter)
+        BooksForm.write_book(_book_values(ctx, library_id, book_id))   # INSERT
+        BooksForm.write_book(_book_values(ctx, library_id, book_id))   # UPDATE
+        BooksForm.remove_book((library_id, book_id))
+    return timed(save_cycle, iterations)
+
+
+@benchmark("books_save_new_allocated_id")
+def bench_save_new(ctx, iterations):
+    # Новая книга без кода: book_id выдаёт счётчик библиотеки в транзакции INSERT
+    library_id = ctx.library_ids[-1]
+
+    def save_new():
+        book_id = BooksForm.write_book(_book_values(ctx, library_id, None), True)
+        BooksForm.remove_book((library_id, book_id))
+    return timed(save_new, iterations)
+
+
+@benchmark("subscriptions_issue_return_triggers")
+def bench_issue_return(ctx, iterations):
+    # INSERT и UPDATE return_date запускают триггеры изменения books.quantity
+    issued = []
+
+    def issue_return():
+        library_id, book_id = ctx.rnd.choice(ctx.book_keys)
+        key = (library_id, book_id, ctx.rnd.choice(ctx.reader_ids),
+               "2099-01-01T" + str(len(issued)))
+        with ctx.conn:
+            ctx.conn.execute("""
+                INSERT INTO subscriptions (library_id, book_id, reader_id, issue_date)
+                VALUES (?, ?, ?, ?)
+            """, key)
+        with ctx.conn:
+            ctx.conn.execute("""
+                UPDATE subscriptions SET return_date = '2099-02-01'
+                WHERE library_id=? AND book_id=? AND reader_id=? AND issue_date=?
+            """, key)
+        issued.append(key)
+
+    durations = timed(issue_return, iterations)
+    _delete_loans(ctx, issued)
+    return durations
+
+
+@benchmark("circulation_issue_return")
+def bench_circulation(ctx, iterations):
+    # Выдача и возврат через db.circulation: проверка остатка и запись
+    # в одной транзакции BEGIN IMMEDIATE на каждую операцию
+    issued = []
+
+    def issue_return():
+        library_id, book_id = ctx.rnd.choice(ctx.book_keys)
+        reader_id = ctx.rnd.choice(ctx.reader_ids)
+        issue_date = "2099-01-01T" + str(len(issued))
+        circulation.issue(ctx.conn, library_id, book_id, reader_id, issue_date=issue_date)
+        circulation.return_book(ctx.conn, library_id, book_id, reader_id, "2099-02-01")
+        issued.append((library_id, book_id, reader_id, issue_date))
+
+    durations = timed(issue_return, iterations)
+    _delete_loans(ctx, issued)
+    return durations
+
+
+@benchmark("circulation_issue_100_return_batch")
+def bench_circulation_batch(ctx, iterations):
+    # 100 выдач по одной и возврат всех одним пакетом (return_many)
+    issued = []
+
+    def issue_batch():
+        loans = []
+        for _ in range(100):
+            library_id, book_id = ctx.rnd.choice(ctx.book_keys)
+            reader_id = ctx.rnd.choice(ctx.reader_ids)
+            issue_date = "2099-01-01T" + str(len(issued))
+            try:
+                circulation.issue(ctx.conn, library_id, book_id, reader_id, issue_date=issue_date)
+            except circulation.CirculationError:
+                continue   # все экземпляры уже выданы в этом пакете
+            loans.append((library_id, book_id, reader_id))
+            issued.append((library_id, book_id, reader_id, issue_date))
+        circulation.return_many(ctx.conn, loans, "2099-02-01")
+
+    durations = timed(issue_batch, iterations)
+    _delete_loans(ctx, issued)
+    return durations
+
+
+def _delete_loans(ctx, loans):
+    with ctx.conn:
+        ctx.conn.executemany("""
+            DELETE FROM subscriptions WHERE library_id=? AND book_id=? AND reader_id=? AND issue_date=?
+        """, loans)
+
+
+# ---------- Снимок для отчётов ----------
+
+@benchmark("snapshot_refresh_unchanged")
+def bench_snapshot_unchanged(ctx, iterations):
+    # Проверка PRAGMA data_version: база не менялась - копирования нет
+    reports = snapshot.Snapshot(ctx.db_path, "backup", snapshot_path=ctx.db_path + ".bench-snapshot")
+    reports.refresh()
+    durations = timed(reports.refresh, iterations)
+    _close_snapshot(reports)
+    return durations
+
+
+@benchmark("snapshot_refresh_backup")
+def bench_snapshot_backup(ctx, iterations):
+    # Полное копирование базы online backup API
+    reports = snapshot.Snapshot(ctx.db_path, "backup", snapshot_path=ctx.db_path + ".bench-snapshot")
+    durations = timed(lambda: reports.refresh(force=True), max(1, iterations // 10))
+    _close_snapshot(reports)
+    return durations
+
+
+def _close_snapshot(reports):
+    connection.close_connection(reports.read_path)
+    reports.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(reports.snapshot_path + suffix):
+            os.remove(reports.snapshot_path + suffix)
+
+
+# ---------- Отчёты (db/reports.py) ----------
+# Тяжёлые запросы по всей таблице выдач - десятая часть итераций
+
+def _drain(ctx, report):
+    return sum(len(rows) for rows in reports.stream(ctx.conn, report))
+
+
+@benchmark("reports_overdue")
+def bench_reports_overdue(ctx, iterations):
+    return timed(lambda: _drain(ctx, reports.overdue_report(datagen.TODAY)), max(1, iterations // 10))
+
+
+@benchmark("reports_reader_history")
+def bench_reports_history(ctx, iterations):
+    return timed(lambda: _drain(ctx, reports.history_report(ctx.rnd.choice(ctx.reader_ids), datagen.TODAY)),
+                 iterations)
+
+
+@benchmark("reports_trends_library_month")
+def bench_reports_trends_library(ctx, iterations):
+    return timed(lambda: _drain(ctx, reports.trends_report("library", "month")), max(1, iterations // 10))
+
+
+@benchmark("reports_trends_theme_week")
+def bench_reports_trends_theme(ctx, iterations):
+    return timed(lambda: _drain(ctx, reports.trends_report("theme", "week")), max(1, iterations // 10))
+
+
+# ---------- Время запуска приложения ----------
+
+def startup_time(db_path):
+    # app.py --startup-time в отдельном процессе: импорт, первая отрисовка окна,
+    # первая форма (мс от начала импорта app.py) и весь процесс целиком.
+    # Для сравнения - импорт books_form, с которого начинался прежний запуск.
+    started = time.perf_counter()
+    app = subprocess.run([sys.executable, os.path.join(ROOT_DIR, "app.py"), "--db", db_path, "--startup-time"],
+                         capture_output=True, text=True, cwd=ROOT_DIR)
+    process_ms = round((time.perf_counter() - started) * 1000, 1)
+    lines = app.stdout.strip().splitlines()
+    startup = json.loads(lines[-1]) if app.returncode == 0 and lines else {"error": app.stderr.strip()[-300:]}
+    startup["process_ms"] = process_ms
+    legacy = subprocess.run([sys.executable, "-c", "import time; started = time.perf_counter(); import books_form; "
+                             "print((time.perf_counter() - started) * 1000)"],
+                            capture_output=True, text=True, cwd=ROOT_DIR)
+    if legacy.returncode == 0:
+        startup["books_form_import_ms"] = round(float(legacy.stdout), 1)
+    return startup
+
+
+# ---------- Запуск ----------
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(DATA_DIR)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(db_path, iterations=50, only=None, seed=1):
+    connection.configure(db_path)
+    ctx = Context(db_path, seed)
+    meta = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "db": os.path.basename(db_path),
+        "rows": {table: ctx.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                 for table in ("books", "readers", "subscriptions")},
+        "iterations": iterations,
+        "profiling": connection.PROFILING,
+    }
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if only and only not in name:
+            continue
+        results[name] = summarize(func(ctx, iterations))
+        print(f"{name:40} {results[name]['median_ms']:10.3f} мс (медиана)")
+    startup = startup_time(db_path)
+    for name, value in startup.items():
+        print(f"startup.{name:32} {value:10} мс" if name != "error" else f"startup: {value}")
+    return {"meta": meta, "results": results, "startup": startup}
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    print(f"\nСравнение с {baseline_path} (медиана, было -> стало):")
+    for name, stats in current["results"].items():
+        if name in baseline:
+            before, after = baseline[name]["median_ms"], stats["median_ms"]
+            ratio = after / before if before else float("inf")
+            mark = "  <-- медленнее" if ratio > 1.2 else ""
+            print(f"{name:40} {before:10.3f} -> {after:10.3f} мс  x{ratio:.2f}{mark}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарки запросов приложения на синтетической базе")
+    parser.add_argument("--books", type=int, default=10000, help="размер синтетической базы")
+    parser.add_argument("--db", help="готовая база (по умолчанию bench/data/books_<N>.db, создаётся)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--only", help="запускать только бенчмарки, имя которых содержит строку")
+    parser.add_argument("--out", help="записать результаты в JSON-файл")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-profiling", action="store_true",
+                        help="соединения без профилировщика (оценка его накладных расходов через --compare)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    connection.PROFILING = not args.no_profiling
+    db_path = args.db
+    if db_path is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        db_path = os.path.join(DATA_DIR, f"books_{args.books}.db")
+        if not os.path.exists(db_path):
+            print(f"Генерация {db_path} ...")
+            datagen.generate(db_path, args.books, seed=args.seed)
+    report = run(db_path, args.iterations, args.only, args.seed)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,57 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import sqlite3
 
-DB_PATH = "db/library.db"
+from db import batch, dedup, search, shards, snapshot
+from db.book_ids import allocate_book_ids, peek_next_book_id
+from db.connection import immediate
+from db.executor import QueryExecutor
+from db.reference import copy_publisher, publisher_id, registry
+from form.live_search import LiveSearch
+from form import diagnostics_form
+from form.record_grid import RecordGrid
+
+# Столбцы books_compat: издательство - наименованием, publisher_id - для фильтра
+BOOK_COLUMNS = ("library_id", "book_id", "theme_id", "author", "title",
+                "publisher", "publish_place", "publish_year", "quantity", "publisher_id")
+
+BOOK_GRID_COLUMNS = (
+    ("library_id", "Библ.", 50), ("book_id", "Код", 60), ("author", "Автор", 160),
+    ("title", "Название", 220), ("publisher", "Издательство", 140),
+    ("publish_year", "Год", 50), ("quantity", "Кол-во", 60),
+)
 
 class BooksForm(tk.Frame):
     def __init__(self, master):
         super().__init__(master)
-        self.conn = sqlite3.connect(DB_PATH)
-        self.cursor = self.conn.cursor()
-
-        self.books = []
-        self.index = 0
+        # Книги читаются и пишутся через маршрутизатор: при раздельном хранении
+        # (db/shards.py) - в файле библиотеки, список - по всем файлам сразу
+        self.router = shards.get_router()
+
+        self.all_books = self.router.source("books_compat", BOOK_COLUMNS, ("title", "library_id", "book_id"))
+        self.found_books = self.router.source(search.BOOKS_HITS, BOOK_COLUMNS + ("rank",),
+                                              ("rank", "library_id", "book_id"), page_size=search.RESULT_PAGE_SIZE)
+        self.book_search = search.CachedSearch(self.found_books, "books", ("title", "author", "publisher"))
+        self.books = self.all_books
         self.current_key = None  # (library_id, book_id)
+        self.suggested_book_id = None  # код, показанный при добавлении книги
 
-        self.libraries = []
-        self.themes = []
+        self.libraries = None  # справочники из db.reference (Lookup)
+        self.themes = None
+        self.publishers = None
 
-        self.load_libraries()
-        self.load_themes()
+        self.grid_visible = False
+        self.last_batch = None  # db.batch.Batch для отмены
+        self.executor = QueryExecutor(self, on_busy=self.set_busy)
         self.create_widgets()
+        # Справочники и первая страница читаются в фоне: окно показывается сразу
+        self.executor.submit(registry.refresh, callback=lambda _: self.refresh_reference(),
+                             errback=self.show_db_error)
         self.load_books()
         self.show_record()
 
     def create_widgets(self):
         tk.Label(self, text="Библиотека:").grid(row=0, column=0, sticky="e")
-        self.library_cb = ttk.Combobox(self, values=[f"{lib[1]} (ID:{lib[0]})" for lib in self.libraries], state="readonly")
+        self.library_cb = ttk.Combobox(self, state="readonly", postcommand=self.refresh_reference)
         self.library_cb.grid(row=0, column=1, sticky="w")
         self.library_cb.bind("<<ComboboxSelected>>", self.on_library_change)
 
@@ -34,7 +60,7 @@ class BooksForm(tk.Frame):
         self.entry_book_id.grid(row=1, column=1, sticky="w")
 
         tk.Label(self, text="Тематика:").grid(row=2, column=0, sticky="e")
-        self.theme_cb = ttk.Combobox(self, values=[t[1] for t in self.themes], state="readonly")
+        self.theme_cb = ttk.Combobox(self, state="readonly", postcommand=self.refresh_reference)
         self.theme_cb.grid(row=2, column=1, sticky="w")
 
         tk.Label(self, text="Автор:").grid(row=3, column=0, sticky="e")
@@ -45,9 +71,10 @@ class BooksForm(tk.Frame):
         self.entry_title = tk.Entry(self, width=40)
         self.entry_title.grid(row=4, column=1, columnspan=3, sticky="w")
 
+        # Список - справочник издательств; новое наименование добавляется в него при сохранении
         tk.Label(self, text="Издательство:").grid(row=5, column=0, sticky="e")
-        self.entry_publisher = tk.Entry(self, width=30)
-        self.entry_publisher.grid(row=5, column=1, sticky="w")
+        self.publisher_cb = ttk.Combobox(self, width=28, postcommand=self.refresh_reference)
+        self.publisher_cb.grid(row=5, column=1, sticky="w")
 
         tk.Label(self, text="Место издания:").grid(row=5, column=2, sticky="e")
         self.entry_publish_place = tk.Entry(self, width=20)
@@ -67,6 +94,10 @@ class BooksForm(tk.Frame):
         tk.Button(nav_frame, text="<", command=self.prev_record).pack(side="left")
         tk.Button(nav_frame, text=">", command=self.next_record).pack(side="left")
         tk.Button(nav_frame, text=">>", command=self.last_record).pack(side="left")
+        # Табличный режим сортирует и листает через OFFSET одну базу - при
+        # раздельном хранении недоступен
+        tk.Button(nav_frame, text="Таблица", command=self.toggle_grid,
+                  state="disabled" if self.router.sharded else "normal").pack(side="left", padx=10)
 
         btn_frame = tk.Frame(self)
         btn_frame.grid(row=8, column=0, columnspan=4, pady=10)
@@ -76,52 +107,128 @@ class BooksForm(tk.Frame):
 
         search_frame = tk.Frame(self)
         search_frame.grid(row=9, column=0, columnspan=4, pady=10)
-        tk.Label(search_frame, text="Поиск по названию:").pack(side="left")
+        tk.Label(search_frame, text="Поиск (название, автор, издательство):").pack(side="left")
         self.search_title = tk.Entry(search_frame, width=20)
         self.search_title.pack(side="left", padx=5)
-        tk.Button(search_frame, text="Найти", command=self.search).pack(side="left")
-        tk.Button(search_frame, text="Сбросить фильтр", command=self.load_books).pack(side="left", padx=10)
-
-    def load_libraries(self):
-        self.cursor.execute("SELECT library_id, name FROM libraries ORDER BY name")
-        self.libraries = self.cursor.fetchall()
-
-    def load_themes(self):
-        self.cursor.execute("SELECT theme_id, name FROM themes ORDER BY name")
-        self.themes = self.cursor.fetchall()
+        self.live_search = LiveSearch(self.search_title, self.search)
+        tk.Button(search_frame, text="Найти", command=self.live_search.submit).pack(side="left")
+        tk.Label(search_frame, text="Издательство:").pack(side="left", padx=(10, 0))
+        self.filter_publisher_cb = ttk.Combobox(search_frame, state="readonly", width=24,
+                                                postcommand=self.refresh_reference)
+        self.filter_publisher_cb.pack(side="left", padx=5)
+        self.filter_publisher_cb.bind("<<ComboboxSelected>>", self.filter_publisher)
+        tk.Button(search_frame, text="Сбросить фильтр", command=self.reset_filter).pack(side="left", padx=10)
+
+        self.status_label = tk.Label(self, text="", fg="gray")
+        self.status_label.grid(row=10, column=0, columnspan=4, sticky="w")
+
+        self.grid_view = RecordGrid(self, self.executor, BOOK_GRID_COLUMNS, self.grid_selected,
+                                    connect=snapshot.get_snapshot().connection,
+                                    multiple=True, on_mark=self.marked_changed)
+        self.grid_view.grid(row=11, column=0, columnspan=4, sticky="nsew", pady=5)
+        self.grid_view.grid_remove()
+
+        # Пакетные операции над отмеченными в таблице книгами (Ctrl/Shift + щелчок)
+        self.batch_frame = tk.Frame(self)
+        self.batch_frame.grid(row=12, column=0, columnspan=4, sticky="w", pady=5)
+        self.marked_label = tk.Label(self.batch_frame, text="Отмечено: 0")
+        self.marked_label.pack(side="left", padx=5)
+        tk.Label(self.batch_frame, text="Тематика:").pack(side="left")
+        self.batch_theme_cb = ttk.Combobox(self.batch_frame, state="readonly", width=18,
+                                           postcommand=self.refresh_reference)
+        self.batch_theme_cb.pack(side="left")
+        tk.Button(self.batch_frame, text="Применить", command=self.batch_theme).pack(side="left", padx=5)
+        tk.Label(self.batch_frame, text="Кол-во (5, +2, -1):").pack(side="left")
+        self.batch_quantity = tk.Entry(self.batch_frame, width=6)
+        self.batch_quantity.pack(side="left")
+        tk.Button(self.batch_frame, text="Применить", command=self.batch_set_quantity).pack(side="left", padx=5)
+        tk.Button(self.batch_frame, text="Удалить отмеченные", command=self.batch_delete).pack(side="left", padx=5)
+        self.undo_button = tk.Button(self.batch_frame, text="Отменить пакет", command=self.undo_batch,
+                                     state="disabled")
+        self.undo_button.pack(side="left", padx=5)
+        self.batch_frame.grid_remove()
+
+    def toggle_grid(self):
+        self.grid_visible = not self.grid_visible
+        if self.grid_visible:
+            self.grid_view.grid()
+            self.batch_frame.grid()
+            self.grid_view.show_source(self.books)
+        else:
+            self.grid_view.grid_remove()
+            self.batch_frame.grid_remove()
+
+    def grid_selected(self, row):
+        # Строка, выбранная в таблице, становится текущей записью формы
+        self.executor.submit(self.books.seek, row, callback=self.moved, errback=self.show_error)
+
+    def set_busy(self, busy):
+        self.status_label.config(text="Выполняется запрос..." if busy else "")
+        self.config(cursor="watch" if busy else "")
+
+    def show_error(self, error):
+        messagebox.showerror("Ошибка", str(error))
+
+    def show_db_error(self, error):
+        messagebox.showerror("Ошибка базы данных", str(error))
+
+    def refresh_reference(self):
+        # Справочники из общего кэша: списки обновляются, только если справочник
+        # изменился (в том числе в другой форме или другом процессе)
+        libraries, themes, publishers = registry.libraries, registry.themes, registry.publishers
+        if publishers is not self.publishers:
+            self.publishers = publishers
+            self.publisher_cb.config(values=publishers.names())
+            self.filter_publisher_cb.config(values=publishers.names())
+        if libraries is not self.libraries:
+            self.libraries = libraries
+            self.library_cb.config(values=libraries.names())
+        if themes is not self.themes:
+            self.themes = themes
+            self.theme_cb.config(values=themes.names())
+            self.batch_theme_cb.config(values=themes.names())
+
+    def open_source(self, source, where_clause="", params=()):
+        # Первая страница читается в фоне; новый поиск отменяет незавершённый
+        self.executor.submit(source.reset, where_clause, params,
+                             callback=lambda _: self.opened(source), errback=self.show_error, tag="load")
+
+    def opened(self, source):
+        self.books = source
+        self.show_record()
+        if self.grid_visible:
+            self.grid_view.show_source(source)
 
     def load_books(self, where_clause="", params=()):
-        query = """
-        SELECT library_id, book_id, theme_id, author, title, publisher, publish_place, publish_year, quantity
-        FROM books
-        """
-        if where_clause:
-            query += " WHERE " + where_clause
-        query += " ORDER BY title"
-        self.cursor.execute(query, params)
-        self.books = self.cursor.fetchall()
-        self.index = 0
-        self.show_record()
+        self.open_source(self.all_books, where_clause, params)
 
     def show_record(self):
-        if not self.books:
+        record = self.books.current()
+        if self.grid_visible:
+            self.grid_view.select_record(record)
+        if record is None:
             self.clear_all_entries()
             self.current_key = None
             return
-        record = self.books[self.index]
         self.current_key = (record[0], record[1])
-        lib_idx = next((i for i, lib in enumerate(self.libraries) if lib[0] == record[0]), 0)
-        self.library_cb.current(lib_idx)
+        self.refresh_reference()
+        lib_idx = self.libraries.index_of(record[0])
+        if lib_idx is None:
+            self.library_cb.set("")
+        else:
+            self.library_cb.current(lib_idx)
         self.entry_book_id.delete(0, tk.END)
         self.entry_book_id.insert(0, str(record[1]))
-        theme_idx = next((i for i, t in enumerate(self.themes) if t[0] == record[2]), 0)
-        self.theme_cb.current(theme_idx if record[2] is not None else 0)
+        theme_idx = self.themes.index_of(record[2])
+        if theme_idx is None:
+            self.theme_cb.set("")
+        else:
+            self.theme_cb.current(theme_idx)
         self.entry_author.delete(0, tk.END)
         self.entry_author.insert(0, record[3] or "")
         self.entry_title.delete(0, tk.END)
         self.entry_title.insert(0, record[4] or "")
-        self.entry_publisher.delete(0, tk.END)
-        self.entry_publisher.insert(0, record[5] or "")
+        self.publisher_cb.set(record[5] or "")
         self.entry_publish_place.delete(0, tk.END)
         self.entry_publish_place.insert(0, record[6] or "")
         self.entry_publish_year.delete(0, tk.END)
@@ -134,7 +241,7 @@ class BooksForm(tk.Frame):
         self.theme_cb.set("")
         self.entry_author.delete(0, tk.END)
         self.entry_title.delete(0, tk.END)
-        self.entry_publisher.delete(0, tk.END)
+        self.publisher_cb.set("")
         self.entry_publish_place.delete(0, tk.END)
         self.entry_publish_year.delete(0, tk.END)
         self.entry_quantity.delete(0, tk.END)
@@ -149,55 +256,58 @@ class BooksForm(tk.Frame):
         self.on_library_change(None)
 
     def get_next_book_id(self, library_id):
-        self.cursor.execute("SELECT MAX(book_id) FROM books WHERE library_id=?", (library_id,))
-        result = self.cursor.fetchone()
-        max_id = result[0] if result and result[0] is not None else 0
-        return max_id + 1
+        # Только подсказка: сам код выдаётся при сохранении (allocate_book_ids)
+        return peek_next_book_id(self.router.connection(library_id), library_id)
 
     def on_library_change(self, event):
         if self.current_key is None and self.library_cb.get():
             try:
-                library_str = self.library_cb.get()
-                library_id = int(library_str.split("ID:")[1].rstrip(")"))
+                library_id = self.libraries.id_of(self.library_cb.get())
                 next_id = self.get_next_book_id(library_id)
+                self.suggested_book_id = next_id
                 self.entry_book_id.delete(0, tk.END)
                 self.entry_book_id.insert(0, str(next_id))
             except Exception:
                 pass
 
-    def first_record(self):
-        if self.books:
-            self.index = 0
+    def navigate(self, move):
+        # Переход на границе страницы читает следующую страницу из БД
+        self.executor.submit(move, callback=self.moved, errback=self.show_error)
+
+    def moved(self, moved):
+        if moved:
             self.show_record()
 
+    def first_record(self):
+        self.navigate(self.books.first)
+
     def last_record(self):
-        if self.books:
-            self.index = len(self.books) - 1
-            self.show_record()
+        self.navigate(self.books.last)
 
     def next_record(self):
-        if self.books and self.index < len(self.books) - 1:
-            self.index += 1
-            self.show_record()
+        self.navigate(self.books.next)
 
     def prev_record(self):
-        if self.books and self.index > 0:
-            self.index -= 1
-            self.show_record()
+        self.navigate(self.books.prev)
 
     def save_record(self):
         try:
-            library_str = self.library_cb.get()
-            if not library_str:
+            self.refresh_reference()
+            library_id = self.libraries.id_of(self.library_cb.get())
+            if library_id is None:
                 raise ValueError("Не выбрана библиотека")
-            library_id = int(library_str.split("ID:")[1].rstrip(")"))
 
-            book_id = int(self.entry_book_id.get().strip())
+            book_id_str = self.entry_book_id.get().strip()
+            is_new = self.current_key is None
+            if is_new and book_id_str in ("", str(self.suggested_book_id)):
+                book_id = None  # код выдаст счётчик библиотеки
+            else:
+                book_id = int(book_id_str)
             theme_name = self.theme_cb.get()
-            theme_id = next((t[0] for t in self.themes if t[1] == theme_name), None)
+            theme_id = self.themes.id_of(theme_name)
             author = self.entry_author.get().strip()
             title = self.entry_title.get().strip()
-            publisher = self.entry_publisher.get().strip()
+            publisher = self.publisher_cb.get().strip()
             publish_place = self.entry_publish_place.get().strip()
             publish_year_str = self.entry_publish_year.get().strip()
             quantity_str = self.entry_quantity.get().strip()
@@ -212,49 +322,241 @@ class BooksForm(tk.Frame):
             if publish_year is not None and (publish_year <= 1000 or publish_year > 2100):
                 raise ValueError("Неверный год издания")
 
-            self.cursor.execute("SELECT COUNT(*) FROM books WHERE library_id=? AND book_id=?", (library_id, book_id))
-            exists = self.cursor.fetchone()[0] > 0
-
-            if exists:
-                self.cursor.execute("""
-                    UPDATE books SET
-                        theme_id=?, author=?, title=?, publisher=?, publish_place=?, publish_year=?, quantity=?
-                    WHERE library_id=? AND book_id=?
-                """, (theme_id, author, title, publisher, publish_place, publish_year, quantity, library_id, book_id))
-            else:
-                self.cursor.execute("""
-                    INSERT INTO books (library_id, book_id, theme_id, author, title, publisher, publish_place, publish_year, quantity)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (library_id, book_id, theme_id, author, title, publisher, publish_place, publish_year, quantity))
-
-            self.conn.commit()
-            self.load_books()
-            messagebox.showinfo("Успех", "Данные сохранены.")
         except Exception as e:
             messagebox.showerror("Ошибка", str(e))
+            return
+
+        # Издательство (values[3]) - код из справочника, подставляется в store
+        values = (theme_id, author, title, None, publish_place, publish_year, quantity, library_id, book_id)
+        # Сначала - похожие книги той же библиотеки (db/dedup.py), запись - после подтверждения
+        exclude = self.current_key
+        self.executor.submit(lambda: dedup.similar_books(shards.get_router().connection(library_id), library_id,
+                                                         author, title, publisher, exclude=exclude),
+                             callback=lambda found: self.store_checked(values, is_new, publisher, found),
+                             errback=self.show_db_error, tag="dedup")
+
+    def store_checked(self, values, is_new, publisher, found):
+        if found and not messagebox.askyesno("Возможный дубль", "Похожие книги в этой библиотеке:\n\n" + "\n".join(
+                f"{book_id}: {author} - {title} ({name or '-'}), сходство {score:.2f}"
+                for score, _, book_id, author, title, name in found) + "\n\nВсё равно сохранить?"):
+            return
+        self.refresh_reference()
+        if not publisher:
+            self.store(values, is_new, None)
+        elif self.publishers.id_of(publisher) is not None:
+            self.store(values, is_new, (self.publishers.id_of(publisher), publisher))
+        else:
+            # Нового издательства нет в справочнике: сначала оно, затем книга
+            self.executor.submit_write(publisher_id, publisher,
+                                       callback=lambda key: self.store(values, is_new, (key, publisher)),
+                                       errback=self.show_db_error)
+
+    def store(self, values, is_new, publisher):
+        values = values[:3] + (publisher and publisher[0],) + values[4:]
+        self.executor.submit_write(self.store_book, values, is_new, publisher,
+                                   db_path=shards.get_router().path(values[-2]),
+                                   callback=self.saved, errback=self.show_error)
+
+    @staticmethod
+    def write_book(values, is_new=False, publisher=None):
+        # Своя транзакция в файле библиотеки (бенчмарки); возвращает код книги
+        conn = shards.get_router().connection(values[-2])
+        with immediate(conn):
+            return BooksForm.store_book(conn, values, is_new, publisher)
+
+    @staticmethod
+    def store_book(conn, values, is_new=False, publisher=None):
+        # Выражения без commit: транзакция - write_book, QueryExecutor.submit_write
+        # или групповой commit очереди записи. Возвращает код книги.
+        # values[3] - publisher_id; publisher - (код, наименование) для копии
+        # справочника в файле библиотеки (db/shards.py)
+        if publisher is not None:
+            copy_publisher(conn, *publisher)
+        if values[-1] is None:
+            # Новая книга: код выдаётся в той же транзакции, что и INSERT
+            values = values[:-1] + (allocate_book_ids(conn, values[-2]),)
+        elif is_new:
+            # Код новой книги введён вручную: занятый код - ошибка, а не
+            # перезапись другой книги (errback формы покажет сообщение)
+            if conn.execute("SELECT 1 FROM books WHERE library_id=? AND book_id=?", values[-2:]).fetchone():
+                raise ValueError(f"Код книги {values[-1]} уже занят")
+        else:
+            cursor = conn.execute("""
+                UPDATE books SET
+                    theme_id=?, author=?, title=?, publisher_id=?, publish_place=?, publish_year=?, quantity=?
+                WHERE library_id=? AND book_id=?
+            """, values)
+            if cursor.rowcount:
+                return values[-1]
+        conn.execute("""
+            INSERT INTO books (theme_id, author, title, publisher_id, publish_place, publish_year, quantity, library_id, book_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, values)
+        return values[-1]
+
+    def saved(self, book_id):
+        self.suggested_book_id = None
+        self.load_books()
+        messagebox.showinfo("Успех", f"Данные сохранены (код книги {book_id}).")
 
     def delete_record(self):
         if self.current_key is None:
             messagebox.showwarning("Внимание", "Нет записи для удаления.")
             return
         if messagebox.askyesno("Подтверждение", "Удалить текущую запись?"):
-            self.cursor.execute("DELETE FROM books WHERE library_id=? AND book_id=?", self.current_key)
-            self.conn.commit()
+            # IntegrityError - запись используется в других таблицах (foreign_keys = ON)
+            self.executor.submit_write(self.delete_book, self.current_key,
+                                       db_path=shards.get_router().path(self.current_key[0]),
+                                       callback=self.deleted, errback=self.show_db_error)
+
+    @staticmethod
+    def remove_book(key):
+        conn = shards.get_router().connection(key[0])
+        with immediate(conn):
+            BooksForm.delete_book(conn, key)
+
+    @staticmethod
+    def delete_book(conn, key):
+        conn.execute("DELETE FROM books WHERE library_id=? AND book_id=?", key)
+
+    def deleted(self, _):
+        self.load_books()
+
+    def search(self, title, explicit=False):
+        # Вызывается LiveSearch по мере ввода. Строка короче MIN_QUERY_LENGTH
+        # ищется через LIKE только по Enter / "Найти": на первых буквах
+        # такой запрос почти всегда возвращает всю таблицу.
+        if len(title) >= search.MIN_QUERY_LENGTH:
+            self.executor.submit(self.book_search.run, title,
+                                 callback=self.opened, errback=self.show_error, tag="load")
+        elif title and explicit:
+            self.load_books("title LIKE ? ESCAPE '\\'", (search.like_pattern(title),))
+        elif not title:
             self.load_books()
 
-    def search(self):
-        title = self.search_title.get().strip()
-        if title:
-            where = "title LIKE ?"
-            param = ('%' + title + '%',)
-            self.load_books(where, param)
+    # ---------- Пакетные операции ----------
+
+    def marked_changed(self, count):
+        self.marked_label.config(text=f"Отмечено: {count}")
+
+    def run_batch(self, func, *args, callback):
+        keys = [(row[0], row[1]) for row in self.grid_view.marked.values()]
+        if not keys:
+            messagebox.showwarning("Внимание", "Не отмечено ни одной книги.")
+            return
+        try:
+            db_path = batch.batch_path(keys)
+        except ValueError as error:
+            messagebox.showerror("Ошибка", str(error))
+            return
+        self.executor.submit_write(func, keys, *args, db_path=db_path, callback=callback, errback=self.show_db_error)
+
+    def batch_theme(self):
+        self.refresh_reference()
+        theme_id = self.themes.id_of(self.batch_theme_cb.get())
+        if theme_id is None:
+            messagebox.showerror("Ошибка", "Не выбрана тематика")
+            return
+        self.run_batch(batch.set_theme, theme_id, BOOK_COLUMNS, callback=self.batch_changed)
+
+    def batch_set_quantity(self):
+        # "5" - новое количество, "+2" / "-1" - приращение
+        text = self.batch_quantity.get().strip()
+        try:
+            value = int(text)
+            if not text.startswith(("+", "-")) and value < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Ошибка", "Количество: число (5) или приращение (+2, -1)")
+            return
+        if text.startswith(("+", "-")):
+            self.run_batch(batch.set_quantity, None, value, BOOK_COLUMNS, callback=self.batch_changed)
         else:
-            self.load_books()
+            self.run_batch(batch.set_quantity, value, None, BOOK_COLUMNS, callback=self.batch_changed)
+
+    def batch_delete(self):
+        count = len(self.grid_view.marked)
+        if count and not messagebox.askyesno("Подтверждение",
+                                             f"Удалить отмеченные книги ({count}) вместе с историей выдач?"):
+            return
+        self.run_batch(batch.delete_books, callback=self.batch_deleted)
+
+    def batch_done(self, last, text):
+        self.last_batch = last
+        self.undo_button.config(state="normal")
+        self.status_label.config(text=text)
+
+    def batch_changed(self, result):
+        rows, last = result
+        self.apply_rows(rows)
+        self.batch_done(last, f"Изменено книг: {len(rows)}")
+
+    def apply_rows(self, rows):
+        # Подставить изменённые строки в форму и таблицу, не перечитывая список
+        changed = {(row[0], row[1]): row for row in rows}
+
+        def patch(row):
+            new = changed.get((row[0], row[1]))
+            return row if new is None else new + row[len(new):]
+        self.books.replace_rows(patch)
+        self.grid_view.replace_rows(patch)
+        self.show_record()
+
+    def batch_deleted(self, result):
+        keys, last = result
+        gone = set(keys)
+
+        def removed(row):
+            return (row[0], row[1]) in gone
+        self.books.remove_rows(removed)
+        self.grid_view.remove_rows(removed, len(keys))
+        if self.books.current() is None and not self.books.complete:
+            self.reopen()
+        else:
+            self.show_record()
+        self.batch_done(last, f"Удалено книг: {len(keys)}")
+
+    def reopen(self):
+        # Перечитать текущий список (с тем же фильтром) с начала
+        self.open_source(self.books, self.books.where_clause, self.books.params)
+
+    def undo_batch(self):
+        last, self.last_batch = self.last_batch, None
+        self.undo_button.config(state="disabled")
+        if last is None:
+            return
+
+        def undone(rows):
+            # Восстановленные книги встают по местам в порядке списка - перечитать
+            if last.action == "delete":
+                self.reopen()
+            else:
+                self.apply_rows(rows)
+            self.status_label.config(text=f"Пакет отменён: книг {len(rows)}")
+
+        def failed(error):
+            self.batch_done(last, "")
+            self.show_db_error(error)
+        self.executor.submit_write(batch.undo, last, BOOK_COLUMNS, db_path=batch.batch_path(last.before),
+                                   callback=undone, errback=failed)
+
+    def filter_publisher(self, event=None):
+        # Книги издательства - по индексу idx_books_publisher, в порядке названий
+        key = self.publishers.id_of(self.filter_publisher_cb.get())
+        if key is not None:
+            self.live_search.clear()
+            self.load_books("publisher_id = ?", (key,))
+
+    def reset_filter(self):
+        self.live_search.clear()
+        self.filter_publisher_cb.set("")
+        self.load_books()
 
 # Блок запуска
 if __name__ == "__main__":
     root = tk.Tk()
     root.title("Книги")
+    diagnostics_form.install(root)
     form = BooksForm(root)
     form.pack(padx=10, pady=10)
     root.mainloop()
@@ -0,0 +1,393 @@
+import argparse
+import asyncio
+import base64
+import http
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import traceback
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from db import circulation, connection, search, shards, snapshot, write_queue
+from db.connection import get_connection
+from db.record_source import RecordSource
+
+# Локальный HTTP/JSON API к базе библиотеки для киосков и веб-каталога
+# (только стандартная библиотека: asyncio и свой разбор HTTP/1.1 keep-alive).
+# Запросы - те же, что в формах: RecordSource с keyset-пагинацией по ключу
+# формы, полнотекстовый поиск db.search, выдача через db.circulation
+# (с маршрутизацией db.shards).
+#
+# Чтение выполняет пул из READERS потоков - у каждого своё соединение
+# (connection.get_connection), запись - один поток: операции выдачи идут
+# по очереди и не спорят за блокировку записи SQLite друг с другом.
+# С --group-commit выдачи идут в очередь записи (db/write_queue.py): потоков
+# записи WRITERS, каждый ждёт свой future, а commit - один на группу.
+# Ответы GET несут ETag по PRAGMA data_version: если база не менялась,
+# запрос с If-None-Match получает 304 без обращения к таблицам.
+
+HOST = "127.0.0.1"
+PORT = 8080
+READERS = 4
+WRITERS = 16
+PAGE_LIMIT = 50
+# Период обслуживания сводок (граница просрочки), секунд
+MAINTENANCE_SECONDS = 3600
+MAX_LIMIT = 500
+# Заголовки и тело запроса больше этого - 413
+MAX_BODY = 65536
+
+BOOK_COLUMNS = ("library_id", "book_id", "theme_id", "author", "title",
+                "publisher", "publish_place", "publish_year", "quantity", "publisher_id")
+READER_COLUMNS = ("reader_id", "full_name", "address", "phone")
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, size):
+    # Курсор - ключ последней строки страницы: список из size значений,
+    # каждое из которых SQLite может связать с параметром запроса
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise ApiError(400, "Неверный курсор страницы")
+    if (not isinstance(key, list) or len(key) != size
+            or not all(value is None or isinstance(value, (int, float, str)) for value in key)):
+        raise ApiError(400, "Неверный курсор страницы")
+    return key
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name}: ожидается целое число")
+
+
+class LibraryApi:
+    # Обработчики запросов (выполняются в потоках пулов) и версия данных для ETag
+
+    def __init__(self, db_path=None, readers=READERS):
+        self.router = shards.get_router(db_path)
+        self.db_path = self.router.db_path
+        self.read_pool = ThreadPoolExecutor(readers, thread_name_prefix="api-read")
+        self.write_pool = ThreadPoolExecutor(WRITERS if write_queue.ENABLED else 1, thread_name_prefix="api-write")
+        # data_version у нового соединения начинается заново: ETag прошлого запуска не подходит
+        self.boot = f"{os.getpid():x}{int(time.time()):x}"
+        self._monitors = {}
+        self._lock = threading.Lock()
+
+    def version(self):
+        # data_version отдельного соединения с каждым файлом меняется при commit
+        # любого другого соединения: форм, других процессов и писателя API
+        paths = [self.db_path]
+        if self.router.sharded:
+            directory = shards.shard_dir(self.db_path)
+            paths += [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                      if name.endswith(".db")]
+        tokens = []
+        with self._lock:
+            for path in paths:
+                conn = self._monitors.get(path)
+                if conn is None:
+                    conn = self._monitors[path] = sqlite3.connect(snapshot.read_only_uri(path), uri=True,
+                                                                  check_same_thread=False)
+                tokens.append(str(conn.execute("PRAGMA data_version").fetchone()[0]))
+        return f'"{self.boot}-{len(paths)}-{"-".join(tokens)}"'
+
+    def close(self):
+        self.read_pool.shutdown()
+        self.write_pool.shutdown()
+        write_queue.close_all()
+        with self._lock:
+            for conn in self._monitors.values():
+                conn.close()
+            self._monitors.clear()
+
+    # ---------- Чтение ----------
+
+    def _page(self, source, where_clause, params, query):
+        limit = min(_int(query.get("limit", PAGE_LIMIT), "limit"), MAX_LIMIT)
+        if limit <= 0:
+            raise ApiError(400, "limit: ожидается положительное число")
+        source.page_size = limit
+        after = query.get("after")
+        rows = source.page_after(where_clause, params, decode_cursor(after, len(source.key)) if after else None)
+        items = [dict(zip(source.columns, row)) for row in rows]
+        next_cursor = encode_cursor([rows[-1][i] for i in source.key_idx]) if len(rows) == limit else None
+        return {"items": items, "next": next_cursor}
+
+    def books(self, query):
+        # Как BooksForm.search: от MIN_QUERY_LENGTH символов - FTS по релевантности,
+        # короче - подстрока названия через LIKE; иначе весь каталог по названию
+        text = query.get("q", "").strip()
+        conditions, params = [], []
+        if len(text) >= search.MIN_QUERY_LENGTH:
+            source = self.router.source(search.BOOKS_HITS, BOOK_COLUMNS + ("rank",),
+                                        ("rank", "library_id", "book_id"))
+            params.append(search.match_phrase(text))
+        else:
+            source = self.router.source("books_compat", BOOK_COLUMNS, ("title", "library_id", "book_id"))
+            if text:
+                conditions.append("title LIKE ? ESCAPE '\\'")
+                params.append(search.like_pattern(text))
+        if query.get("library_id"):
+            conditions.append("library_id = ?")
+            params.append(_int(query["library_id"], "library_id"))
+        if query.get("publisher_id"):
+            conditions.append("publisher_id = ?")
+            params.append(_int(query["publisher_id"], "publisher_id"))
+        if query.get("available") == "1":
+            conditions.append("quantity > 0")
+        return self._page(source, " AND ".join(conditions), tuple(params), query)
+
+    def book(self, query, library_id, book_id):
+        # Книга и наличие: свободные экземпляры (quantity) и выданные сейчас
+        library_id, book_id = int(library_id), int(book_id)
+        conn = self.router.connection(library_id)
+        row = conn.execute(f"SELECT {', '.join(BOOK_COLUMNS)} FROM books_compat WHERE library_id = ? AND book_id = ?",
+                           (library_id, book_id)).fetchone()
+        if row is None:
+            raise ApiError(404, f"Книга {library_id}/{book_id} не найдена")
+        on_loan = conn.execute("""
+            SELECT COUNT(*) FROM subscriptions
+            WHERE library_id = ? AND book_id = ? AND return_date IS NULL
+        """, (library_id, book_id)).fetchone()[0]
+        book = dict(zip(BOOK_COLUMNS, row))
+        book["availability"] = {"available": book["quantity"], "on_loan": on_loan,
+                                "total": book["quantity"] + on_loan}
+        return book
+
+    def readers(self, query):
+        # Читатели всегда в общей базе, и при раздельном хранении книг
+        text = query.get("q", "").strip()
+        if len(text) >= search.MIN_QUERY_LENGTH:
+            source = RecordSource(search.READERS_HITS, READER_COLUMNS + ("rank",), ("rank", "reader_id"),
+                                  db_path=self.db_path)
+            return self._page(source, "", (search.match_phrase(text),), query)
+        source = RecordSource("readers", READER_COLUMNS, ("full_name", "reader_id"), db_path=self.db_path)
+        if text:
+            return self._page(source, "full_name LIKE ? ESCAPE '\\'", (search.like_pattern(text),), query)
+        return self._page(source, "", (), query)
+
+    def reader(self, query, reader_id):
+        # Читатель и книги у него на руках
+        reader_id = int(reader_id)
+        row = get_connection(self.db_path).execute(
+            f"SELECT {', '.join(READER_COLUMNS)} FROM readers WHERE reader_id = ?", (reader_id,)).fetchone()
+        if row is None:
+            raise ApiError(404, f"Читатель {reader_id} не найден")
+        reader = dict(zip(READER_COLUMNS, row))
+        reader["loans"] = [dict(zip(("library_id", "book_id", "issue_date", "advance"), loan))
+                           for loan in self.router.open_loans(reader_id)]
+        return reader
+
+    def library_stats(self, query):
+        return {str(key): values for key, values in self.router.library_stats().items()}
+
+    # ---------- Выдача (поток записи) ----------
+
+    def _loan(self, body):
+        return (_int(body.get("library_id"), "library_id"), _int(body.get("book_id"), "book_id"),
+                _int(body.get("reader_id"), "reader_id"))
+
+    def issue(self, body):
+        advance = body.get("advance", 0)
+        if not isinstance(advance, (int, float)) or advance < 0:
+            raise ApiError(400, "advance: ожидается неотрицательное число")
+        issue_date = self.router.issue(*self._loan(body), advance)
+        return {"issue_date": issue_date}
+
+    def return_book(self, body):
+        return {"return_date": self.router.return_book(*self._loan(body))}
+
+    def renew(self, body):
+        return {"issue_date": self.router.renew(*self._loan(body))}
+
+
+# (метод, шаблон пути, обработчик): GET - в пуле чтения, POST - в потоке записи
+ROUTES = (
+    ("GET", re.compile(r"/books"), "books"),
+    ("GET", re.compile(r"/books/(\d+)/(\d+)"), "book"),
+    ("GET", re.compile(r"/readers"), "readers"),
+    ("GET", re.compile(r"/readers/(\d+)"), "reader"),
+    ("GET", re.compile(r"/stats/libraries"), "library_stats"),
+    ("POST", re.compile(r"/loans"), "issue"),
+    ("POST", re.compile(r"/loans/return"), "return_book"),
+    ("POST", re.compile(r"/loans/renew"), "renew"),
+)
+
+
+class ApiServer:
+    # HTTP/1.1 поверх asyncio.start_server: разбор запроса и ответ - в цикле
+    # событий, обработчики LibraryApi - в пулах потоков
+
+    def __init__(self, api):
+        self.api = api
+
+    async def dispatch(self, method, target, headers, body):
+        # (статус, объект JSON или None, дополнительные заголовки)
+        url = urllib.parse.urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        allowed = False
+        for route_method, pattern, name in ROUTES:
+            match = pattern.fullmatch(path)
+            if match is None:
+                continue
+            allowed = True
+            if route_method == method:
+                break
+        else:
+            if allowed:
+                return 405, {"error": "Метод не поддерживается"}, {}
+            return 404, {"error": "Нет такого ресурса"}, {}
+        loop = asyncio.get_running_loop()
+        handler = getattr(self.api, name)
+        try:
+            if method == "GET":
+                etag = self.api.version()
+                if headers.get("if-none-match") == etag:
+                    return 304, None, {"ETag": etag}
+                query = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+                result = await loop.run_in_executor(self.api.read_pool, handler, query, *match.groups())
+                return 200, result, {"ETag": etag, "Cache-Control": "no-cache"}
+            try:
+                data = json.loads(body or b"{}")
+            except ValueError:
+                raise ApiError(400, "Тело запроса - не JSON")
+            if not isinstance(data, dict):
+                raise ApiError(400, "Тело запроса - не объект JSON")
+            result = await loop.run_in_executor(self.api.write_pool, handler, data)
+            return 201 if name == "issue" else 200, result, {}
+        except ApiError as e:
+            return e.status, {"error": str(e)}, {}
+        except circulation.CirculationError as e:
+            return 409, {"error": str(e)}, {}
+        except sqlite3.Error as e:
+            return 500, {"error": f"Ошибка базы данных: {e}"}, {}
+        except Exception as e:
+            # Ошибка обработчика не должна рвать соединение keep-alive: клиент
+            # получает 500, подробности - в журнал сервера
+            traceback.print_exc()
+            return 500, {"error": f"Внутренняя ошибка сервера: {e}"}, {}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    # Не "МЕТОД ЦЕЛЬ ВЕРСИЯ": ответ 400, дальше поток не разобрать
+                    writer.write(self.response(400, {"error": "Неверная строка запроса"}, {}, False))
+                    await writer.drain()
+                    break
+                headers = {}
+                size = len(line)
+                while True:
+                    header = await reader.readline()
+                    size += len(header)
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = headers.get("content-length") or "0"
+                length = int(length) if length.isascii() and length.isdigit() else None
+                if length is None:
+                    status, result, extra = 400, {"error": "Неверный заголовок Content-Length"}, {}
+                    headers["connection"] = "close"
+                elif size + length > MAX_BODY:
+                    status, result, extra = 413, {"error": "Слишком большой запрос"}, {}
+                    headers["connection"] = "close"
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, result, extra = await self.dispatch(method, target, headers, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(self.response(status, result, extra, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def response(status, result, extra, keep_alive):
+        payload = b"" if result is None else json.dumps(result, ensure_ascii=False).encode("utf-8")
+        lines = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}",
+                 "Content-Type: application/json; charset=utf-8",
+                 f"Content-Length: {len(payload)}",
+                 "Connection: " + ("keep-alive" if keep_alive else "close")]
+        lines += [f"{name}: {value}" for name, value in extra.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload
+
+    async def maintain(self):
+        # Граница просрочки сводок (ShardRouter.refresh_overdue) - при запуске и
+        # раз в MAINTENANCE_SECONDS, в потоке записи: пул чтения не пишет
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(self.api.write_pool, self.api.router.refresh_overdue)
+            except sqlite3.Error:
+                traceback.print_exc()
+            await asyncio.sleep(MAINTENANCE_SECONDS)
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        maintenance = asyncio.create_task(self.maintain())
+        if ready:
+            ready(server.sockets[0].getsockname()[1])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            maintenance.cancel()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Локальный HTTP/JSON API библиотеки")
+    parser.add_argument("--db", help="файл БД (по умолчанию db/library.db)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT, help="0 - любой свободный")
+    parser.add_argument("--readers", type=int, default=READERS, help="потоков (соединений) чтения")
+    parser.add_argument("--no-profiling", action="store_true", help="соединения без профилировщика")
+    parser.add_argument("--group-commit", action="store_true", help="выдачи через очередь записи с групповым commit")
+    parser.add_argument("--synchronous", choices=write_queue.SYNCHRONOUS_LEVELS, default=write_queue.SYNCHRONOUS,
+                        help="PRAGMA synchronous очереди записи")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    connection.PROFILING = not args.no_profiling
+    if args.db:
+        connection.configure(args.db)
+    if args.group_commit:
+        write_queue.configure(synchronous=args.synchronous)
+    api = LibraryApi(args.db, args.readers)
+    try:
+        asyncio.run(ApiServer(api).serve(args.host, args.port,
+                                         ready=lambda port: print(f"API: http://{args.host}:{port}/", flush=True)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import collections
+
+from db import shards
+
+# Пакетные операции над выбранными книгами (табличный режим BooksForm):
+# смена тематики, количества и удаление. Пакет - книги одного файла БД (при
+# раздельном хранении - одной библиотеки, см. batch_path) и одна транзакция
+# с executemany: ошибка откатывает его целиком, частично применённых пакетов
+# не бывает. Операции - выражения без commit: транзакцию открывает
+# QueryExecutor.submit_write (или групповой commit очереди записи).
+# Каждая операция возвращает изменённые строки и Batch - всё, что нужно,
+# чтобы отменить пакет (undo).
+
+BOOK_FIELDS = ("library_id", "book_id", "theme_id", "author", "title",
+               "publisher_id", "publish_place", "publish_year", "quantity")
+LOAN_FIELDS = ("library_id", "book_id", "reader_id", "issue_date", "return_date", "advance")
+
+# action: "theme" - before = {ключ: прежний theme_id};
+# "quantity" - {ключ: на сколько изменилось количество};
+# "delete" - {ключ: (строка books, [строки subscriptions])}
+Batch = collections.namedtuple("Batch", "action before")
+
+
+def batch_path(keys):
+    # Файл БД пакета ключей (library_id, book_id). Книги разных файлов в
+    # один пакет не берутся: транзакция SQLite - в пределах одного файла.
+    router = shards.get_router()
+    paths = {router.path(key[0]) for key in keys}
+    if len(paths) > 1:
+        raise ValueError("В пакет можно отметить книги только одной библиотеки")
+    return paths.pop() if paths else router.path()
+
+
+def _read(conn, table, fields, keys):
+    query = f"SELECT {', '.join(fields)} FROM {table} WHERE library_id = ? AND book_id = ?"
+    return {key: conn.execute(query, key).fetchall() for key in keys}
+
+
+def _rows(conn, columns, keys):
+    # Строки книг после изменения (столбцы формы, с наименованием издательства -
+    # из books_compat); удалённые другим клерком пропускаются
+    return [rows[0] for rows in _read(conn, "books_compat", columns, keys).values() if rows]
+
+
+def set_theme(conn, keys, theme_id, columns=BOOK_FIELDS):
+    keys = [tuple(key) for key in keys]
+    before = {key: found[0][0] for key, found in _read(conn, "books", ("theme_id",), keys).items() if found}
+    conn.executemany("UPDATE books SET theme_id = ? WHERE library_id = ? AND book_id = ?",
+                     ((theme_id,) + key for key in keys))
+    return _rows(conn, columns, keys), Batch("theme", before)
+
+
+def set_quantity(conn, keys, quantity=None, delta=None, columns=BOOK_FIELDS):
+    # quantity - новое количество, delta - приращение (списание: отрицательное).
+    # Отрицательный остаток отвергает CHECK - пакет откатывается целиком.
+    keys = [tuple(key) for key in keys]
+    old = {key: found[0][0] for key, found in _read(conn, "books", ("quantity",), keys).items() if found}
+    if delta is None:
+        conn.executemany("UPDATE books SET quantity = ? WHERE library_id = ? AND book_id = ?",
+                         ((quantity,) + key for key in keys))
+    else:
+        conn.executemany("UPDATE books SET quantity = quantity + ? WHERE library_id = ? AND book_id = ?",
+                         ((delta,) + key for key in keys))
+    before = {key: (quantity - old[key]) if delta is None else delta for key in old}
+    return _rows(conn, columns, keys), Batch("quantity", before)
+
+
+def delete_books(conn, keys):
+    # Вместе с книгами каскадом удаляются их выдачи - они сохраняются для отмены
+    keys = [tuple(key) for key in keys]
+    books = _read(conn, "books", BOOK_FIELDS, keys)
+    loans = _read(conn, "subscriptions", LOAN_FIELDS, keys)
+    before = {key: (found[0], loans[key]) for key, found in books.items() if found}
+    conn.executemany("DELETE FROM books WHERE library_id = ? AND book_id = ?", keys)
+    return [key for key in keys if books[key]], Batch("delete", before)
+
+
+def undo(conn, batch, columns=BOOK_FIELDS):
+    # Отменить пакет (в том же файле БД - batch_path(batch.before));
+    # возвращает восстановленные строки книг
+    keys = list(batch.before)
+    if batch.action == "theme":
+        conn.executemany("UPDATE books SET theme_id = ? WHERE library_id = ? AND book_id = ?",
+                         ((batch.before[key],) + key for key in keys))
+    elif batch.action == "quantity":
+        # Обратное приращение: выдачи после пакета остаются в силе
+        conn.executemany("UPDATE books SET quantity = quantity - ? WHERE library_id = ? AND book_id = ?",
+                         ((batch.before[key],) + key for key in keys))
+    else:
+        # Каждая восстановленная выдача (и закрытая тоже) уменьшит остаток
+        # триггером reduce_quantity_after_issue - книга вставляется с запасом
+        quantity = BOOK_FIELDS.index("quantity")
+        conn.executemany(
+            f"INSERT INTO books ({', '.join(BOOK_FIELDS)}) VALUES ({', '.join('?' * len(BOOK_FIELDS))})",
+            (book[:quantity] + (book[quantity] + len(loans),) + book[quantity + 1:]
+             for book, loans in (batch.before[key] for key in keys)))
+        conn.executemany(
+            f"INSERT INTO subscriptions ({', '.join(LOAN_FIELDS)}) VALUES ({', '.join('?' * len(LOAN_FIELDS))})",
+            (loan for key in keys for loan in batch.before[key][1]))
+    return _rows(conn, columns, keys)
@@ -0,0 +1,32 @@
+# Выдача кодов книг (book_id) по библиотекам через таблицу book_id_sequences.
+# Код берётся UPDATE ... RETURNING в той же транзакции, что и INSERT книги:
+# блокировка записи SQLite гарантирует, что два клерка не получат один код.
+# Коды не переиспользуются после удаления книги, в отличие от MAX(book_id) + 1.
+
+
+def allocate_book_ids(conn, library_id, count=1):
+    # Резервирует count кодов подряд и возвращает первый из них.
+    # Вызывать внутри транзакции, в которой будут вставлены книги.
+    row = conn.execute("""
+        UPDATE book_id_sequences SET next_id = next_id + ?
+        WHERE library_id = ?
+        RETURNING next_id
+    """, (count, library_id)).fetchone()
+    if row is None:
+        # Первая книга библиотеки после создания таблицы - начать с MAX(book_id) + 1
+        row = conn.execute("""
+            INSERT INTO book_id_sequences (library_id, next_id)
+            SELECT ?, COALESCE(MAX(book_id), 0) + 1 + ? FROM books WHERE library_id = ?
+            RETURNING next_id
+        """, (library_id, count, library_id)).fetchone()
+    return row[0] - count
+
+
+def peek_next_book_id(conn, library_id):
+    # Код, который получит следующая книга (для подсказки в форме, без резервирования)
+    row = conn.execute("SELECT next_id FROM book_id_sequences WHERE library_id = ?",
+                       (library_id,)).fetchone()
+    if row is not None:
+        return row[0]
+    row = conn.execute("SELECT MAX(book_id) FROM books WHERE library_id = ?", (library_id,)).fetchone()
+    return (row[0] or 0) + 1
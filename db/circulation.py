@@ -0,0 +1,127 @@
+import datetime
+
+from db.connection import immediate
+
+# Выдача и возврат книг (таблица subscriptions).
+# Остаток books.quantity меняют триггеры reduce_quantity_after_issue и
+# increase_quantity_after_return; здесь он проверяется до INSERT, а не
+# через отказ CHECK(quantity >= 0) после него. Каждая операция - одна
+# транзакция BEGIN IMMEDIATE: блокировка записи берётся сразу, поэтому
+# между проверкой остатка и выдачей другой клерк не заберёт тот же экземпляр.
+
+# Срок выдачи; продление начинает его заново
+LOAN_DAYS = 30
+
+
+class CirculationError(ValueError):
+    pass
+
+
+def now():
+    # Миллисекунды - чтобы повторная выдача той же книги тому же читателю
+    # не совпала по первичному ключу с только что закрытой
+    return datetime.datetime.now().isoformat(timespec="milliseconds")
+
+
+def _check_stock(conn, library_id, book_id):
+    row = conn.execute("SELECT quantity FROM books WHERE library_id = ? AND book_id = ?",
+                       (library_id, book_id)).fetchone()
+    if row is None:
+        raise CirculationError(f"Книга {library_id}/{book_id} не найдена")
+    if row[0] <= 0:
+        raise CirculationError(f"Нет свободных экземпляров книги {library_id}/{book_id}")
+
+
+def _open_loan(conn, library_id, book_id, reader_id):
+    # Самая ранняя незакрытая выдача (частичный индекс idx_subscriptions_open_book)
+    row = conn.execute("""
+        SELECT issue_date FROM subscriptions
+        WHERE library_id = ? AND book_id = ? AND reader_id = ? AND return_date IS NULL
+        ORDER BY issue_date LIMIT 1
+    """, (library_id, book_id, reader_id)).fetchone()
+    if row is None:
+        raise CirculationError(f"У читателя {reader_id} нет книги {library_id}/{book_id}")
+    return row[0]
+
+
+def issue(conn, library_id, book_id, reader_id, advance=0, issue_date=None):
+    # Выдать экземпляр читателю; возвращает дату выдачи (часть ключа записи)
+    issue_date = issue_date or now()
+    with immediate(conn):
+        _check_stock(conn, library_id, book_id)
+        conn.execute("""
+            INSERT INTO subscriptions (library_id, book_id, reader_id, issue_date, advance)
+            VALUES (?, ?, ?, ?, ?)
+        """, (library_id, book_id, reader_id, issue_date, advance))
+    return issue_date
+
+
+def return_book(conn, library_id, book_id, reader_id, return_date=None):
+    # Закрыть выдачу; возвращает дату выдачи закрытой записи
+    with immediate(conn):
+        issue_date = _open_loan(conn, library_id, book_id, reader_id)
+        conn.execute("""
+            UPDATE subscriptions SET return_date = ?
+            WHERE library_id = ? AND book_id = ? AND reader_id = ? AND issue_date = ?
+        """, (return_date or now(), library_id, book_id, reader_id, issue_date))
+    return issue_date
+
+
+def renew(conn, library_id, book_id, reader_id, renew_date=None):
+    # Продление: выдача закрывается и тут же открывается новая с сегодняшней датой.
+    # Триггеры возвращают и снова списывают экземпляр - остаток не меняется,
+    # а в истории читателя видны все продления. Залог переходит в новую выдачу.
+    renew_date = renew_date or now()
+    with immediate(conn):
+        issue_date = _open_loan(conn, library_id, book_id, reader_id)
+        conn.execute("""
+            UPDATE subscriptions SET return_date = ?
+            WHERE library_id = ? AND book_id = ? AND reader_id = ? AND issue_date = ?
+        """, (renew_date, library_id, book_id, reader_id, issue_date))
+        conn.execute("""
+            INSERT INTO subscriptions (library_id, book_id, reader_id, issue_date, advance)
+            SELECT library_id, book_id, reader_id, ?, advance FROM subscriptions
+            WHERE library_id = ? AND book_id = ? AND reader_id = ? AND issue_date = ?
+        """, (renew_date, library_id, book_id, reader_id, issue_date))
+    return renew_date
+
+
+def return_many(conn, loans, return_date=None):
+    # Пакетный возврат (например, разбор ящика возврата): loans - список
+    # (library_id, book_id, reader_id). Одна транзакция на весь пакет;
+    # возвращает число закрытых выдач, книги без открытой выдачи пропускаются.
+    return_date = return_date or now()
+    with immediate(conn):
+        cursor = conn.executemany("""
+            UPDATE subscriptions SET return_date = ?1
+            WHERE rowid = (
+                SELECT rowid FROM subscriptions
+                WHERE library_id = ?2 AND book_id = ?3 AND reader_id = ?4 AND return_date IS NULL
+                ORDER BY issue_date LIMIT 1
+            )
+        """, ((return_date, library_id, book_id, reader_id) for library_id, book_id, reader_id in loans))
+        return cursor.rowcount
+
+
+def open_loans(conn, reader_id):
+    # Книги на руках у читателя (индекс idx_subscriptions_reader_return)
+    return conn.execute("""
+        SELECT library_id, book_id, issue_date, advance FROM subscriptions
+        WHERE reader_id = ? AND return_date IS NULL
+        ORDER BY issue_date
+    """, (reader_id,)).fetchall()
+
+
+def overdue_loans(conn, today=None, limit=None):
+    # Выдачи старше LOAN_DAYS (индекс idx_subscriptions_open_date)
+    cutoff = (today or datetime.date.today()) - datetime.timedelta(days=LOAN_DAYS)
+    query = """
+        SELECT library_id, book_id, reader_id, issue_date FROM subscriptions
+        WHERE return_date IS NULL AND issue_date < ?
+        ORDER BY issue_date
+    """
+    params = (cutoff.isoformat(),)
+    if limit is not None:
+        query += " LIMIT ?"
+        params += (limit,)
+    return conn.execute(query, params).fetchall()
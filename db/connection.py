@@ -0,0 +1,81 @@
+import contextlib
+import sqlite3
+import threading
+
+from db.init_db import DB_FILE
+from db.profiler import ProfiledConnection
+
+# Кэш подготовленных выражений на соединение (по умолчанию в sqlite3 - 128)
+STATEMENT_CACHE_SIZE = 512
+
+PRAGMAS = (
+    ("journal_mode", "WAL"),       # читатели не блокируют писателя
+    ("synchronous", "NORMAL"),     # в режиме WAL безопасно и без fsync на каждый commit
+    ("foreign_keys", "ON"),        # иначе ON DELETE CASCADE не работает
+    ("cache_size", -65536),        # 64 МБ страничного кэша
+    ("mmap_size", 268435456),      # 256 МБ файла читаются через mmap
+    ("temp_store", "MEMORY"),
+    ("busy_timeout", 5000),        # ждать блокировку записи до 5 с, а не падать сразу
+)
+
+# Статистика запросов для окна диагностики (db/profiler.py)
+PROFILING = True
+
+_local = threading.local()
+_default_path = DB_FILE
+
+
+def configure(db_path):
+    # Сменить файл БД по умолчанию (бенчмарки, запуск с другой базой)
+    global _default_path
+    _default_path = db_path
+
+
+def default_path():
+    return _default_path
+
+
+def connect(db_path=DB_FILE):
+    # "file:...?mode=ro" - соединение только для чтения (db/snapshot.py)
+    factory = ProfiledConnection if PROFILING else sqlite3.Connection
+    conn = sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE, factory=factory,
+                           uri=db_path.startswith("file:"))
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def get_connection(db_path=None):
+    # Одно настроенное соединение на поток и файл БД:
+    # объекты sqlite3.Connection нельзя передавать между потоками.
+    db_path = db_path or _default_path
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = connect(db_path)
+    return conn
+
+
+def close_connection(db_path=None):
+    conns = getattr(_local, "conns", {})
+    conn = conns.pop(db_path or _default_path, None)
+    if conn is not None:
+        conn.close()
+
+
+@contextlib.contextmanager
+def immediate(conn):
+    # Транзакция BEGIN IMMEDIATE: блокировка записи берётся сразу, а не при
+    # первом изменении. Внутри уже открытой транзакции - просто выполнить в ней.
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
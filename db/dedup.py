@@ -0,0 +1,438 @@
+import argparse
+import functools
+import itertools
+import re
+import sys
+import unicodedata
+from array import array
+
+from db import shards, snapshot
+from db.connection import close_connection
+from db.init_db import DB_FILE
+
+# Поиск дублей в каталоге и среди читателей. Филиалы вводят одну и ту же
+# книгу с разным написанием ("Толстой Л.Н." / "толстой л. н." / "Tolstoy L.N."),
+# один читатель записан дважды с по-разному оформленным телефоном.
+#
+# Нормализация: регистр (casefold), ё -> е, кириллица -> латиница и
+# сглаживание вариантов латинской записи (y/j -> i, kh -> h ...), знаки
+# препинания -> пробел. Телефон - только цифры, 8XXXXXXXXXX -> 7XXXXXXXXXX.
+#
+# Сходство двух записей - взвешенное среднее по полям коэффициента Жаккара
+# множеств триграмм (SHINGLE символов) нормализованного текста: у книги
+# название весит больше автора и издательства, у читателя ФИО - больше
+# адреса. Сравнивать все пары - O(n^2), поэтому кандидаты отбираются
+# блоками (LSH): по триграммам строится MinHash-подпись из BINS значений
+# (одна хеш-функция, триграмма попадает в одну из BINS корзин, пустые
+# корзины берут значение соседней), подпись режется на полосы по ROWS
+# значений. Записи с одинаковой полосой - кандидаты: пара со сходством 0.8
+# совпадает хотя бы в одной полосе с вероятностью ~0.96, 0.5 - ~0.32, 0.3 -
+# ~0.05. Подпись строится по полям с весом от 1 (у книги - автор и
+# название): издательства вида "Издательство «...»" похожи друг на друга и
+# делали бы кандидатами почти все пары. Полосы всех записей хранятся в массивах, равные
+# находятся сортировкой - время O(n log n), память - несколько чисел на
+# запись. Кандидаты проверяются точным сходством, группы собираются через
+# объединение множеств (union-find).
+#
+# Книги сравниваются только внутри одной библиотеки: одна и та же книга в
+# разных филиалах - не дубль. Читатели с одним телефоном - кандидаты и без
+# совпадения полос (ФИО проверяется с порогом PHONE_THRESHOLD), читатели с
+# разными известными телефонами - разные люди.
+#
+# При сохранении в формах проверяется одна запись: кандидаты берутся по
+# индексам (начало названия, фамилия автора или читателя, варианты записи
+# телефона), проверка - тем же сходством. Полный отчёт - db/reports.py
+# (duplicates) и python -m db.dedup.
+
+SHINGLE = 3
+# Веса полей в сходстве: (автор, название, издательство) и (ФИО, адрес)
+BOOK_WEIGHTS = (1.0, 2.0, 0.5)
+READER_WEIGHTS = (2.0, 1.0)
+BINS = 24
+ROWS = 4
+THRESHOLD = 0.8
+PHONE_THRESHOLD = 0.5
+# Блок больше MAX_BUCKET записей проверяется не всеми парами: он делится
+# по значениям следующих полос (см. _pairs)
+MAX_BUCKET = 20
+# Строк на одну пробу по индексу при проверке одной записи
+PROBE_ROWS = 200
+# Дублей, показываемых в предупреждении формы
+WARN_LIMIT = 5
+
+# ГОСТ-подобная транслитерация; твёрдый и мягкий знаки опускаются
+_CYRILLIC = dict(zip("абвгдеёжзийклмнопрстуфхцчшщъыьэюя",
+                     ("a", "b", "v", "g", "d", "e", "e", "zh", "z", "i", "i", "k", "l", "m", "n", "o",
+                      "p", "r", "s", "t", "u", "f", "kh", "ts", "ch", "sh", "shch", "", "y", "", "e",
+                      "yu", "ya")))
+_TRANSLIT = str.maketrans(_CYRILLIC)
+# Варианты латинской записи одних и тех же звуков (после транслитерации)
+_LATIN = ((re.compile(r"shch|sch"), "sh"), (re.compile(r"kh|x"), "h"), (re.compile(r"ts|tz"), "c"),
+          (re.compile(r"[yj]"), "i"), (re.compile(r"w"), "v"), (re.compile(r"ck|q"), "k"),
+          (re.compile(r"ph"), "f"))
+_PUNCTUATION = re.compile(r"[\W_]+")
+_MASK = (1 << 61) - 1
+
+
+def normalize(text):
+    # "Толстой Л.Н." и "TOLSTOY, L. N." -> "tolstoi l n"
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold().translate(_TRANSLIT)
+    for pattern, replacement in _LATIN:
+        text = pattern.sub(replacement, text)
+    return " ".join(_PUNCTUATION.sub(" ", text).split())
+
+
+def phone_digits(phone):
+    # "+7 (900) 123-45-67", "8 900 1234567" -> "79001234567"; короче 7 цифр - ""
+    digits = re.sub(r"\D", "", phone or "")
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    elif len(digits) == 10:
+        digits = "7" + digits
+    return digits if len(digits) >= 7 else ""
+
+
+def book_fields(author, title, publisher):
+    return normalize(author), normalize(title), normalize(publisher)
+
+
+def reader_fields(full_name, address):
+    return normalize(full_name), normalize(address)
+
+
+@functools.lru_cache(maxsize=65536)
+def shingles(text):
+    # Кэш: авторы, издательства и адреса повторяются у многих записей
+    text = f" {text} "
+    return frozenset(text[i:i + SHINGLE] for i in range(max(len(text) - SHINGLE + 1, 1)))
+
+
+def jaccard(a, b):
+    # Коэффициент Жаккара триграмм: 1.0 - одинаковые нормализованные тексты
+    if a == b:
+        return 1.0
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+
+@functools.lru_cache(maxsize=None)
+def _heaviest_first(weights):
+    return sorted(range(len(weights)), key=lambda k: -weights[k])
+
+
+def similarity(a, b, weights, at_least=0.0):
+    # a, b - кортежи нормализованных полей; поле, пустое у обеих записей, не
+    # считается. at_least - порог: как только он недостижим, возвращается 0.0
+    fields = [k for k in _heaviest_first(weights) if a[k] or b[k]]
+    weight_sum = sum(weights[k] for k in fields)
+    if not weight_sum:
+        return 1.0
+    total, remaining = 0.0, weight_sum
+    for k in fields:
+        remaining -= weights[k]
+        total += weights[k] * jaccard(a[k], b[k])
+        if total + remaining < at_least * weight_sum:
+            return 0.0
+    return total / weight_sum
+
+
+def bands(text, group=0):
+    # Хеши BINS // ROWS полос MinHash-подписи (одна хеш-функция, BINS корзин)
+    signature = [None] * BINS
+    for shingle in shingles(text):
+        h = hash(shingle) & _MASK
+        index = h % BINS
+        value = h // BINS
+        if signature[index] is None or value < signature[index]:
+            signature[index] = value
+    # Пустая корзина берёт значение ближайшей следующей непустой (со сдвигом)
+    for index in range(BINS):
+        if signature[index] is None:
+            for step in range(1, BINS):
+                value = signature[(index + step) % BINS]
+                if value is not None and not isinstance(value, tuple):
+                    signature[index] = (value, step)
+                    break
+    return [hash((group, band, tuple(signature[band * ROWS:(band + 1) * ROWS])))
+            for band in range(BINS // ROWS)]
+
+
+class _Groups:
+    # Объединение множеств по номерам записей
+
+    def __init__(self, size):
+        self.parent = array("q", range(size))
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+def _runs(values, indexes=None):
+    # Группы номеров записей с одинаковым значением (сортировкой, без словаря);
+    # indexes - только среди этих номеров
+    order = sorted(range(len(values)) if indexes is None else indexes, key=values.__getitem__)
+    start = 0
+    for end in range(1, len(order) + 1):
+        if end == len(order) or values[order[end]] != values[order[start]]:
+            if end - start > 1:
+                yield order[start:end]
+            start = end
+
+
+def _pairs(run, keys):
+    # Пары номеров записей блока. Блок больше MAX_BUCKET делится по значениям
+    # следующего ключа из keys (другие полосы подписи) - проверяются пары,
+    # совпавшие и в нём; запись, у которой в блоке нет совпадения по этому
+    # ключу, здесь не проверяется. Записи, совпавшие во всех ключах
+    # (одинаковая подпись), сравниваются с первой записью блока.
+    if len(run) <= MAX_BUCKET:
+        return ((run[i], run[j]) for i in range(len(run)) for j in range(i + 1, len(run)))
+    if not keys:
+        return ((run[0], i) for i in run[1:])
+    return itertools.chain.from_iterable(_pairs(part, keys[1:]) for part in _runs(keys[0], run))
+
+
+def find_duplicates(records, weights, threshold=THRESHOLD):
+    # records - (ссылка, группа, поля, точный ключ, телефон); группа - блок,
+    # вне которого дублей не ищем (библиотека книги). Возвращает группы
+    # дублей: [(ссылка, сходство с первой записью, причина)], первая - образец.
+    refs, fields, exact, phones = [], [], array("q"), array("q")
+    has_phone = bytearray()
+    band_values = [array("q") for _ in range(BINS // ROWS)]
+    for ref, group, values, exact_key, phone in records:
+        refs.append(ref)
+        fields.append(values)
+        exact.append(hash((group, exact_key)))
+        has_phone.append(bool(phone))
+        # Без телефона - своё значение: такие записи по телефону не сходятся
+        phones.append(hash((group, phone)) if phone else hash((group, len(refs), None)))
+        text = " ".join(value for value, weight in zip(values, weights) if weight >= 1)
+        for band, value in zip(band_values, bands(text, group)):
+            band.append(value)
+
+    def same_person(i, j):
+        return not (has_phone[i] and has_phone[j]) or phones[i] == phones[j]
+
+    groups = _Groups(len(refs))
+    for run in _runs(exact):
+        for i in run[1:]:
+            groups.union(run[0], i)
+    for run in _runs(phones):
+        for i, j in _pairs(run, band_values):
+            # Один телефон: достаточно похожего ФИО (первое поле)
+            if groups.find(i) != groups.find(j) and jaccard(fields[i][0], fields[j][0]) >= PHONE_THRESHOLD:
+                groups.union(i, j)
+    # Значения полос, блоки которых делились: пары в них проверены не все
+    split = []
+    for number, band in enumerate(band_values):
+        earlier = list(zip(band_values[:number], split))
+        split.append(set())
+        for run in _runs(band):
+            if len(run) > MAX_BUCKET:
+                split[-1].add(band[run[0]])
+            for i, j in _pairs(run, band_values[number + 1:] + band_values[:number]):
+                # Пара, совпавшая в прежней полосе с неделённым блоком, там уже проверена
+                if (groups.find(i) != groups.find(j) and same_person(i, j)
+                        and not any(values[i] == values[j] and values[i] not in divided
+                                    for values, divided in earlier)
+                        and similarity(fields[i], fields[j], weights, threshold) >= threshold):
+                    groups.union(i, j)
+
+    # Корень группы - её наименьший номер, поэтому образец - первая по порядку запись
+    members = {}
+    for i in range(len(refs)):
+        root = groups.find(i)
+        if root != i:
+            members.setdefault(root, [root]).append(i)
+    clusters = []
+    for root in sorted(members):
+        cluster = [(refs[root], 1.0, "образец")]
+        for i in members[root][1:]:
+            reason = ("точное" if exact[i] == exact[root] else
+                      "телефон" if phones[i] == phones[root] else "похожее")
+            cluster.append((refs[i], round(similarity(fields[root], fields[i], weights), 3), reason))
+        clusters.append(cluster)
+    return clusters
+
+
+# ---------- Источники записей ----------
+
+def book_records(conn, library_id=None):
+    query = "SELECT library_id, book_id, author, title, publisher FROM books_compat"
+    params = ()
+    if library_id is not None:
+        query += " WHERE library_id = ?"
+        params = (library_id,)
+    for library, book_id, author, title, publisher in conn.execute(query, params):
+        fields = book_fields(author, title, publisher)
+        yield (library, book_id), library, fields, "|".join(fields).replace(" ", ""), ""
+
+
+def reader_records(conn):
+    for reader_id, full_name, address, phone in conn.execute(
+            "SELECT reader_id, full_name, address, phone FROM readers"):
+        fields, digits = reader_fields(full_name, address), phone_digits(phone)
+        # Точный ключ: ФИО и телефон (без телефона - ФИО и адрес)
+        exact = (fields[0].replace(" ", ""), digits or fields[1])
+        yield reader_id, 0, fields, exact, digits
+
+
+def shard_book_records(conn, files, library_id=None):
+    # book_records по файлам библиотек (db/shards.py) files - [(library_id,
+    # соединение)]; без раскладки (files пуст) - по conn
+    if not files:
+        return book_records(conn, library_id)
+    return itertools.chain.from_iterable(book_records(source, library_id) for key, source in files
+                                         if library_id is None or key == library_id)
+
+
+def fill_candidates(conn, kind="books", threshold=THRESHOLD, library_id=None, files=()):
+    # Группы дублей во временную таблицу dedup_candidates (отчёт duplicates);
+    # files - файлы библиотек, см. shard_book_records
+    if kind == "books":
+        clusters = find_duplicates(shard_book_records(conn, files, library_id), BOOK_WEIGHTS, threshold)
+    else:
+        clusters = find_duplicates(reader_records(conn), READER_WEIGHTS, threshold)
+    conn.executemany("INSERT INTO dedup_candidates VALUES (?, ?, ?, ?, ?, ?)", (
+        (number, n, *(ref if isinstance(ref, tuple) else (ref, None)), score, reason)
+        for number, cluster in enumerate(clusters, 1)
+        for n, (ref, score, reason) in enumerate(cluster, 1)))
+    return len(clusters)
+
+
+# ---------- Проверка одной записи (при сохранении) ----------
+
+def _prefixes(text):
+    # Начало текста в вариантах регистра - для диапазонов по индексу (BINARY):
+    # первое слово и (узкий диапазон, когда на первое слово больше PROBE_ROWS
+    # строк) первые два слова
+    words = [word.strip(".,;:") for word in (text or "").split()[:2]]
+    if not words or len(words[0]) < 2:
+        return []
+    starts = [words[0]] + ([" ".join(words)] if len(words) > 1 else [])
+    return sorted({variant for start in starts
+                   for variant in (start, start.capitalize(), start.lower(), start.upper())})
+
+
+def _probe(conn, query, column, text, params):
+    rows = []
+    for prefix in _prefixes(text):
+        rows += conn.execute(query.format(column=column),
+                             (prefix, prefix + "\U0010ffff") + params + (PROBE_ROWS,)).fetchall()
+    return rows
+
+
+def similar_books(conn, library_id, author, title, publisher, exclude=None, threshold=THRESHOLD):
+    # Похожие книги той же библиотеки: [(сходство, library_id, book_id, author, title, publisher)]
+    # Кандидаты уже, чем у find_duplicates: только книги с тем же началом
+    # названия или автора (пробы по индексам), а не с общей полосой подписи.
+    # Дубль с переставленными словами или иначе записанным первым словом
+    # здесь не найдётся - его покажет полный отчёт duplicates.
+    # INDEXED BY: иначе планировщик выбирает ключ (library_id) - все книги библиотеки
+    # (поэтому books, а не books_compat: наименование издательства - подзапросом)
+    query = """
+        SELECT library_id, book_id, author, title,
+               (SELECT name FROM publishers p WHERE p.publisher_id = b.publisher_id)
+        FROM books b INDEXED BY {index}
+        WHERE {column} >= ? AND {column} < ? AND library_id = ?
+        LIMIT ?
+    """
+    candidates = set(_probe(conn, query.replace("{index}", "idx_books_title_key"), "title", title,
+                            (library_id,)))
+    candidates.update(_probe(conn, query.replace("{index}", "idx_books_author"), "author", author,
+                             (library_id,)))
+    fields = book_fields(author, title, publisher)
+    found = []
+    for row in candidates:
+        if exclude is not None and tuple(row[:2]) == tuple(exclude):
+            continue
+        score = similarity(fields, book_fields(*row[2:]), BOOK_WEIGHTS)
+        if score >= threshold:
+            found.append((round(score, 3),) + row)
+    return sorted(found, key=lambda row: -row[0])[:WARN_LIMIT]
+
+
+def _phone_variants(digits):
+    # Частые записи одного номера 7XXXXXXXXXX: индекс UNIQUE на readers.phone
+    # ищет строку как есть, поэтому phone IN (варианты) - по одному поиску в
+    # индексе на вариант вместо разбора телефона каждого читателя
+    if len(digits) != 11:
+        return [digits]
+    code, a, b, c = digits[1:4], digits[4:7], digits[7:9], digits[9:]
+    return [f"+7{digits[1:]}", f"8{digits[1:]}", digits, f"+7 ({code}) {a}-{b}-{c}",
+            f"8 ({code}) {a}-{b}-{c}", f"+7 {code} {a}-{b}-{c}", f"8 {code} {a}-{b}-{c}",
+            f"+7 {code} {a} {b} {c}", f"+7-{code}-{a}-{b}-{c}", f"8-{code}-{a}-{b}-{c}"]
+
+
+def similar_readers(conn, full_name, address, phone, exclude=None, threshold=THRESHOLD):
+    # Похожие читатели: [(сходство, reader_id, full_name, address, phone)]
+    query = """
+        SELECT reader_id, full_name, address, phone FROM readers
+        WHERE {column} >= ? AND {column} < ?
+        LIMIT ?
+    """
+    candidates = set(_probe(conn, query, "full_name", full_name, ()))
+    digits = phone_digits(phone)
+    if digits:
+        variants = _phone_variants(digits)
+        candidates.update(conn.execute(
+            f"SELECT reader_id, full_name, address, phone FROM readers WHERE phone IN ({', '.join('?' * len(variants))})",
+            variants).fetchall())
+    fields = reader_fields(full_name, address)
+    found = []
+    for row in candidates:
+        if row[0] == exclude:
+            continue
+        other = phone_digits(row[3])
+        score = similarity(fields, reader_fields(row[1], row[2]), READER_WEIGHTS)
+        if digits and other == digits:
+            if jaccard(fields[0], normalize(row[1])) >= PHONE_THRESHOLD:
+                found.append((round(score, 3),) + row)
+        elif score >= threshold and not (digits and other):
+            found.append((round(score, 3),) + row)
+    return sorted(found, key=lambda row: -row[0])[:WARN_LIMIT]
+
+
+# ---------- Запуск из командной строки ----------
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Поиск дублей книг и читателей")
+    parser.add_argument("kind", choices=("books", "readers"))
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="порог сходства, 0..1")
+    parser.add_argument("--library", type=int, help="books: только одна библиотека")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--snapshot", choices=snapshot.MODES, default=snapshot.MODE)
+    return parser.parse_args()
+
+
+def main():
+    # Группы дублей в stdout; отчёт с полями записей - python -m db.reports duplicates
+    args = parse_args()
+    reads = snapshot.Snapshot(args.db, args.snapshot)
+    with shards.reading(reads) as (conn, files):
+        if args.kind == "books":
+            clusters = find_duplicates(shard_book_records(conn, files, args.library), BOOK_WEIGHTS,
+                                       args.threshold)
+        else:
+            clusters = find_duplicates(reader_records(conn), READER_WEIGHTS, args.threshold)
+    shards.close_snapshots(reads)
+    for number, cluster in enumerate(clusters, 1):
+        print(number, "  ".join(f"{ref}:{score}:{reason}" for ref, score, reason in cluster))
+    print(f"Групп дублей: {len(clusters)}", file=sys.stderr)
+    close_connection(reads.read_path)
+    reads.close()
+
+
+if __name__ == "__main__":
+    main()
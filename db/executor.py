@@ -0,0 +1,151 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db import write_queue
+from db.connection import get_connection, immediate
+
+# Как часто (мс) главный поток Tk забирает готовые результаты
+POLL_MS = 20
+
+
+class _Job:
+    def __init__(self, func, args, callback, errback, tag):
+        self.func = func
+        self.args = args
+        self.callback = callback
+        self.errback = errback
+        self.tag = tag
+        self.cancelled = False
+        self.conn = None  # соединение, на котором задание выполняется прямо сейчас
+
+
+def _write(db_path, func, args):
+    conn = get_connection(db_path)
+    with immediate(conn):
+        return func(conn, *args)
+
+
+def _outcome(future):
+    # (результат, ошибка) завершённого future
+    try:
+        return future.result(), None
+    except Exception as e:
+        return None, e
+
+
+class QueryExecutor:
+    # Выполняет запросы вне потока Tk, чтобы окно не зависало на SQLite.
+    # func(*args) вызывается в рабочем потоке (соединение - get_connection()),
+    # callback(result) / errback(exc) - в главном потоке через after().
+    # Задания с одинаковым tag вытесняют друг друга: новое отменяет старое,
+    # а уже выполняющийся запрос прерывается через Connection.interrupt().
+    # По умолчанию один рабочий поток: задания формы выполняются по порядку.
+
+    def __init__(self, widget, workers=1, on_busy=None, db_path=None):
+        self.widget = widget
+        self.on_busy = on_busy
+        self.db_path = db_path
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._latest = {}  # tag -> последнее задание с этим тегом
+        self._pending = 0
+        self._polling = False
+
+    def submit(self, func, *args, callback=None, errback=None, tag=None):
+        job = _Job(func, args, callback, errback, tag)
+        if tag is not None:
+            self.cancel(tag)
+            self._latest[tag] = job
+        self._pending += 1
+        if self._pending == 1 and self.on_busy:
+            self.on_busy(True)
+        self._pool.submit(self._run, job)
+        self._start_polling()
+        return job
+
+    def submit_write(self, func, *args, db_path=None, callback=None, errback=None):
+        # Изменение БД: func(conn, *args) - выражения без commit. С очередью
+        # записи (db/write_queue.py) - в её групповом commit, иначе - своя
+        # транзакция BEGIN IMMEDIATE в рабочем потоке. callback - после commit.
+        db_path = db_path or self.db_path
+        if write_queue.ENABLED:
+            return self.watch(write_queue.get_write_queue(db_path).submit(func, *args),
+                              callback=callback, errback=errback)
+        return self.submit(_write, db_path, func, args, callback=callback, errback=errback)
+
+    def watch(self, future, callback=None, errback=None):
+        # callback(result) / errback(exc) по готовности concurrent.futures.Future -
+        # тоже в главном потоке
+        job = _Job(None, (), callback, errback, None)
+        self._pending += 1
+        if self._pending == 1 and self.on_busy:
+            self.on_busy(True)
+        future.add_done_callback(lambda done: self._results.put((job,) + _outcome(done)))
+        self._start_polling()
+        return job
+
+    def _start_polling(self):
+        if not self._polling:
+            self._polling = True
+            self.widget.after(POLL_MS, self._poll)
+
+    def cancel(self, tag):
+        job = self._latest.pop(tag, None)
+        if job is None:
+            return
+        with self._lock:
+            job.cancelled = True
+            if job.conn is not None:
+                job.conn.interrupt()
+
+    def _run(self, job):
+        if job.cancelled:
+            self._results.put((job, None, None))
+            return
+        with self._lock:
+            job.conn = get_connection(self.db_path)
+        try:
+            result, error = job.func(*job.args), None
+        except Exception as e:
+            result, error = None, e
+        finally:
+            with self._lock:
+                job.conn = None
+        self._results.put((job, result, error))
+
+    def _poll(self):
+        try:
+            while True:
+                try:
+                    job, result, error = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                self._finish(job, result, error)
+        finally:
+            if self._pending:
+                self.widget.after(POLL_MS, self._poll)
+            else:
+                self._polling = False
+
+    def _finish(self, job, result, error):
+        self._pending -= 1
+        if self._pending == 0 and self.on_busy:
+            self.on_busy(False)
+        if job.tag is not None and self._latest.get(job.tag) is job:
+            del self._latest[job.tag]
+        if job.cancelled:
+            return
+        if error is None:
+            if job.callback:
+                job.callback(result)
+        elif job.errback:
+            job.errback(error)
+        else:
+            self.widget.report_callback_exception(type(error), error, error.__traceback__)
+
+    def shutdown(self):
+        for tag in list(self._latest):
+            self.cancel(tag)
+        self._pool.shutdown(wait=False)
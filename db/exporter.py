@@ -0,0 +1,233 @@
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import struct
+import zlib
+
+from db import search, shards
+from db.connection import close_connection, connect
+from db.init_db import DB_FILE
+from db.snapshot import MODES, Snapshot
+
+# Строк за один fetchmany(): в памяти одновременно не больше одной пачки
+FETCH_SIZE = 5000
+# Строк в одной группе столбцового файла
+ROW_GROUP_SIZE = 50000
+
+COLUMNAR_MAGIC = b"LCOL1\n"
+
+TABLES = {
+    "books": ("library_id", "book_id", "theme_id", "author", "title",
+              "publisher", "publish_place", "publish_year", "quantity"),
+    "readers": ("reader_id", "full_name", "address", "phone"),
+    "subscriptions": ("library_id", "book_id", "reader_id", "issue_date", "return_date", "advance"),
+}
+# Откуда читать: издательство книги - наименованием, через представление
+SOURCES = {"books": "books_compat"}
+
+# Фильтры - те же, что в формах: поиск по названию, по ФИО и выбор библиотеки
+# (% и _ в строке поиска - обычные символы, как в формах)
+FILTERS = {
+    "title": (("books",), "title LIKE ? ESCAPE '\\'", search.like_pattern),
+    "full_name": (("readers",), "full_name LIKE ? ESCAPE '\\'", search.like_pattern),
+    "library_id": (("books", "subscriptions"), "library_id = ?", int),
+    "publisher_id": (("books",), "publisher_id = ?", int),
+}
+
+
+def build_query(table, filters):
+    conditions, params = [], []
+    for name, value in filters.items():
+        if value in (None, ""):
+            continue
+        tables, condition, convert = FILTERS[name]
+        if table not in tables:
+            raise ValueError(f"Фильтр {name} не применим к таблице {table}")
+        conditions.append(condition)
+        params.append(convert(value))
+    query = f"SELECT {', '.join(TABLES[table])} FROM {SOURCES.get(table, table)}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return query, params
+
+
+def iter_batches(conn, table, filters, fetch_size=FETCH_SIZE):
+    query, params = build_query(table, filters)
+    cursor = conn.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def _open_text(path, compress):
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def write_csv(batches, columns, path, compress=False):
+    count = 0
+    with _open_text(path, compress) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def write_jsonl(batches, columns, path, compress=False):
+    count = 0
+    with _open_text(path, compress) as f:
+        for rows in batches:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                f.write("\n")
+            count += len(rows)
+    return count
+
+
+# ---------- Столбцовый формат ----------
+# COLUMNAR_MAGIC, строка JSON-заголовка {"columns": [...]}, затем группы строк:
+# 4 байта длины (big-endian) + zlib(JSON {"rows": n, "columns": [...]}).
+# Строковые столбцы с повторами хранятся словарём: {"dict": [...], "codes": [...]}.
+# Значения одного столбца лежат рядом, поэтому сжимаются намного лучше строк CSV.
+
+def _encode_column(values):
+    if not any(isinstance(v, str) for v in values):
+        return values
+    codes, index, dictionary = [], {}, []
+    for v in values:
+        code = index.get(v)
+        if code is None:
+            code = index[v] = len(dictionary)
+            dictionary.append(v)
+        codes.append(code)
+    if len(dictionary) * 2 > len(values):
+        return values  # почти все значения разные - словарь не выгоден
+    return {"dict": dictionary, "codes": codes}
+
+
+def _decode_column(data):
+    if isinstance(data, dict):
+        dictionary = data["dict"]
+        return [dictionary[c] for c in data["codes"]]
+    return data
+
+
+def _write_row_group(f, rows):
+    chunk = {"rows": len(rows), "columns": [_encode_column(list(col)) for col in zip(*rows)]}
+    payload = zlib.compress(json.dumps(chunk, ensure_ascii=False).encode("utf-8"), 6)
+    f.write(struct.pack(">I", len(payload)))
+    f.write(payload)
+
+
+def write_columnar(batches, columns, path, compress=False):
+    # compress не используется: группы строк и так сжаты zlib
+    count = 0
+    group = []
+    with open(path, "wb") as f:
+        f.write(COLUMNAR_MAGIC)
+        f.write(json.dumps({"columns": list(columns)}).encode("utf-8") + b"\n")
+        for rows in batches:
+            group.extend(rows)
+            count += len(rows)
+            if len(group) >= ROW_GROUP_SIZE:
+                _write_row_group(f, group)
+                group = []
+        if group:
+            _write_row_group(f, group)
+    return count
+
+
+def read_columnar(path):
+    # Построчное чтение столбцового файла (по одной группе в памяти)
+    with open(path, "rb") as f:
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(f"{path}: не столбцовый файл экспорта")
+        columns = json.loads(f.readline())["columns"]
+        while True:
+            size = f.read(4)
+            if not size:
+                break
+            chunk = json.loads(zlib.decompress(f.read(struct.unpack(">I", size)[0])))
+            yield from (dict(zip(columns, row))
+                        for row in zip(*(_decode_column(c) for c in chunk["columns"])))
+
+
+WRITERS = {
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+    "columnar": write_columnar,
+}
+
+
+def export_table(conn, table, path, fmt="csv", compress=False, files=(), **filters):
+    # files - [(library_id, соединение)] файлов библиотек (db/shards.py):
+    # книги и выдачи читаются из них по порядку библиотек (с фильтром
+    # библиотеки - только из её файла), остальное - из conn
+    if files and table in shards.SHARD_TABLES:
+        library_id = filters.get("library_id")
+        batches = itertools.chain.from_iterable(
+            iter_batches(source, table, filters) for key, source in files
+            if library_id in (None, "") or key == int(library_id))
+    else:
+        batches = iter_batches(conn, table, filters)
+    return WRITERS[fmt](batches, TABLES[table], path, compress)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Выгрузка данных библиотеки в файл")
+    parser.add_argument("table", choices=sorted(TABLES))
+    parser.add_argument("path", help="выходной файл")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--gzip", action="store_true", help="сжать csv/jsonl в gzip")
+    parser.add_argument("--title", help="фильтр по названию книги (подстрока)")
+    parser.add_argument("--full-name", help="фильтр по ФИО читателя (подстрока)")
+    parser.add_argument("--library", help="библиотека: код или наименование")
+    parser.add_argument("--publisher", help="издательство книги: код или наименование")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--snapshot", choices=MODES,
+                        help="читать снимок базы (db/snapshot.py), а не саму базу")
+    return parser.parse_args()
+
+
+def export(conn, args, files=()):
+    library_id = args.library
+    if library_id and not library_id.isdigit():
+        row = conn.execute("SELECT library_id FROM libraries WHERE name = ?", (library_id,)).fetchone()
+        if row is None:
+            raise SystemExit(f"Библиотека не найдена: {library_id}")
+        library_id = row[0]
+    publisher_id = args.publisher
+    if publisher_id and not publisher_id.isdigit():
+        row = conn.execute("SELECT publisher_id FROM publishers WHERE name = ?", (publisher_id,)).fetchone()
+        if row is None:
+            raise SystemExit(f"Издательство не найдено: {publisher_id}")
+        publisher_id = row[0]
+    return export_table(conn, args.table, args.path, args.format, args.gzip, files, title=args.title,
+                        full_name=args.full_name, library_id=library_id, publisher_id=publisher_id)
+
+
+def main():
+    args = parse_args()
+    if args.snapshot:
+        snapshot = Snapshot(args.db, args.snapshot)
+        with shards.reading(snapshot) as (conn, files):
+            count = export(conn, args, files)
+        shards.close_snapshots(snapshot)
+        close_connection(snapshot.read_path)
+        snapshot.close()
+    else:
+        conn = connect(args.db)
+        count = export(conn, args, shards.ShardRouter(args.db).connections())
+        conn.close()
+    print(f"{args.table}: выгружено {count} строк в {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+import argparse
+import csv
+import time
+
+from db import init_db, shards
+from db.book_ids import allocate_book_ids
+from db.connection import connect, immediate
+from db.init_db import DB_FILE
+from db.reference import copy_publisher
+
+# Строк на одну транзакцию: один commit (и один fsync) на пачку, а не на строку
+BATCH_SIZE = 50000
+# Сколько кодов книг резервировать за одно обращение к счётчику библиотеки
+BOOK_ID_BLOCK = 1000
+# Индексы books, которые --rebuild-indexes не удаляет (см. _drop_books_indexes)
+KEPT_BOOKS_INDEXES = ("idx_books_title_key", "idx_books_author")
+
+
+class ImportStats:
+    def __init__(self, table):
+        self.table = table
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.table}: {self.rows} строк за {self.elapsed:.1f} с "
+                f"({self.rows_per_second():.0f} строк/с)")
+
+
+# ---------- Чтение входных файлов (потоково, по одной записи) ----------
+
+def read_csv(path, encoding="utf-8", delimiter=","):
+    with open(path, newline="", encoding=encoding) as f:
+        for row in csv.DictReader(f, delimiter=delimiter):
+            yield {k.strip(): (v.strip() if v is not None else None) for k, v in row.items() if k}
+
+
+def _subfields(data):
+    # "10$aВойна и мир :$bроман" -> {"a": "Война и мир :", "b": "роман"}
+    result = {}
+    for part in data.split("$")[1:]:
+        if part:
+            result.setdefault(part[0], part[1:].strip())
+    return result
+
+
+def _strip_isbd(value):
+    # Убрать завершающую ISBD-пунктуацию: "Москва :" -> "Москва"
+    return value.rstrip(" /:;,.=") if value else value
+
+
+def read_mrk(path, encoding="utf-8"):
+    # Текстовый MARC (.mrk, MarcEdit): строки "=245  10$aНазвание", записи разделены пустой строкой.
+    # 100$a - автор, 245$a$b - название, 260/264 $a$b$c - место, издательство, год,
+    # 650$a - тематика, 852$a - библиотека, 852$p - код книги, 852$t - количество.
+    record = {}
+    with open(path, encoding=encoding) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                if record:
+                    yield record
+                    record = {}
+                continue
+            if not line.startswith("=") or len(line) < 6:
+                continue
+            tag, data = line[1:4], line[6:]
+            sub = _subfields(data)
+            if tag == "100":
+                # точку не убираем: она часто часть инициалов ("Толстой, Л. Н.")
+                record["author"] = (sub.get("a") or "").rstrip(" ,") or None
+            elif tag == "245":
+                title = _strip_isbd(sub.get("a"))
+                if sub.get("b"):
+                    title = f"{title}: {_strip_isbd(sub['b'])}"
+                record["title"] = title
+            elif tag in ("260", "264"):
+                record["publish_place"] = _strip_isbd(sub.get("a"))
+                record["publisher"] = _strip_isbd(sub.get("b"))
+                year = "".join(ch for ch in sub.get("c", "") if ch.isdigit())[:4]
+                record["publish_year"] = year or None
+            elif tag == "650" and "theme" not in record:
+                record["theme"] = _strip_isbd(sub.get("a"))
+            elif tag == "852":
+                record["library"] = sub.get("a")
+                record["book_id"] = sub.get("p")
+                record["quantity"] = sub.get("t")
+    if record:
+        yield record
+
+
+def read_rows(path, fmt="csv", encoding="utf-8"):
+    if fmt == "mrk":
+        return read_mrk(path, encoding)
+    return read_csv(path, encoding)
+
+
+# ---------- Вспомогательное ----------
+
+def _int_or_none(value):
+    return int(value) if value not in (None, "") else None
+
+
+def _text_or_none(value):
+    return value if value not in (None, "") else None
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _write_batches(conn, sql, rows, stats, batch_size, prepare=list):
+    # Пачка - одна транзакция BEGIN IMMEDIATE. prepare(пачка) -> параметры
+    # строк вызывается внутри неё: его записи (новые значения справочников,
+    # резервирование кодов) фиксируются или откатываются вместе с пачкой.
+    for batch in _batches(rows, batch_size):
+        with immediate(conn):
+            conn.executemany(sql, prepare(batch))
+        stats.rows += len(batch)
+
+
+class NameMap:
+    # Наименование -> id для справочников themes / libraries / publishers.
+    # Загружается один раз, отсутствующие значения добавляются в справочник.
+
+    def __init__(self, conn, table, id_column, insert_sql):
+        self.conn = conn
+        self.insert_sql = insert_sql
+        self.ids = dict(conn.execute(f"SELECT name, {id_column} FROM {table}"))
+
+    def resolve(self, name):
+        if not name:
+            return None
+        key = self.ids.get(name)
+        if key is None:
+            cursor = self.conn.execute(self.insert_sql, (name,))
+            key = self.ids[name] = cursor.lastrowid
+        return key
+
+
+# ---------- Импорт по таблицам ----------
+
+def import_libraries(conn, rows, batch_size=BATCH_SIZE):
+    stats = ImportStats("libraries")
+    params = ((r["name"], r.get("address") or "") for r in rows)
+    _write_batches(conn, """
+        INSERT INTO libraries (name, address) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET address = excluded.address
+    """, params, stats, batch_size)
+    return stats.finish()
+
+
+def import_themes(conn, rows, batch_size=BATCH_SIZE):
+    stats = ImportStats("themes")
+    params = ((r["name"],) for r in rows)
+    _write_batches(conn, "INSERT INTO themes (name) VALUES (?) ON CONFLICT(name) DO NOTHING",
+                   params, stats, batch_size)
+    return stats.finish()
+
+
+def import_readers(conn, rows, batch_size=BATCH_SIZE):
+    # Повторный импорт того же читателя (по телефону) обновляет его данные.
+    # Пустой телефон хранится как NULL, иначе он нарушил бы UNIQUE(phone).
+    stats = ImportStats("readers")
+    params = ((r["full_name"], _text_or_none(r.get("address")), _text_or_none(r.get("phone")))
+              for r in rows)
+    _write_batches(conn, """
+        INSERT INTO readers (full_name, address, phone) VALUES (?, ?, ?)
+        ON CONFLICT(phone) DO UPDATE SET full_name = excluded.full_name, address = excluded.address
+    """, params, stats, batch_size)
+    return stats.finish()
+
+
+class BookParams:
+    # Строки books из входного файла -> параметры INSERT, по пачке за вызов
+    # (prepare для _write_batches): наименования справочников -> коды, коды
+    # книг для строк без book_id - из зарезервированных блоков (resolve и
+    # number - те же шаги по отдельности, для раздельного хранения).
+    # Ошибка в пачке прерывает импорт, поэтому откаченные коды в кэше дальше
+    # не используются.
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.themes = NameMap(conn, "themes", "theme_id", "INSERT INTO themes (name) VALUES (?)")
+        self.libraries = NameMap(conn, "libraries", "library_id",
+                                 "INSERT INTO libraries (name, address) VALUES (?, '')")
+        self.publishers = NameMap(conn, "publishers", "publisher_id", "INSERT INTO publishers (name) VALUES (?)")
+        # Зарезервированные блоки кодов: library_id -> [следующий, конец блока)
+        self.blocks = {}
+
+    def __call__(self, batch):
+        return self.number(self.conn, self.resolve(batch))
+
+    def resolve(self, batch):
+        # Параметры строк; book_id - None, если код не указан
+        return [self.params(r) for r in batch]
+
+    def number(self, conn, params):
+        # Коды книгам без кода - из блоков, зарезервированных в conn
+        # (в файле библиотеки при раздельном хранении)
+        return [p if p[1] is not None else p[:1] + (self.book_id(conn, p[0]),) + p[2:] for p in params]
+
+    def book_id(self, conn, library_id):
+        block = self.blocks.get(library_id)
+        if block is None or block[0] >= block[1]:
+            first = allocate_book_ids(conn, library_id, BOOK_ID_BLOCK)
+            block = self.blocks[library_id] = [first, first + BOOK_ID_BLOCK]
+        block[0] += 1
+        return block[0] - 1
+
+    def publisher_names(self):
+        return {publisher_id: name for name, publisher_id in self.publishers.ids.items()}
+
+    def params(self, r):
+        library_id = _int_or_none(r.get("library_id")) or self.libraries.resolve(r.get("library"))
+        if library_id is None:
+            raise ValueError(f"Не указана библиотека: {r}")
+        theme_id = _int_or_none(r.get("theme_id")) or self.themes.resolve(r.get("theme"))
+        book_id = _int_or_none(r.get("book_id"))
+        quantity = _int_or_none(r.get("quantity"))
+        return (library_id, book_id, theme_id, r["author"], r["title"],
+                self.publishers.resolve(_text_or_none(r.get("publisher"))), _text_or_none(r.get("publish_place")),
+                _int_or_none(r.get("publish_year")), 1 if quantity is None else quantity)
+
+
+def _drop_books_indexes(conn):
+    # Вторичные индексы books, триггеры полнотекстового индекса и сводных таблиц:
+    # после загрузки их дешевле построить заново, чем обновлять на каждой строке.
+    # Индексы KEPT_BOOKS_INDEXES остаются: их называет INDEXED BY в
+    # dedup.similar_books, без них проверка дублей формы падает во время загрузки.
+    objects = conn.execute(f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE (type = 'index' AND name LIKE 'idx\\_books\\_%' ESCAPE '\\'
+               AND name NOT IN ({', '.join('?' * len(KEPT_BOOKS_INDEXES))}))
+           OR (type = 'trigger' AND name LIKE 'books\\_fts\\_%' ESCAPE '\\')
+           OR (type = 'trigger' AND name LIKE 'books\\_stats\\_%' ESCAPE '\\')
+    """, KEPT_BOOKS_INDEXES).fetchall()
+    with immediate(conn):
+        for obj_type, name, _ in objects:
+            conn.execute(f"DROP {obj_type.upper()} {name}")
+    return objects
+
+
+def _restore_books_indexes(conn, objects):
+    with immediate(conn):
+        for _, _, sql in objects:
+            conn.execute(sql)
+    triggers = [name for obj_type, name, _ in objects if obj_type == "trigger"]
+    if any(name.startswith("books_fts_") for name in triggers):
+        # Только индекс книг: в файле библиотеки (db/shards.py) readers_fts нет
+        init_db.rebuild_books_search_index(conn)
+    if any(name.startswith("books_stats_") for name in triggers):
+        init_db.rebuild_stats(conn)
+
+
+BOOKS_INSERT = """
+    INSERT INTO books (library_id, book_id, theme_id, author, title,
+                       publisher_id, publish_place, publish_year, quantity)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(library_id, book_id) DO UPDATE SET
+        theme_id = excluded.theme_id, author = excluded.author, title = excluded.title,
+        publisher_id = excluded.publisher_id, publish_place = excluded.publish_place,
+        publish_year = excluded.publish_year, quantity = excluded.quantity
+"""
+
+
+def _write_shards(router, rows, stats, batch_size, books):
+    # Раздельное хранение (db/shards.py): наименования справочников пачки -
+    # транзакция общей базы, книги - транзакция файла каждой библиотеки вместе
+    # с копиями издательств и резервом кодов. Справочник фиксируется раньше
+    # книг: после ошибки в файле библиотеки новые наименования в нём остаются
+    # (как в BooksForm: сначала издательство, затем книга).
+    for batch in _batches(rows, batch_size):
+        with immediate(books.conn):
+            params = books.resolve(batch)
+        names = books.publisher_names()
+        groups = {}
+        for p in params:
+            groups.setdefault(p[0], []).append(p)
+        for library_id, group in groups.items():
+            conn = router.connection(library_id)
+            with immediate(conn):
+                for publisher_id in {p[5] for p in group} - {None}:
+                    copy_publisher(conn, publisher_id, names[publisher_id])
+                conn.executemany(BOOKS_INSERT, books.number(conn, group))
+        stats.rows += len(batch)
+
+
+def import_books(conn, rows, batch_size=BATCH_SIZE, rebuild_indexes=False, router=None):
+    # router - ShardRouter базы conn: при раздельном хранении книги пишутся
+    # в файлы библиотек, --rebuild-indexes перестраивает индексы в каждом
+    stats = ImportStats("books")
+    sharded = router is not None and router.sharded
+    targets = [shard for _, shard in router.connections()] if sharded else [conn]
+    dropped = [(target, _drop_books_indexes(target)) for target in targets] if rebuild_indexes else []
+    try:
+        if sharded:
+            _write_shards(router, rows, stats, batch_size, BookParams(conn))
+        else:
+            _write_batches(conn, BOOKS_INSERT, rows, stats, batch_size, BookParams(conn))
+    finally:
+        for target, objects in dropped:
+            if objects:
+                _restore_books_indexes(target, objects)
+    return stats.finish()
+
+
+IMPORTERS = {
+    "libraries": import_libraries,
+    "themes": import_themes,
+    "readers": import_readers,
+    "books": import_books,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Пакетная загрузка данных в базу библиотеки")
+    parser.add_argument("table", choices=sorted(IMPORTERS))
+    parser.add_argument("path", help="входной файл")
+    parser.add_argument("--format", choices=("csv", "mrk"), default="csv",
+                        help="csv с заголовком или текстовый MARC (.mrk, только для books)")
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--rebuild-indexes", action="store_true",
+                        help="удалить индексы idx_books_* (кроме нужных поиску дублей) на время загрузки и построить заново")
+    parser.add_argument("--db", default=DB_FILE)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = connect(args.db)
+    rows = read_rows(args.path, args.format, args.encoding)
+    if args.table == "books":
+        stats = import_books(conn, rows, args.batch_size, args.rebuild_indexes, shards.ShardRouter(args.db))
+    else:
+        stats = IMPORTERS[args.table](conn, rows, args.batch_size)
+    conn.close()
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
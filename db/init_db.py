@@ -1,6 +1,8 @@
 import sqlite3
 
+import argparse
 import os
+import sys
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # <- подняться на уровень выше
 DB_DIR = os.path.join(BASE_DIR, "db")
@@ -19,6 +21,34 @@ def create_connection(db_file):
         print("Ошибка подключения:", e)
         return None
 
+# Сводные таблицы: (таблица, ключ)
+STATS_TABLES = (("library_stats", "library_id"), ("theme_stats", "theme_id"))
+
+def _stats_keys(row):
+    # Ключи сводных таблиц для строки books (NEW/OLD)
+    return (row + ".library_id", f"COALESCE({row}.theme_id, 0)")
+
+def _loan_stats_keys(row):
+    # Ключи сводных таблиц для строки subscriptions: тематика берётся у книги
+    return (row + ".library_id", f"""COALESCE((SELECT theme_id FROM books
+                 WHERE library_id = {row}.library_id AND book_id = {row}.book_id), 0)""")
+
+def _is_overdue(row):
+    return f"COALESCE({row}.issue_date < (SELECT overdue_cutoff FROM stats_state), 0)"
+
+def _stats_delta(keys, titles="0", available="0", on_loan="0", overdue="0"):
+    # UPSERT с приращениями в обе сводные таблицы
+    return "".join(f"""
+        INSERT INTO {table} ({key_column}, titles, available, on_loan, overdue)
+        VALUES ({key}, {titles}, {available}, {on_loan}, {overdue})
+        ON CONFLICT({key_column}) DO UPDATE SET
+            titles = titles + excluded.titles, available = available + excluded.available,
+            on_loan = on_loan + excluded.on_loan, overdue = overdue + excluded.overdue;"""
+        for (table, key_column), key in zip(STATS_TABLES, keys))
+
+def _publisher_name(row):
+    return f"(SELECT name FROM publishers WHERE publisher_id = {row}.publisher_id)"
+
 def create_schema(conn):
     cursor = conn.cursor()
 
@@ -56,13 +86,17 @@ def create_schema(conn):
         theme_id INTEGER,
         author TEXT NOT NULL,
         title TEXT NOT NULL,
-        publisher TEXT,
+        -- издательство - ссылка на справочник; наименованием - в представлении books_compat
+        publisher_id INTEGER,
         publish_place TEXT,
-        publish_year INTEGER CHECK(publish_year > 1000 AND publish_year <= strftime('%Y', 'now')),
+        -- strftime('now') в CHECK недопустим (недетерминированная функция),
+        -- верхняя граница совпадает с проверкой в BooksForm.save_record
+        publish_year INTEGER CHECK(publish_year > 1000 AND publish_year <= 2100),
         quantity INTEGER DEFAULT 1 CHECK(quantity >= 0),
         PRIMARY KEY (library_id, book_id),
         FOREIGN KEY (library_id) REFERENCES libraries(library_id) ON DELETE CASCADE,
-        FOREIGN KEY (theme_id) REFERENCES themes(theme_id)
+        FOREIGN KEY (theme_id) REFERENCES themes(theme_id),
+        FOREIGN KEY (publisher_id) REFERENCES publishers(publisher_id)
     );
     """)
 
@@ -91,15 +125,103 @@ def create_schema(conn):
     );
     """)
 
+    # Следующий свободный код книги в каждой библиотеке (см. db/book_ids.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS book_id_sequences (
+        library_id INTEGER PRIMARY KEY,
+        next_id INTEGER NOT NULL,
+        FOREIGN KEY (library_id) REFERENCES libraries(library_id) ON DELETE CASCADE
+    );
+    """)
+
+    # Счётчики изменений справочников для кэша в формах (см. db/reference.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS reference_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    cursor.execute("""
+    INSERT OR IGNORE INTO reference_versions (name)
+    VALUES ('libraries'), ('themes'), ('publishers');
+    """)
+
+    # Сводные счётчики по библиотекам и тематикам (ведут триггеры, см. db/stats.py):
+    # названий, свободных экземпляров, экземпляров на руках и просроченных выдач.
+    # Всего экземпляров = available + on_loan. theme_id = 0 - книги без тематики.
+    for table, key_column in STATS_TABLES:
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            {key_column} INTEGER PRIMARY KEY,
+            titles INTEGER NOT NULL DEFAULT 0,
+            available INTEGER NOT NULL DEFAULT 0,
+            on_loan INTEGER NOT NULL DEFAULT 0,
+            overdue INTEGER NOT NULL DEFAULT 0
+        );
+        """)
+
+    # Просрочка зависит от даты, а не только от изменений: overdue считается
+    # относительно выдач до overdue_cutoff, граница сдвигается раз в день
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stats_state (
+        id INTEGER PRIMARY KEY CHECK(id = 1),
+        overdue_cutoff TEXT
+    );
+    """)
+    cursor.execute("INSERT OR IGNORE INTO stats_state (id) VALUES (1);")
+
+    # Полнотекстовый индекс книг (триграммы: поиск по подстроке, регистр
+    # не учитывается, в том числе для кириллицы).
+    # rowid = library_id * 2^32 + book_id, т.к. у books составной ключ.
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, publisher,
+        library_id UNINDEXED, book_id UNINDEXED,
+        tokenize = 'trigram'
+    );
+    """)
+
+    # Полнотекстовый индекс читателей (текст хранится только в readers)
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS readers_fts USING fts5(
+        full_name, address,
+        content = 'readers', content_rowid = 'reader_id',
+        tokenize = 'trigram'
+    );
+    """)
+
+    # Совпадение в названии / ФИО весит больше, чем в остальных полях
+    cursor.execute("INSERT INTO books_fts(books_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)')")
+    cursor.execute("INSERT INTO readers_fts(readers_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+
     conn.commit()
 
 def create_indexes(conn):
     cursor = conn.cursor()
 
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_books_author ON books(author);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_books_title ON books(title);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_reader ON subscriptions(reader_id);")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_return ON subscriptions(return_date);")
+    # Ключи постраничной навигации: (title, library_id, book_id) и (full_name, reader_id)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_books_title_key ON books(title, library_id, book_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_readers_name ON readers(full_name);")
+    # Книги издательства: внешний ключ и фильтр формы с тем же порядком, что
+    # у постраничной навигации (title, library_id, book_id)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_books_publisher ON books(publisher_id, title, library_id, book_id);")
+    # История и книги на руках читателя; заменяет индекс только по reader_id
+    cursor.execute("DROP INDEX IF EXISTS idx_subscriptions_reader;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_reader_return ON subscriptions(reader_id, return_date);")
+    # Открытые выдачи (return_date IS NULL) - малая часть таблицы: возврат и
+    # продление ищут выдачу по книге, отчёт о просрочке - по дате выдачи.
+    # Частичные индексы заменяют индекс по return_date целиком; поиск всех
+    # выдач книги (library_id, book_id) покрывает первичный ключ.
+    cursor.execute("DROP INDEX IF EXISTS idx_subscriptions_return;")
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_subscriptions_open_book
+    ON subscriptions(library_id, book_id, reader_id, issue_date) WHERE return_date IS NULL;
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_subscriptions_open_date
+    ON subscriptions(issue_date) WHERE return_date IS NULL;
+    """)
 
     conn.commit()
 
@@ -129,27 +251,246 @@ def create_triggers(conn):
     END;
     """)
 
+    # Любое изменение справочника увеличивает его счётчик в reference_versions
+    for table in ("libraries", "themes", "publishers"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_version_after_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE reference_versions SET version = version + 1 WHERE name = '{table}';
+            END;
+            """)
+
+    # Код, введённый вручную или загруженный импортом, сдвигает счётчик библиотеки
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS book_id_sequence_after_insert
+    AFTER INSERT ON books
+    BEGIN
+        UPDATE book_id_sequences
+        SET next_id = NEW.book_id + 1
+        WHERE library_id = NEW.library_id AND next_id <= NEW.book_id;
+    END;
+    """)
+
+    # Сводные счётчики: книги
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS books_stats_insert
+    AFTER INSERT ON books
+    BEGIN{_stats_delta(_stats_keys("NEW"), "1", "NEW.quantity")}
+    END;
+    """)
+
+    # Выдача и возврат меняют quantity - самый частый случай, только приращение
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS books_stats_quantity
+    AFTER UPDATE OF quantity ON books
+    WHEN OLD.library_id = NEW.library_id AND OLD.theme_id IS NEW.theme_id
+         AND OLD.quantity IS NOT NEW.quantity
+    BEGIN{_stats_delta(_stats_keys("NEW"), available="NEW.quantity - OLD.quantity")}
+    END;
+    """)
+
+    # Смена библиотеки или тематики переносит книгу вместе с её выдачами
+    open_loans = """(SELECT COUNT(*) FROM subscriptions
+                 WHERE library_id = OLD.library_id AND book_id = OLD.book_id AND return_date IS NULL)"""
+    overdue_loans = """(SELECT COUNT(*) FROM subscriptions
+                 WHERE library_id = OLD.library_id AND book_id = OLD.book_id AND return_date IS NULL
+                   AND issue_date < (SELECT overdue_cutoff FROM stats_state))"""
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS books_stats_move
+    AFTER UPDATE OF library_id, theme_id ON books
+    WHEN OLD.library_id != NEW.library_id OR OLD.theme_id IS NOT NEW.theme_id
+    BEGIN{_stats_delta(_stats_keys("OLD"), "-1", "-OLD.quantity", "-" + open_loans, "-" + overdue_loans)}
+        {_stats_delta(_stats_keys("NEW"), "1", "NEW.quantity", open_loans, overdue_loans)}
+    END;
+    """)
+
+    # BEFORE: каскадное удаление выдач идёт раньше AFTER-триггера книги,
+    # и к тому моменту ни выдач, ни тематики книги уже не найти
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS books_stats_delete
+    BEFORE DELETE ON books
+    BEGIN{_stats_delta(_stats_keys("OLD"), "-1", "-OLD.quantity", "-" + open_loans, "-" + overdue_loans)}
+    END;
+    """)
+
+    # Сводные счётчики: выдачи (учитываются только открытые)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS subscriptions_stats_insert
+    AFTER INSERT ON subscriptions
+    WHEN NEW.return_date IS NULL
+    BEGIN{_stats_delta(_loan_stats_keys("NEW"), on_loan="1", overdue=_is_overdue("NEW"))}
+    END;
+    """)
+
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS subscriptions_stats_update
+    AFTER UPDATE OF library_id, book_id, issue_date, return_date ON subscriptions
+    WHEN OLD.return_date IS NULL OR NEW.return_date IS NULL
+    BEGIN{_stats_delta(_loan_stats_keys("OLD"), on_loan="-(OLD.return_date IS NULL)",
+                       overdue=f"-((OLD.return_date IS NULL) * {_is_overdue('OLD')})")}
+        {_stats_delta(_loan_stats_keys("NEW"), on_loan="(NEW.return_date IS NULL)",
+                      overdue=f"(NEW.return_date IS NULL) * {_is_overdue('NEW')}")}
+    END;
+    """)
+
+    # При удалении книги выдачи уже вычтены триггером books_stats_delete
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS subscriptions_stats_delete
+    AFTER DELETE ON subscriptions
+    WHEN OLD.return_date IS NULL
+         AND EXISTS (SELECT 1 FROM books WHERE library_id = OLD.library_id AND book_id = OLD.book_id)
+    BEGIN{_stats_delta(_loan_stats_keys("OLD"), on_loan="-1", overdue="-" + _is_overdue("OLD"))}
+    END;
+    """)
+
+    # Синхронизация полнотекстового индекса книг; издательство - наименование из справочника
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS books_fts_insert
+    AFTER INSERT ON books
+    BEGIN
+        INSERT INTO books_fts (rowid, title, author, publisher, library_id, book_id)
+        VALUES (NEW.library_id * 4294967296 + NEW.book_id, NEW.title, NEW.author, {_publisher_name("NEW")},
+                NEW.library_id, NEW.book_id);
+    END;
+    """)
+
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS books_fts_delete
+    AFTER DELETE ON books
+    BEGIN
+        DELETE FROM books_fts WHERE rowid = OLD.library_id * 4294967296 + OLD.book_id;
+    END;
+    """)
+
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS books_fts_update
+    AFTER UPDATE OF library_id, book_id, title, author, publisher_id ON books
+    BEGIN
+        DELETE FROM books_fts WHERE rowid = OLD.library_id * 4294967296 + OLD.book_id;
+        INSERT INTO books_fts (rowid, title, author, publisher, library_id, book_id)
+        VALUES (NEW.library_id * 4294967296 + NEW.book_id, NEW.title, NEW.author, {_publisher_name("NEW")},
+                NEW.library_id, NEW.book_id);
+    END;
+    """)
+
+    # Переименование издательства - заново все его книги в индексе (по idx_books_publisher)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS books_fts_publisher
+    AFTER UPDATE OF name ON publishers
+    WHEN OLD.name IS NOT NEW.name
+    BEGIN
+        DELETE FROM books_fts WHERE rowid IN (
+            SELECT library_id * 4294967296 + book_id FROM books WHERE publisher_id = NEW.publisher_id);
+        INSERT INTO books_fts (rowid, title, author, publisher, library_id, book_id)
+        SELECT library_id * 4294967296 + book_id, title, author, NEW.name, library_id, book_id
+        FROM books WHERE publisher_id = NEW.publisher_id;
+    END;
+    """)
+
+    # Синхронизация полнотекстового индекса читателей (external content)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS readers_fts_insert
+    AFTER INSERT ON readers
+    BEGIN
+        INSERT INTO readers_fts (rowid, full_name, address)
+        VALUES (NEW.reader_id, NEW.full_name, NEW.address);
+    END;
+    """)
+
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS readers_fts_delete
+    AFTER DELETE ON readers
+    BEGIN
+        INSERT INTO readers_fts (readers_fts, rowid, full_name, address)
+        VALUES ('delete', OLD.reader_id, OLD.full_name, OLD.address);
+    END;
+    """)
+
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS readers_fts_update
+    AFTER UPDATE OF reader_id, full_name, address ON readers
+    BEGIN
+        INSERT INTO readers_fts (readers_fts, rowid, full_name, address)
+        VALUES ('delete', OLD.reader_id, OLD.full_name, OLD.address);
+        INSERT INTO readers_fts (rowid, full_name, address)
+        VALUES (NEW.reader_id, NEW.full_name, NEW.address);
+    END;
+    """)
+
     conn.commit()
 
 def create_views(conn):
     cursor = conn.cursor()
 
-    # Просмотр доступных книг
+    # Книги с прежним набором столбцов (издательство - наименованием, как до
+    # справочника publishers) и publisher_id последним: для старых запросов,
+    # форм и выгрузки. Запись через представление (INSTEAD OF) добавляет
+    # новое наименование в справочник.
+    cursor.execute("""
+    CREATE VIEW IF NOT EXISTS books_compat AS
+    SELECT b.library_id, b.book_id, b.theme_id, b.author, b.title, p.name AS publisher,
+           b.publish_place, b.publish_year, b.quantity, b.publisher_id
+    FROM books b
+    LEFT JOIN publishers p ON p.publisher_id = b.publisher_id;
+    """)
+
+    # Без OR IGNORE: отвергнутая вставка сдвигает счётчик AUTOINCREMENT
+    add_publisher = ("INSERT INTO publishers (name) SELECT TRIM(NEW.publisher) WHERE TRIM(NEW.publisher) <> '' "
+                     "AND TRIM(NEW.publisher) NOT IN (SELECT name FROM publishers);")
+    publisher_id = "(SELECT publisher_id FROM publishers WHERE name = TRIM(NEW.publisher))"
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS books_compat_insert
+    INSTEAD OF INSERT ON books_compat
+    BEGIN
+        {add_publisher}
+        INSERT INTO books (library_id, book_id, theme_id, author, title, publisher_id,
+                           publish_place, publish_year, quantity)
+        VALUES (NEW.library_id, NEW.book_id, NEW.theme_id, NEW.author, NEW.title, {publisher_id},
+                NEW.publish_place, NEW.publish_year, COALESCE(NEW.quantity, 1));
+    END;
+    """)
+
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS books_compat_update
+    INSTEAD OF UPDATE ON books_compat
+    BEGIN
+        {add_publisher}
+        UPDATE books SET
+            library_id = NEW.library_id, book_id = NEW.book_id, theme_id = NEW.theme_id,
+            author = NEW.author, title = NEW.title, publisher_id = {publisher_id},
+            publish_place = NEW.publish_place, publish_year = NEW.publish_year, quantity = NEW.quantity
+        WHERE library_id = OLD.library_id AND book_id = OLD.book_id;
+    END;
+    """)
+
     cursor.execute("""
-    CREATE VIEW IF NOT EXISTS available_books AS
+    CREATE TRIGGER IF NOT EXISTS books_compat_delete
+    INSTEAD OF DELETE ON books_compat
+    BEGIN
+        DELETE FROM books WHERE library_id = OLD.library_id AND book_id = OLD.book_id;
+    END;
+    """)
+
+    # Просмотр доступных книг (столбцы - как у books_compat)
+    cursor.execute("DROP VIEW IF EXISTS available_books;")
+    cursor.execute("""
+    CREATE VIEW available_books AS
     SELECT *
-    FROM books
+    FROM books_compat
     WHERE quantity > 0;
     """)
 
-    # Просмотр количества выданных книг по библиотекам
+    # Просмотр количества выданных книг по библиотекам: книги на руках сейчас
+    # (раньше считались все выдачи за всё время) из сводной таблицы
+    cursor.execute("DROP VIEW IF EXISTS issued_books_count;")
     cursor.execute("""
-    CREATE VIEW IF NOT EXISTS issued_books_count AS
-    SELECT s.library_id, l.name AS library_name, COUNT(*) AS issued_count
-    FROM subscriptions s
+    CREATE VIEW issued_books_count AS
+    SELECT s.library_id, l.name AS library_name, s.on_loan AS issued_count
+    FROM library_stats s
     JOIN libraries l ON s.library_id = l.library_id
-    GROUP BY s.library_id
-    HAVING issued_count > 5;
+    WHERE s.on_loan > 5;
     """)
 
     # Просмотр книг с тематиками
@@ -162,14 +503,108 @@ def create_views(conn):
 
     conn.commit()
 
+def rebuild_search_index(conn):
+    # Однократное заполнение полнотекстовых индексов для уже существующих данных
+    cursor = conn.cursor()
+
+    rebuild_books_search_index(conn)
+    cursor.execute("INSERT INTO readers_fts(readers_fts) VALUES ('rebuild');")
+    cursor.execute("INSERT INTO readers_fts(readers_fts) VALUES ('optimize');")
+
+    conn.commit()
+
+def rebuild_books_search_index(conn):
+    # Только индекс книг (также для файлов библиотек, см. db/shards.py)
+    cursor = conn.cursor()
+
+    cursor.execute("DELETE FROM books_fts;")
+    cursor.execute("""
+    INSERT INTO books_fts (rowid, title, author, publisher, library_id, book_id)
+    SELECT b.library_id * 4294967296 + b.book_id, b.title, b.author, p.name, b.library_id, b.book_id
+    FROM books b
+    LEFT JOIN publishers p ON p.publisher_id = b.publisher_id;
+    """)
+    cursor.execute("INSERT INTO books_fts(books_fts) VALUES ('optimize');")
+
+    conn.commit()
+
+def backfill_book_id_sequences(conn):
+    # Заполнить счётчики кодов книг по уже существующим данным
+    cursor = conn.cursor()
+
+    cursor.execute("""
+    INSERT INTO book_id_sequences (library_id, next_id)
+    SELECT library_id, MAX(book_id) + 1 FROM books GROUP BY library_id
+    ON CONFLICT(library_id) DO UPDATE SET next_id = MAX(next_id, excluded.next_id);
+    """)
+
+    conn.commit()
+
+def stats_query(key_column):
+    # Сводные счётчики, посчитанные заново по books и subscriptions
+    key = "b.library_id" if key_column == "library_id" else "COALESCE(b.theme_id, 0)"
+    return f"""
+    SELECT {key} AS {key_column}, COUNT(*) AS titles, SUM(b.quantity) AS available,
+           COALESCE(SUM(l.on_loan), 0) AS on_loan, COALESCE(SUM(l.overdue), 0) AS overdue
+    FROM books b
+    LEFT JOIN (
+        SELECT library_id, book_id, COUNT(*) AS on_loan,
+               COALESCE(SUM(issue_date < (SELECT overdue_cutoff FROM stats_state)), 0) AS overdue
+        FROM subscriptions WHERE return_date IS NULL
+        GROUP BY library_id, book_id
+    ) l ON l.library_id = b.library_id AND l.book_id = b.book_id
+    GROUP BY 1
+    """
+
+def rebuild_stats(conn):
+    # Пересчитать сводные таблицы целиком (после сбоя или массовой загрузки)
+    cursor = conn.cursor()
+
+    for table, key_column in STATS_TABLES:
+        cursor.execute(f"DELETE FROM {table};")
+        cursor.execute(f"INSERT INTO {table} ({key_column}, titles, available, on_loan, overdue)"
+                       + stats_query(key_column))
+
+    conn.commit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Создание и обслуживание базы данных библиотеки")
+    parser.add_argument("--rebuild-search", action="store_true",
+                        help="перестроить полнотекстовый индекс книг и читателей")
+    parser.add_argument("--backfill-ids", action="store_true",
+                        help="заполнить счётчики кодов книг по существующим данным")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     ensure_db_folder()
     conn = create_connection(DB_FILE)
     if conn:
+        has_search = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'books_fts'").fetchone() is not None
+        has_sequences = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'book_id_sequences'").fetchone() is not None
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'library_stats'").fetchone() is not None
         create_schema(conn)
+        # Сначала миграции: индексы и представления ниже описывают последнюю
+        # схему (например, books.publisher_id), старая база до неё доводится здесь.
+        # migrations импортирует этот модуль - поэтому импорт здесь
+        sys.path.insert(0, BASE_DIR)
+        from db import migrations
+        migrations.migrate(conn)
         create_indexes(conn)
         create_triggers(conn)
         create_views(conn)
+        if args.rebuild_search or not has_search:
+            rebuild_search_index(conn)
+            print("Полнотекстовый индекс перестроен.")
+        if args.backfill_ids or not has_sequences:
+            backfill_book_id_sequences(conn)
+            print("Счётчики кодов книг заполнены.")
+        if not has_stats:
+            rebuild_stats(conn)
+            print("Сводные таблицы заполнены.")
         conn.close()
         print("База данных успешно создана и настроена.")
 
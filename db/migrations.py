@@ -0,0 +1,390 @@
+import argparse
+import collections
+import glob
+import os
+import re
+import sqlite3
+import time
+
+from db import connection, init_db, shards
+from db.connection import immediate
+from db.reference import ADD_PUBLISHER
+
+# Версионные миграции схемы. Номер применённой миграции хранится в
+# PRAGMA user_version (0 - база, созданная до появления миграций).
+# init_db.create_* всегда описывают последнюю схему, поэтому каждая миграция
+# должна быть безвредна на уже новой схеме (проверять, есть ли что менять).
+# Обычная миграция выполняется в одной транзакции вместе со сменой user_version.
+# Перестройка большой таблицы (online=True) копирует данные порциями в
+# отдельных транзакциях, чтобы не держать блокировку записи минутами;
+# user_version меняется в короткой завершающей транзакции подмены таблицы.
+
+CHUNK_SIZE = 20000
+# Строк на индекс для ANALYZE после миграции (приблизительная статистика,
+# чтобы ANALYZE на миллионах строк не занимал минуты)
+ANALYSIS_LIMIT = 1000
+
+Migration = collections.namedtuple("Migration", "version description func online")
+Step = collections.namedtuple("Step", "version chunk_size log")
+MIGRATIONS = []
+
+
+def migration(version, description, online=False):
+    def register(func):
+        if MIGRATIONS and MIGRATIONS[-1].version >= version:
+            raise ValueError(f"Миграции должны идти по возрастанию версий: {version}")
+        MIGRATIONS.append(Migration(version, description, func, online))
+        return func
+    return register
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def _set_version(conn, version):
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+
+
+# ---------- Порционная перестройка таблицы ----------
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def rebuild_table(conn, table, create_sql, key, step, values=None, prelude=(), finish=None):
+    # Пересоздать table по create_sql (CREATE TABLE с именем {table}), не
+    # останавливая работу с ней. Данные копируются порциями по ключу key;
+    # изменения, сделанные в table во время копирования (любым соединением),
+    # переносят временные триггеры. Индексы и триггеры таблицы создаются
+    # заново при подмене.
+    # values - {столбец новой таблицы: выражение по старой строке {row}} для
+    # столбцов, которых в старой таблице нет (остальные копируются как есть);
+    # prelude - выражения по строкам {rows} (например, пополнить справочник):
+    # выполняются для всей таблицы в транзакции создания триггеров и в
+    # триггерах для каждой изменённой строки перед её переносом;
+    # finish(conn) - в транзакции подмены, после индексов и триггеров.
+    new = table + "_rebuild"
+    values = values or {}
+    key_list = ", ".join(key)
+    marks = ", ".join("?" * len(key))
+    key_match = " AND ".join(f"{k} = OLD.{k}" for k in key)
+
+    with immediate(conn):
+        _drop_rebuild(conn, new)   # остатки прерванного запуска
+        conn.execute(re.sub(rf'^CREATE TABLE\s+(["`]?){table}\1', f"CREATE TABLE {new}", create_sql.strip(), count=1))
+        columns = _columns(conn, new)
+        column_list = ", ".join(columns)
+        new_row = "(SELECT " + ", ".join(f"NEW.{c} AS {c}" for c in _columns(conn, table)) + ")"
+
+        def source(row):
+            return ", ".join(values.get(c, "{row}." + c).format(row=row) for c in columns)
+
+        steps = "".join(sql.format(rows=new_row) + ";\n" for sql in prelude)
+        conn.execute(f"""
+            CREATE TRIGGER {new}_insert AFTER INSERT ON {table}
+            BEGIN
+                {steps}INSERT OR REPLACE INTO {new} ({column_list}) VALUES ({source("NEW")});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER {new}_update AFTER UPDATE ON {table}
+            BEGIN
+                DELETE FROM {new} WHERE {key_match};
+                {steps}INSERT OR REPLACE INTO {new} ({column_list}) VALUES ({source("NEW")});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER {new}_delete AFTER DELETE ON {table}
+            BEGIN
+                DELETE FROM {new} WHERE {key_match};
+            END
+        """)
+        for sql in prelude:
+            conn.execute(sql.format(rows=table))
+
+    copied = 0
+    last = None
+    started = time.perf_counter()
+    try:
+        while True:
+            # Порция - строки после last до end включительно; каждая порция
+            # в своей транзакции, между ними могут писать другие соединения
+            with immediate(conn):
+                conditions = [] if last is None else [f"({key_list}) > ({marks})"]
+                params = () if last is None else last
+                end = conn.execute(
+                    f"SELECT {key_list} FROM {table}"
+                    + "".join(" WHERE " + c for c in conditions)
+                    + f" ORDER BY {key_list} LIMIT 1 OFFSET ?",
+                    params + (step.chunk_size - 1,)).fetchone()
+                if end is not None:
+                    conditions.append(f"({key_list}) <= ({marks})")
+                    params += tuple(end)
+                cursor = conn.execute(
+                    f"INSERT OR REPLACE INTO {new} ({column_list}) SELECT {source(table)} FROM {table}"
+                    + (" WHERE " + " AND ".join(conditions) if conditions else ""),
+                    params)
+            copied += cursor.rowcount
+            step.log(f"  {table}: скопировано {copied} строк ({time.perf_counter() - started:.1f} с)")
+            if end is None:
+                break
+            last = tuple(end)
+
+        _swap_table(conn, table, new, step, finish)
+    finally:
+        with immediate(conn):
+            _drop_rebuild(conn, new)
+
+
+def _drop_rebuild(conn, new):
+    for suffix in ("insert", "update", "delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {new}_{suffix}")
+    conn.execute(f"DROP TABLE IF EXISTS {new}")
+
+
+def _swap_table(conn, table, new, step, finish=None):
+    # Подмена одной короткой транзакцией (порядок из раздела 7 документации
+    # ALTER TABLE): внешние ключи отключены, чтобы DROP TABLE не удалил выдачи
+    # каскадом; legacy_alter_table - чтобы RENAME не проверял триггеры и
+    # представления, ссылающиеся на ещё не существующую таблицу.
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        with immediate(conn):
+            for suffix in ("insert", "update", "delete"):
+                conn.execute(f"DROP TRIGGER {new}_{suffix}")
+            before = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            after = conn.execute(f"SELECT COUNT(*) FROM {new}").fetchone()[0]
+            if before != after:
+                raise RuntimeError(f"{table}: скопировано {after} строк из {before}")
+            objects = conn.execute("""
+                SELECT sql FROM sqlite_master
+                WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+            """, (table,)).fetchall()
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {new} RENAME TO {table}")
+            for (sql,) in objects:
+                conn.execute(sql)
+            if finish is not None:
+                finish(conn)
+            problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+            if problems:
+                raise RuntimeError(f"Нарушены внешние ключи после перестройки {table}: {problems[:5]}")
+            _set_version(conn, step.version)
+    finally:
+        conn.execute("PRAGMA legacy_alter_table = OFF")
+        conn.execute("PRAGMA foreign_keys = ON")
+
+
+# ---------- Миграции ----------
+
+def _latest_schema():
+    # Объекты последней схемы из init_db (единственный источник схемы):
+    # {имя: (тип, таблица, sql)} в порядке создания
+    scratch = sqlite3.connect(":memory:")
+    init_db.create_schema(scratch)
+    init_db.create_indexes(scratch)
+    init_db.create_triggers(scratch)
+    init_db.create_views(scratch)
+    objects = {name: (obj_type, table, sql) for obj_type, name, table, sql in scratch.execute(
+        "SELECT type, name, tbl_name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY rowid")}
+    scratch.close()
+    return objects
+
+
+# Издательство книги - текст (до миграции 3) или ссылка на справочник publishers
+PUBLISHER_ID = "(SELECT publisher_id FROM publishers WHERE name = TRIM({row}.publisher))"
+ADD_PUBLISHERS = """
+    INSERT INTO publishers (name)
+    SELECT DISTINCT TRIM(publisher) FROM {rows}
+    WHERE TRIM(publisher) <> '' AND TRIM(publisher) NOT IN (SELECT name FROM publishers)"""
+# В файле библиотеки код нового издательства выдаёт общая база: наименования,
+# появившиеся во время перестройки, получают временный отрицательный код
+# (см. _reconcile_publishers)
+ADD_SHARD_PUBLISHERS = """
+    INSERT INTO publishers (publisher_id, name)
+    SELECT -(SELECT COUNT(*) FROM publishers WHERE publisher_id < 0) - ROW_NUMBER() OVER (), name
+    FROM (SELECT DISTINCT TRIM(publisher) AS name FROM {rows}
+          WHERE TRIM(publisher) <> '' AND TRIM(publisher) NOT IN (SELECT name FROM publishers))"""
+# Объекты, читающие books.publisher_id: прежние триггеры books_fts_* читали
+# NEW.publisher, поэтому при подмене таблицы они заменяются определениями из init_db
+PUBLISHER_OBJECTS = ("idx_books_publisher", "books_fts_insert", "books_fts_update", "books_fts_publisher",
+                     "books_compat", "books_compat_insert", "books_compat_update", "books_compat_delete",
+                     "available_books")
+
+
+def _replace_objects(objects):
+    # finish для rebuild_table: [(имя, тип, sql)] пересоздаются по порядку
+    def finish(conn):
+        for name, obj_type, sql in objects:
+            conn.execute(f"DROP {obj_type.upper()} IF EXISTS {name}")
+            conn.execute(sql)
+    return finish
+
+
+def _rebuild_books(conn, step, shard=False):
+    # Перестроить books по последней схеме (в файле библиотеки - без внешних
+    # ключей на общую базу); текстовое издательство заменяется ссылкой
+    schema = _latest_schema()
+    create_sql = schema["books"][2]
+    objects = [(name,) + schema[name] for name in PUBLISHER_OBJECTS]
+    if shard:
+        create_sql = shards.shard_table_sql(create_sql)
+        objects = [obj for obj in objects if shards.in_shard(obj[1], obj[0], obj[2])]
+    objects = [(name, obj_type, sql) for name, obj_type, _, sql in objects]
+    rebuild_table(conn, "books", create_sql, ("library_id", "book_id"), step,
+                  values={"publisher_id": PUBLISHER_ID},
+                  prelude=(ADD_SHARD_PUBLISHERS if shard else ADD_PUBLISHERS,),
+                  finish=_replace_objects(objects))
+
+
+def _reconcile_publishers(conn, shard):
+    # Временные (отрицательные) коды издательств файла библиотеки - на коды общей базы
+    added = shard.execute("SELECT publisher_id, name FROM publishers WHERE publisher_id < 0").fetchall()
+    if not added:
+        return
+    with immediate(conn):
+        conn.executemany(ADD_PUBLISHER, ((name,) for _, name in added))
+    ids = dict(conn.execute("SELECT name, publisher_id FROM publishers"))
+    # Внешний ключ books -> publishers: книга и издательство меняют код вместе
+    shard.execute("PRAGMA foreign_keys = OFF")
+    try:
+        with immediate(shard):
+            for publisher_id, name in added:
+                shard.execute("UPDATE books SET publisher_id = ? WHERE publisher_id = ?", (ids[name], publisher_id))
+                shard.execute("UPDATE publishers SET publisher_id = ? WHERE publisher_id = ?",
+                              (ids[name], publisher_id))
+    finally:
+        shard.execute("PRAGMA foreign_keys = ON")
+
+
+def _link_shard_publishers(conn, step):
+    # Файлы библиотек (db/shards.py): наименования издательств файла - в
+    # справочник общей базы, копия справочника - в файл, затем перестройка books
+    main_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    publishers_sql = _latest_schema()["publishers"][2]
+    for path in sorted(glob.glob(os.path.join(shards.shard_dir(main_path), "library_*.db"))):
+        shard = connection.connect(path)
+        try:
+            if "publisher" not in _columns(shard, "books"):
+                continue
+            names = shard.execute("SELECT DISTINCT TRIM(publisher) FROM books WHERE TRIM(publisher) <> ''").fetchall()
+            with immediate(conn):
+                conn.executemany(ADD_PUBLISHER, names)
+            # Триггер books_fts_publisher появится при подмене books (он читает publisher_id)
+            with immediate(shard):
+                shard.execute(publishers_sql.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+                shard.executemany("INSERT OR REPLACE INTO publishers (publisher_id, name, address) VALUES (?, ?, ?)",
+                                  conn.execute("SELECT publisher_id, name, address FROM publishers"))
+            step.log(f"  {os.path.basename(path)}")
+            _rebuild_books(shard, step, shard=True)
+            _reconcile_publishers(conn, shard)
+            # books_fts хранит прежний текст издательства (без TRIM)
+            init_db.rebuild_books_search_index(shard)
+            optimize(shard)
+        finally:
+            shard.close()
+
+
+@migration(1, "books: CHECK publish_year без strftime('now')", online=True)
+def fix_books_year_check(conn, step):
+    # Недетерминированная функция в CHECK: SQLite отвергает любую запись в books
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'books'").fetchone()[0]
+    check = re.compile(r"publish_year\s*<=\s*strftime\([^)]*\)")
+    if not check.search(sql):
+        with immediate(conn):
+            _set_version(conn, step.version)
+        return
+    # Таблица версии 1: прежнее определение с исправленным CHECK (издательство
+    # остаётся текстом - его переносит миграция 3)
+    rebuild_table(conn, "books", check.sub("publish_year <= 2100", sql), ("library_id", "book_id"), step)
+
+
+@migration(2, "books: удалить idx_books_title (префикс idx_books_title_key)")
+def drop_books_title_index(conn, step):
+    conn.execute("DROP INDEX IF EXISTS idx_books_title")
+
+
+@migration(3, "books: издательство - ссылка publisher_id на справочник publishers", online=True)
+def link_books_publishers(conn, step):
+    # Наименования издательств переносятся в справочник (TRIM, пустые - NULL),
+    # books перестраивается порциями с publisher_id и индексом idx_books_publisher;
+    # старые запросы читают books_compat. При раздельном хранении - и файлы библиотек.
+    # После подмены полнотекстовый индекс строится заново: в нём прежний текст
+    # издательства, а не наименование из справочника.
+    # Сначала файлы библиотек: user_version общей базы меняется последним,
+    # прерванная миграция продолжится с ещё не перестроенных файлов
+    _link_shard_publishers(conn, step)
+    if "publisher" in _columns(conn, "books"):
+        _rebuild_books(conn, step)
+        init_db.rebuild_search_index(conn)
+    with immediate(conn):
+        _set_version(conn, step.version)
+
+
+# ---------- Запуск ----------
+
+def optimize(conn):
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    conn.commit()
+
+
+def migrate(conn, target=None, chunk_size=CHUNK_SIZE, log=print):
+    # Применить миграции новее user_version (до target включительно).
+    # Возвращает [(версия, описание, секунды миграции, секунды ANALYZE)].
+    target = latest_version() if target is None else target
+    applied = []
+    for m in MIGRATIONS:
+        if m.version <= current_version(conn) or m.version > target:
+            continue
+        log(f"Миграция {m.version}: {m.description}")
+        step = Step(m.version, chunk_size, log)
+        started = time.perf_counter()
+        if m.online:
+            m.func(conn, step)
+        else:
+            with immediate(conn):
+                m.func(conn, step)
+                _set_version(conn, m.version)
+        elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        optimize(conn)
+        analyzed = time.perf_counter() - started
+        log(f"  готово за {elapsed:.2f} с, ANALYZE/optimize {analyzed:.2f} с")
+        applied.append((m.version, m.description, elapsed, analyzed))
+    return applied
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    parser.add_argument("--db", help="файл БД (по умолчанию db/library.db)")
+    parser.add_argument("--target", type=int, help="остановиться на этой версии")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="строк в порции при перестройке таблиц")
+    parser.add_argument("--status", action="store_true", help="только показать версии")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = connection.connect(args.db or init_db.DB_FILE)
+    version = current_version(conn)
+    if args.status:
+        for m in MIGRATIONS:
+            print(f"{'+' if m.version <= version else ' '} {m.version:3} {m.description}")
+    else:
+        applied = migrate(conn, args.target, args.chunk_size)
+        total = sum(elapsed + analyzed for _, _, elapsed, analyzed in applied)
+        print(f"Версия схемы: {current_version(conn)}, применено миграций: {len(applied)} за {total:.2f} с")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
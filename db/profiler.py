@@ -0,0 +1,275 @@
+import bisect
+import functools
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Профилирование запросов приложения. Соединения из db.connection создаются
+# с фабрикой ProfiledConnection: каждый execute/executemany и чтение его строк
+# (fetchone/fetchmany/fetchall, итерация) попадают в статистику по тексту
+# запроса - число вызовов, гистограмма длительностей, строки, шаги VM SQLite.
+# Шаги считает progress handler (вызывается каждые PROGRESS_STEPS инструкций),
+# trace callback - сколько выражений SQLite выполнило (триггеры, неявные
+# BEGIN/COMMIT). Для запросов дольше SLOW_MS один раз снимается и пишется
+# в журнал EXPLAIN QUERY PLAN.
+
+SLOW_MS = 50
+PROGRESS_STEPS = 1000
+# Верхние границы корзин гистограммы, мс (последняя корзина - всё, что дольше)
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+log = logging.getLogger(__name__)
+
+
+# Текст запроса приложения почти всегда один и тот же объект-константа
+@functools.lru_cache(maxsize=1024)
+def normalize(sql):
+    return " ".join(sql.split())
+
+
+class StatementStats:
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.vm_steps = 0
+        self.statements = 0
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)
+        self.plan = None
+
+    def add(self, seconds, rows, vm_steps, statements):
+        self.calls += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+        self.vm_steps += vm_steps
+        self.statements += statements
+        self.histogram[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+    def percentile(self, fraction):
+        # Верхняя граница корзины, в которую попадает процентиль, мс
+        wanted = fraction * self.calls
+        seen = 0
+        for i, n in enumerate(self.histogram):
+            seen += n
+            if n and seen >= wanted:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max * 1000
+        return 0.0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.calls, 3) if self.calls else 0.0,
+            "p95_ms": self.percentile(0.95),
+            "max_ms": round(self.max * 1000, 3),
+            "rows": self.rows,
+            "vm_steps": self.vm_steps,
+            "sqlite_statements": self.statements,
+            "histogram": dict(zip([f"<={b}ms" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"], self.histogram)),
+            "plan": self.plan,
+        }
+
+
+class Profiler:
+    # Статистика всех соединений процесса (общая для потоков)
+
+    def __init__(self, slow_ms=SLOW_MS):
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.untracked = {}  # выражения вне execute: COMMIT из with conn и т.п.
+        self.started = time.time()
+
+    def record(self, sql, seconds, rows, vm_steps, statements):
+        with self.lock:
+            stats = self.stats.get(sql)
+            if stats is None:
+                stats = self.stats[sql] = StatementStats()
+            stats.add(seconds, rows, vm_steps, statements)
+            need_plan = stats.plan is None and seconds * 1000 >= self.slow_ms
+            if need_plan:
+                stats.plan = []   # снимается один раз
+        return need_plan
+
+    def set_plan(self, sql, plan):
+        with self.lock:
+            self.stats[sql].plan = plan
+
+    def record_untracked(self, sql):
+        with self.lock:
+            self.untracked[sql] = self.untracked.get(sql, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.untracked.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        # Копия статистики, по убыванию общего времени
+        with self.lock:
+            statements = sorted(((sql, s.as_dict()) for sql, s in self.stats.items()),
+                                key=lambda item: item[1]["total_ms"], reverse=True)
+            return {
+                "since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "slow_ms": self.slow_ms,
+                "statements": [dict(sql=sql, **stats) for sql, stats in statements],
+                "untracked": dict(sorted(self.untracked.items(), key=lambda item: -item[1])),
+            }
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+
+profiler = Profiler()
+
+
+class _Run:
+    # Одно выполнение запроса: время и шаги копятся, пока читаются строки
+    __slots__ = ("sql", "params", "seconds", "rows", "vm_steps", "statements")
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.seconds = 0.0
+        self.rows = 0
+        self.vm_steps = 0
+        self.statements = 0
+
+
+class ProfiledCursor(sqlite3.Cursor):
+
+    def _measure(self, run, func, *args):
+        conn = self.connection
+        conn._active = run
+        steps = conn._vm_steps
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            run.seconds += time.perf_counter() - started
+            run.vm_steps += (conn._vm_steps - steps) * PROGRESS_STEPS
+            conn._active = None
+
+    def _start(self, sql, params, many=False):
+        conn = self.connection
+        conn._finish()
+        run = _Run(normalize(sql), None if many else params)
+        conn._open = run
+        conn._open_cursor = self
+        return run
+
+    def execute(self, sql, params=()):
+        run = self._start(sql, params)
+        self._measure(run, super().execute, sql, params)
+        if self.description is None:
+            # INSERT/UPDATE/DELETE без RETURNING: строк для чтения нет
+            run.rows = max(self.rowcount, 0)
+            self.connection._finish()
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        run = self._start(sql, None, many=True)
+        self._measure(run, super().executemany, sql, seq_of_params)
+        run.rows = max(self.rowcount, 0)
+        self.connection._finish()
+        return self
+
+    def _run(self):
+        run = self.connection._open
+        return run if run is not None and self.connection._open_cursor is self else None
+
+    def fetchone(self):
+        run = self._run()
+        row = super().fetchone() if run is None else self._measure(run, super().fetchone)
+        if run is not None and row is not None:
+            run.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        run = self._run()
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size) if run is None else self._measure(run, super().fetchmany, size)
+        if run is not None:
+            run.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        run = self._run()
+        rows = super().fetchall() if run is None else self._measure(run, super().fetchall)
+        if run is not None:
+            run.rows += len(rows)
+            self.connection._finish()
+        return rows
+
+    def __next__(self):
+        run = self._run()
+        if run is None:
+            return super().__next__()
+        try:
+            row = self._measure(run, super().__next__)
+        except StopIteration:
+            self.connection._finish()
+            raise
+        run.rows += 1
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    # Последний незавершённый запрос соединения (строки ещё читаются)
+    # записывается в статистику при следующем запросе или дочитывании.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._open = None
+        self._open_cursor = None
+        self._active = None
+        self._vm_steps = 0
+        self._explaining = False
+        self.set_progress_handler(self._progress, PROGRESS_STEPS)
+        self.set_trace_callback(self._trace)
+
+    def _progress(self):
+        self._vm_steps += 1
+        return 0
+
+    def _trace(self, statement):
+        if self._active is not None:
+            self._active.statements += 1
+        elif not self._explaining:
+            profiler.record_untracked(normalize(statement))
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def _finish(self):
+        run, self._open = self._open, None
+        if run is None:
+            return
+        if profiler.record(run.sql, run.seconds, run.rows, run.vm_steps, run.statements):
+            self._explain(run)
+
+    def _explain(self, run):
+        self._explaining = True
+        try:
+            cursor = sqlite3.Cursor(self)
+            plan = [detail for _, _, _, detail in
+                    cursor.execute("EXPLAIN QUERY PLAN " + run.sql, run.params or ()).fetchall()]
+        except sqlite3.Error as e:
+            plan = [f"EXPLAIN QUERY PLAN не выполнен: {e}"]
+        finally:
+            self._explaining = False
+        profiler.set_plan(run.sql, plan)
+        log.warning("Медленный запрос (%.1f мс, %d строк): %s\n  %s",
+                    run.seconds * 1000, run.rows, run.sql, "\n  ".join(plan))
@@ -0,0 +1,207 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from db.connection import get_connection
+
+PAGE_SIZE = 50
+
+# Один фоновый поток на всё приложение: подгружает следующую страницу,
+# пока пользователь листает текущую. У потока своё соединение с БД.
+_prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+
+class RecordSource:
+    # Оконный источник записей для навигации << < > >>.
+    # Вместо fetchall() всей таблицы держит в памяти одну страницу вокруг
+    # текущей позиции и переходит между страницами по ключу (keyset-пагинация):
+    # WHERE (k1, k2, ...) > (?, ?, ...) ORDER BY k1, k2, ... LIMIT n.
+    # Ключ должен однозначно задавать порядок записей и входить в columns.
+    # table может быть подзапросом "(SELECT ...)": его параметры идут первыми в params.
+    # Если весь результат уместился на одной странице (complete), навигация
+    # идёт без запросов к БД.
+
+    def __init__(self, table, columns, key, page_size=PAGE_SIZE, db_path=None):
+        self.db_path = db_path
+        self.table = table
+        self.columns = columns
+        self.key = key
+        self.key_idx = [columns.index(k) for k in key]
+        self.page_size = page_size
+
+        self.where_clause = ""
+        self.params = ()
+        self.page = []
+        self.pos = 0
+        self.complete = False
+        self._count = None
+        self._prefetch = None  # (ключ последней записи страницы, отбор, future)
+
+    def _spec(self):
+        # Отбор текущего запроса: (where_clause, params)
+        return self.where_clause, self.params
+
+    def _select(self, spec, extra_where="", extra_params=(), descending=False):
+        where_clause, params = spec
+        conditions = []
+        if where_clause:
+            conditions.append("(" + where_clause + ")")
+        if extra_where:
+            conditions.append(extra_where)
+        query = "SELECT " + ", ".join(self.columns) + " FROM " + self.table
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        direction = " DESC" if descending else ""
+        query += " ORDER BY " + ", ".join(k + direction for k in self.key)
+        query += " LIMIT ?"
+        return query, tuple(params) + tuple(extra_params) + (self.page_size,)
+
+    def _key_condition(self, op):
+        return "(" + ", ".join(self.key) + ") " + op + " (" + ", ".join("?" * len(self.key)) + ")"
+
+    def _row_key(self, row):
+        return tuple(row[i] for i in self.key_idx)
+
+    def _fetch(self, mode, key=None, spec=None):
+        # spec - отбор (_spec), по умолчанию текущий; фоновое чтение получает
+        # его при постановке в очередь, а не читает атрибуты при выполнении
+        spec = spec or self._spec()
+        if mode == "first":
+            query, params = self._select(spec)
+        elif mode == "last":
+            query, params = self._select(spec, descending=True)
+        elif mode == "after":
+            query, params = self._select(spec, self._key_condition(">"), key)
+        elif mode == "from":
+            query, params = self._select(spec, self._key_condition(">="), key)
+        else:  # before
+            query, params = self._select(spec, self._key_condition("<"), key, descending=True)
+        descending = mode in ("last", "before")
+        rows = self._execute(query, params, descending)
+        if descending:
+            rows.reverse()
+        return rows
+
+    def _execute(self, query, params, descending=False):
+        # Строки одной страницы в порядке ключа (descending - в обратном)
+        return get_connection(self.db_path).execute(query, params).fetchall()
+
+    def connections(self):
+        # Соединения, из которых читаются записи (см. db/shards.py)
+        return [get_connection(self.db_path)]
+
+    def _set_page(self, rows, pos, complete=False):
+        self.page = rows
+        self.pos = pos
+        self.complete = complete
+        self._prefetch = None
+        # Страница заполнена целиком - вероятно, дальше есть ещё записи
+        if not complete and len(rows) == self.page_size:
+            key, spec = self._row_key(rows[-1]), self._spec()
+            self._prefetch = (key, spec, _prefetcher.submit(self._fetch, "after", key, spec))
+
+    def reset(self, where_clause="", params=()):
+        self.where_clause = where_clause
+        self.params = params
+        rows = self._fetch("first")
+        complete = len(rows) < self.page_size
+        self._count = len(rows) if complete else None
+        self._set_page(rows, 0, complete)
+
+    def page_after(self, where_clause, params, key=None):
+        # Одна страница после ключа key (None - первая) без смены текущей
+        # позиции и отбора: запрос без состояния, например из HTTP API (db/api.py)
+        spec = (where_clause, params)
+        return self._fetch("first", spec=spec) if key is None else self._fetch("after", tuple(key), spec)
+
+    def load(self, where_clause, params, rows, complete):
+        # Показать готовую первую страницу того же запроса (из кэша поиска).
+        # complete - rows содержат весь результат; иначе следующие страницы
+        # читаются из БД по ключу последней строки.
+        self.where_clause = where_clause
+        self.params = params
+        self._count = len(rows) if complete else None
+        self._set_page(list(rows), 0, complete)
+
+    def replace_rows(self, patch):
+        # Подставить изменённые строки (после пакетной операции) без чтения
+        # из БД: patch(строка) - новая строка или та же
+        self.page = [patch(row) for row in self.page]
+        self._prefetch = None
+
+    def remove_rows(self, removed):
+        # Убрать удалённые записи (removed(строка) - True) со страницы;
+        # текущей становится следующая
+        self.pos -= sum(1 for row in self.page[:self.pos] if removed(row))
+        self.page = [row for row in self.page if not removed(row)]
+        self.pos = max(0, min(self.pos, len(self.page) - 1))
+        self._count = len(self.page) if self.complete else None
+        self._prefetch = None
+
+    def seek(self, row):
+        # Встать на запись row (например, выбранную в табличном режиме)
+        rows = self._fetch("from", self._row_key(row))
+        self._set_page(rows, 0)
+        return bool(rows)
+
+    def current(self):
+        if not self.page:
+            return None
+        return self.page[self.pos]
+
+    def count(self):
+        if self._count is None:
+            query = "SELECT COUNT(*) FROM " + self.table
+            if self.where_clause:
+                query += " WHERE " + self.where_clause
+            self._count = get_connection(self.db_path).execute(query, self.params).fetchone()[0]
+        return self._count
+
+    def first(self):
+        if not self.page:
+            return False
+        if self.complete:
+            self.pos = 0
+            return True
+        self._set_page(self._fetch("first"), 0)
+        return True
+
+    def last(self):
+        if not self.page:
+            return False
+        if self.complete:
+            self.pos = len(self.page) - 1
+            return True
+        rows = self._fetch("last")
+        self._set_page(rows, len(rows) - 1)
+        return True
+
+    def next(self):
+        if not self.page:
+            return False
+        if self.pos < len(self.page) - 1:
+            self.pos += 1
+            return True
+        if self.complete:
+            return False
+        key = self._row_key(self.page[-1])
+        if self._prefetch is not None and self._prefetch[:2] == (key, self._spec()):
+            rows = self._prefetch[2].result()
+        else:
+            rows = self._fetch("after", key)
+        if not rows:
+            return False
+        self._set_page(rows, 0)
+        return True
+
+    def prev(self):
+        if not self.page:
+            return False
+        if self.pos > 0:
+            self.pos -= 1
+            return True
+        if self.complete:
+            return False
+        rows = self._fetch("before", self._row_key(self.page[0]))
+        if not rows:
+            return False
+        self._set_page(rows, len(rows) - 1)
+        return True
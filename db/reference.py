@@ -0,0 +1,103 @@
+import threading
+
+from db.connection import get_connection
+
+# Справочники, которые формы показывают в выпадающих списках
+QUERIES = {
+    "libraries": "SELECT library_id, name FROM libraries ORDER BY name",
+    "themes": "SELECT theme_id, name FROM themes ORDER BY name",
+    "publishers": "SELECT publisher_id, name FROM publishers ORDER BY name",
+}
+
+
+class Lookup:
+    # Строки справочника (id, name) в порядке списка и словари для поиска за O(1)
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.index_by_id = {row[0]: i for i, row in enumerate(rows)}
+        self.id_by_name = {row[1]: row[0] for row in rows}
+
+    def names(self):
+        return [row[1] for row in self.rows]
+
+    def index_of(self, key):
+        return self.index_by_id.get(key)
+
+    def id_of(self, name):
+        return self.id_by_name.get(name)
+
+
+class ReferenceData:
+    # Общий кэш справочников для всех форм одного потока (потока Tk).
+    # Перечитывается только изменившийся справочник:
+    # - PRAGMA data_version меняется после commit в других соединениях,
+    # - total_changes - после изменений через это же соединение;
+    # в обоих случаях сверяются счётчики reference_versions (их ведут триггеры).
+    # Первую загрузку можно выполнить в рабочем потоке (refresh через
+    # QueryExecutor при запуске): справочники - просто данные, а поток Tk
+    # потом только сверит версии своим соединением.
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self.lookups = {}
+        self.versions = {}
+        self.seen = None
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        self.refresh()
+        return self.lookups[name]
+
+    def refresh(self):
+        conn = get_connection(self.db_path)
+        with self.lock:
+            # Счётчики своего соединения: у каждого потока data_version свой
+            seen = (id(conn), conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+            if seen == self.seen and len(self.lookups) == len(QUERIES):
+                return
+            self.seen = seen
+            versions = dict(conn.execute("SELECT name, version FROM reference_versions"))
+            for name, query in QUERIES.items():
+                if name not in self.lookups or versions.get(name) != self.versions.get(name):
+                    self.lookups[name] = Lookup(conn.execute(query).fetchall())
+                    self.versions[name] = versions.get(name)
+
+    @property
+    def libraries(self):
+        return self.get("libraries")
+
+    @property
+    def themes(self):
+        return self.get("themes")
+
+    @property
+    def publishers(self):
+        return self.get("publishers")
+
+
+registry = ReferenceData()
+
+
+# ---------- Издательства ----------
+
+# Новое наименование. Не INSERT OR IGNORE: отвергнутая вставка всё равно
+# сдвигает счётчик AUTOINCREMENT, и коды издательств шли бы с пропусками
+ADD_PUBLISHER = "INSERT INTO publishers (name) SELECT ?1 WHERE NOT EXISTS (SELECT 1 FROM publishers WHERE name = ?1)"
+
+
+def publisher_id(conn, name):
+    # Код издательства по наименованию, новое - в справочник (выражения без
+    # commit: транзакция - QueryExecutor.submit_write); пустое - None
+    name = (name or "").strip()
+    if not name:
+        return None
+    conn.execute(ADD_PUBLISHER, (name,))
+    return conn.execute("SELECT publisher_id FROM publishers WHERE name = ?", (name,)).fetchone()[0]
+
+
+def copy_publisher(conn, publisher_id, name):
+    # Строка справочника общей базы в копию файла библиотеки (db/shards.py)
+    # перед записью книги. Имеющаяся строка не меняется: наименование в форме
+    # могло устареть, переименования переносит ShardRouter.sync_publishers
+    conn.execute("INSERT OR IGNORE INTO publishers (publisher_id, name) VALUES (?, ?)", (publisher_id, name))
@@ -0,0 +1,348 @@
+import argparse
+import collections
+import datetime
+import sys
+
+from db import dedup, exporter, shards, snapshot
+from db.circulation import LOAN_DAYS
+from db.connection import close_connection
+from db.init_db import DB_FILE
+from db.stats import overdue_cutoff
+
+# Отчёты по выдачам: список просроченных на день, история читателя, динамика
+# выдач и возвратов по библиотекам или тематикам (день, неделя, месяц).
+# Отбор, соединения и агрегаты выполняет SQLite (оконные функции - номер
+# строки, накопленные суммы, изменение к прошлому периоду), Python только
+# читает результат порциями (fetchmany) и пишет их в CSV/JSON (writers
+# db/exporter) или в окно отчёта (form/report_form.py). Отчёты читают снимок
+# базы (db/snapshot.py), чтобы тяжёлое чтение не задерживало выдачу книг.
+# При раздельном хранении (db/shards.py) выдачи и книги отбираются в каждом
+# файле библиотеки и сводятся во временные таблицы соединения отчёта (_collect),
+# итоговый запрос (с читателями и справочниками общей базы) - один.
+#
+# Динамика строится в два прохода. Сначала выдачи и возвраты сводятся по
+# (ключ, день) во временную таблицу report_daily: один просмотр subscriptions,
+# каждая строка дважды (день выдачи и день возврата) добавляется к счётчикам
+# через INSERT ... ON CONFLICT DO UPDATE. Счётчиков - десятки тысяч, они
+# в кэше, поэтому это в 2-3 раза быстрее GROUP BY, который сортировал бы все
+# строки таблицы. Неделя или месяц и оконные функции вычисляются уже по
+# дневным итогам - по строке на день, а не на каждую выдачу. По файлам
+# библиотек report_daily строится в каждом, затем дневные итоги складываются.
+
+# Report: заголовок, имена столбцов, запрос и его параметры, prepare -
+# выражения [(sql, params)] или функции func(conn, files), выполняемые перед
+# запросом тем же соединением (files - файлы библиотек, см. stream)
+Report = collections.namedtuple("Report", "title columns query params prepare", defaults=((),))
+
+# Выдачи отчёта вместе с полями книги (overdue, history)
+LOANS_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS report_loans (
+        library_id, book_id, reader_id, issue_date, return_date, advance, title, author, theme_id
+    )"""
+LOANS_FILL = """
+    INSERT INTO report_loans
+    SELECT s.library_id, s.book_id, s.reader_id, s.issue_date, s.return_date, s.advance,
+           b.title, b.author, b.theme_id
+    FROM subscriptions s
+    JOIN books b ON b.library_id = s.library_id AND b.book_id = s.book_id
+    WHERE {conditions}
+"""
+CANDIDATES_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS dedup_candidates (
+        cluster INTEGER, n INTEGER, ref1 INTEGER, ref2 INTEGER, score REAL, reason TEXT,
+        PRIMARY KEY (cluster, n)
+    ) WITHOUT ROWID"""
+
+BUCKETS = {
+    "day": "day",
+    # Понедельник недели: strftime('%w') - 0 для воскресенья
+    "week": "date(day, '-' || ((CAST(strftime('%w', day) AS INTEGER) + 6) % 7) || ' days')",
+    "month": "substr(day, 1, 7) || '-01'",
+}
+
+# Ключ динамики: выражение по s (subscriptions) и b (books), справочник имён
+TREND_KEYS = {
+    "library": ("s.library_id", "libraries", "library_id"),
+    "theme": ("COALESCE(b.theme_id, 0)", "themes", "theme_id"),
+}
+
+
+def _today(today):
+    return (today or datetime.date.today()).isoformat()
+
+
+def _rows(conn, query, params=()):
+    # Курсор запроса и INSERT для его строк в таблицу с теми же столбцами
+    cursor = conn.execute(query, params)
+    return cursor, ", ".join("?" * len(cursor.description))
+
+
+def _collect(create, table, fill, params=(), merge=None, shared=()):
+    # Шаг prepare: временная table (create) соединения отчёта, заполненная
+    # выражением fill по книгам и выдачам. Без раскладки fill выполняется в
+    # самом соединении. При раздельном хранении - в каждом файле библиотеки
+    # (в его временной table), затем строки добавляются в соединение отчёта
+    # (merge - INSERT для них, по умолчанию простой). shared - [(create, имя)]
+    # временные таблицы соединения отчёта, которые читает fill: копируются
+    # в файлы библиотек перед ним.
+    def step(conn, files):
+        sources = [source for _, source in files] or [conn]
+        for target in [conn] + [source for source in sources if source is not conn]:
+            target.execute(create)
+            target.execute(f"DELETE FROM {table}")
+        for source in sources:
+            if source is not conn:
+                for shared_create, name in shared:
+                    source.execute(shared_create)
+                    source.execute(f"DELETE FROM {name}")
+                    cursor, marks = _rows(conn, f"SELECT * FROM {name}")
+                    source.executemany(f"INSERT INTO {name} VALUES ({marks})", cursor)
+            source.execute(fill, params)
+            if source is not conn:
+                cursor, marks = _rows(source, f"SELECT * FROM {table}")
+                conn.executemany(merge or f"INSERT INTO {table} VALUES ({marks})", cursor)
+    return step
+
+
+def overdue_report(today=None, library_id=None):
+    # Невозвращённые выдачи старше LOAN_DAYS дней (частичный индекс открытых выдач
+    # по дате). n - номер в списке библиотеки, reader_overdue - сколько всего
+    # просрочено у читателя (оконные функции).
+    today = today or datetime.date.today()
+    conditions = ["s.return_date IS NULL", "s.issue_date < ?"]
+    params = [overdue_cutoff(today)]
+    if library_id is not None:
+        conditions.append("s.library_id = ?")
+        params.append(library_id)
+    prepare = (_collect(LOANS_TABLE, "report_loans", LOANS_FILL.format(conditions=" AND ".join(conditions)),
+                        tuple(params)),)
+    query = f"""
+        SELECT s.library_id, l.name, ROW_NUMBER() OVER (
+                   PARTITION BY s.library_id ORDER BY s.issue_date, s.book_id, s.reader_id) AS n,
+               s.book_id, s.title, s.author, t.name, s.reader_id, r.full_name, r.phone,
+               substr(s.issue_date, 1, 10),
+               date(substr(s.issue_date, 1, 10), '+{LOAN_DAYS} days'),
+               CAST(julianday(?) - julianday(substr(s.issue_date, 1, 10)) AS INTEGER) - {LOAN_DAYS},
+               COUNT(*) OVER (PARTITION BY s.reader_id)
+        FROM report_loans s
+        JOIN readers r ON r.reader_id = s.reader_id
+        JOIN libraries l ON l.library_id = s.library_id
+        LEFT JOIN themes t ON t.theme_id = s.theme_id
+        ORDER BY s.library_id, n
+    """
+    columns = ("library_id", "library", "n", "book_id", "title", "author", "theme", "reader_id",
+               "full_name", "phone", "issue_date", "due_date", "days_overdue", "reader_overdue")
+    return Report(f"Просроченные выдачи на {_today(today)}", columns, query, (_today(today),), prepare)
+
+
+def history_report(reader_id, today=None):
+    # Все выдачи читателя (индекс по reader_id) по порядку: дни на руках,
+    # перерыв с прошлой выдачи (LAG), накопленная сумма залогов
+    today = today or datetime.date.today()
+    prepare = (_collect(LOANS_TABLE, "report_loans", LOANS_FILL.format(conditions="s.reader_id = ?"),
+                        (reader_id,)),)
+    query = """
+        SELECT ROW_NUMBER() OVER w, s.library_id, s.book_id, s.title, s.author, t.name,
+               substr(s.issue_date, 1, 10), substr(s.return_date, 1, 10),
+               CAST(julianday(COALESCE(substr(s.return_date, 1, 10), ?))
+                    - julianday(substr(s.issue_date, 1, 10)) AS INTEGER),
+               s.return_date IS NULL AND s.issue_date < ?,
+               CAST(julianday(substr(s.issue_date, 1, 10))
+                    - julianday(substr(LAG(s.issue_date) OVER w, 1, 10)) AS INTEGER),
+               s.advance, SUM(s.advance) OVER w
+        FROM report_loans s
+        LEFT JOIN themes t ON t.theme_id = s.theme_id
+        WINDOW w AS (ORDER BY s.issue_date, s.library_id, s.book_id)
+        ORDER BY s.issue_date, s.library_id, s.book_id
+    """
+    columns = ("n", "library_id", "book_id", "title", "author", "theme", "issue_date", "return_date",
+               "days", "overdue", "days_since_previous", "advance", "advance_total")
+    return Report(f"История выдач читателя {reader_id}", columns, query,
+                  (_today(today), overdue_cutoff(today)), prepare)
+
+
+def trends_report(by="library", bucket="month", date_from=None, date_to=None):
+    # Выдачи и возвраты по периодам; date_from/date_to - "ГГГГ-ММ-ДД", до - не включая.
+    # issued_total - с начала отчёта, change - к прошлому периоду ключа,
+    # share - доля ключа среди всех выдач периода, %.
+    key, names, name_key = TREND_KEYS[by]
+    join = "JOIN books b ON b.library_id = s.library_id AND b.book_id = s.book_id" if by == "theme" else ""
+    # k.kind = 0 - строка считается как выдача, 1 - как возврат
+    conditions = {0: ["k.kind = 0"], 1: ["k.kind = 1", "s.return_date IS NOT NULL"]}
+    params = []
+    for kind, column in ((0, "s.issue_date"), (1, "s.return_date")):
+        if date_from:
+            conditions[kind].append(f"{column} >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions[kind].append(f"{column} < ?")
+            params.append(date_to)
+    daily = f"""
+        INSERT INTO report_daily (key, day, issued, returned)
+        SELECT {key}, substr(CASE k.kind WHEN 0 THEN s.issue_date ELSE s.return_date END, 1, 10),
+               1 - k.kind, k.kind
+        FROM subscriptions s {join}
+        CROSS JOIN (SELECT 0 AS kind UNION ALL SELECT 1) k
+        WHERE ({" AND ".join(conditions[0])}) OR ({" AND ".join(conditions[1])})
+        ON CONFLICT DO UPDATE SET issued = issued + excluded.issued, returned = returned + excluded.returned
+    """
+    prepare = (
+        _collect("""CREATE TEMP TABLE IF NOT EXISTS report_daily (
+                        key INTEGER, day TEXT, issued INTEGER, returned INTEGER,
+                        PRIMARY KEY (key, day)
+                    ) WITHOUT ROWID""", "report_daily", daily, tuple(params),
+                 merge="""INSERT INTO report_daily VALUES (?, ?, ?, ?) ON CONFLICT DO UPDATE
+                          SET issued = issued + excluded.issued, returned = returned + excluded.returned"""),
+    )
+    query = f"""
+        WITH buckets AS (
+            SELECT key, {BUCKETS[bucket]} AS bucket, SUM(issued) AS issued, SUM(returned) AS returned
+            FROM report_daily GROUP BY 1, 2
+        )
+        SELECT k.key, COALESCE(n.name, '-'), k.bucket, k.issued, k.returned,
+               SUM(k.issued) OVER (PARTITION BY k.key ORDER BY k.bucket),
+               k.issued - LAG(k.issued, 1, 0) OVER (PARTITION BY k.key ORDER BY k.bucket),
+               ROUND(100.0 * k.issued / NULLIF(SUM(k.issued) OVER (PARTITION BY k.bucket), 0), 1)
+        FROM buckets k
+        LEFT JOIN {names} n ON n.{name_key} = k.key
+        ORDER BY k.key, k.bucket
+    """
+    columns = (by + "_id", by, bucket, "issued", "returned", "issued_total", "change", "share")
+    return Report(f"Выдачи и возвраты: {by}, {bucket}", columns, query, (), prepare)
+
+
+def duplicates_report(kind="books", threshold=dedup.THRESHOLD, library_id=None):
+    # Кандидаты на слияние (db/dedup.py): группы похожих записей, первая в
+    # группе - образец, score - сходство с ним, reason - точное совпадение
+    # после нормализации, общий телефон или похожий текст
+    # Поля книг-кандидатов и число выдач - из файлов библиотек (_collect)
+    prepare = [
+        (CANDIDATES_TABLE, ()),
+        ("DELETE FROM dedup_candidates", ()),
+        lambda conn, files: dedup.fill_candidates(conn, kind, threshold, library_id, files),
+    ]
+    shared = ((CANDIDATES_TABLE, "dedup_candidates"),)
+    if kind == "books":
+        prepare.append(_collect("""
+            CREATE TEMP TABLE IF NOT EXISTS report_books (
+                library_id, book_id, author, title, publisher, publish_year, quantity, loans
+            )""", "report_books", """
+            INSERT INTO report_books
+            SELECT b.library_id, b.book_id, b.author, b.title, b.publisher, b.publish_year, b.quantity,
+                   (SELECT COUNT(*) FROM subscriptions s
+                    WHERE s.library_id = b.library_id AND s.book_id = b.book_id)
+            FROM dedup_candidates d
+            JOIN books_compat b ON b.library_id = d.ref1 AND b.book_id = d.ref2
+        """, shared=shared))
+        query = """
+            SELECT d.cluster, d.n, d.score, d.reason, b.library_id, b.book_id, b.author, b.title,
+                   b.publisher, b.publish_year, b.quantity, b.loans
+            FROM dedup_candidates d
+            JOIN report_books b ON b.library_id = d.ref1 AND b.book_id = d.ref2
+            ORDER BY d.cluster, d.n
+        """
+        columns = ("cluster", "n", "score", "reason", "library_id", "book_id", "author", "title",
+                   "publisher", "publish_year", "quantity", "loans")
+    else:
+        prepare.append(_collect("""
+            CREATE TEMP TABLE IF NOT EXISTS report_reader_loans (
+                reader_id INTEGER PRIMARY KEY, loans INTEGER
+            )""", "report_reader_loans", """
+            INSERT INTO report_reader_loans
+            SELECT reader_id, COUNT(*) FROM subscriptions
+            WHERE reader_id IN (SELECT ref1 FROM dedup_candidates)
+            GROUP BY reader_id
+        """, merge="""INSERT INTO report_reader_loans VALUES (?, ?)
+                      ON CONFLICT DO UPDATE SET loans = loans + excluded.loans""", shared=shared))
+        query = """
+            SELECT d.cluster, d.n, d.score, d.reason, r.reader_id, r.full_name, r.address, r.phone,
+                   COALESCE(l.loans, 0) AS loans
+            FROM dedup_candidates d
+            JOIN readers r ON r.reader_id = d.ref1
+            LEFT JOIN report_reader_loans l ON l.reader_id = r.reader_id
+            ORDER BY d.cluster, d.n
+        """
+        columns = ("cluster", "n", "score", "reason", "reader_id", "full_name", "address", "phone", "loans")
+    title = "Кандидаты на слияние: " + ("книги" if kind == "books" else "читатели")
+    return Report(title, columns, query, (), tuple(prepare))
+
+
+def stream(conn, report, fetch_size=exporter.FETCH_SIZE, files=()):
+    # Строки отчёта порциями; в памяти не больше одной порции. files -
+    # [(library_id, соединение)] файлов библиотек при раздельном хранении
+    # (ShardRouter.connections, shards.snapshot_connections), conn - общая база
+    for step in report.prepare:
+        if callable(step):
+            step(conn, files)
+        else:
+            conn.execute(*step)
+    cursor = conn.execute(report.query, report.params)
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        yield rows
+
+
+WRITERS = {
+    "csv": exporter.write_csv,
+    "json": exporter.write_jsonl,
+}
+
+
+def write(conn, report, path, fmt="csv", compress=False, files=()):
+    return WRITERS[fmt](stream(conn, report, files=files), report.columns, path, compress)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Отчёты по выдачам книг")
+    parser.add_argument("report", choices=("overdue", "history", "trends", "duplicates"))
+    parser.add_argument("--out", help="выходной файл (по умолчанию - таблица в stdout)")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--today", type=datetime.date.fromisoformat, help="дата отчёта, ГГГГ-ММ-ДД")
+    parser.add_argument("--library", type=int, help="overdue, duplicates: только одна библиотека")
+    parser.add_argument("--reader", type=int, help="history: код читателя")
+    parser.add_argument("--by", choices=sorted(TREND_KEYS), default="library")
+    parser.add_argument("--bucket", choices=sorted(BUCKETS), default="month")
+    parser.add_argument("--from", dest="date_from", help="trends: с даты ГГГГ-ММ-ДД")
+    parser.add_argument("--to", dest="date_to", help="trends: до даты (не включая)")
+    parser.add_argument("--kind", choices=("books", "readers"), default="books", help="duplicates: что искать")
+    parser.add_argument("--threshold", type=float, default=dedup.THRESHOLD, help="duplicates: порог сходства")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--snapshot", choices=snapshot.MODES, default=snapshot.MODE)
+    return parser.parse_args()
+
+
+def build(args):
+    if args.report == "overdue":
+        return overdue_report(args.today, args.library)
+    if args.report == "history":
+        if args.reader is None:
+            raise SystemExit("history: нужен --reader")
+        return history_report(args.reader, args.today)
+    if args.report == "duplicates":
+        return duplicates_report(args.kind, args.threshold, args.library)
+    return trends_report(args.by, args.bucket, args.date_from, args.date_to)
+
+
+def main():
+    args = parse_args()
+    report = build(args)
+    reports = snapshot.Snapshot(args.db, args.snapshot)
+    with shards.reading(reports) as (conn, files):
+        if args.out:
+            count = write(conn, report, args.out, args.format, args.gzip, files)
+            print(f"{report.title}: {count} строк в {args.out}", file=sys.stderr)
+        else:
+            print("\t".join(report.columns))
+            for rows in stream(conn, report, files=files):
+                for row in rows:
+                    print("\t".join("" if value is None else str(value) for value in row))
+    shards.close_snapshots(reports)
+    close_connection(reports.read_path)
+    reports.close()
+
+
+if __name__ == "__main__":
+    main()
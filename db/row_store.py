@@ -0,0 +1,191 @@
+import array
+import itertools
+import math
+
+# Компактное хранение загруженных строк (кэш поиска, страницы табличного
+# режима) по столбцам вместо списка кортежей. Кортеж из sqlite3 - это объект
+# на строку плюс отдельный объект на каждое значение, даже если автор или
+# издательство повторяются в тысячах строк. Здесь:
+#   целые (коды, год, количество) - array("q"), дробные - array("d");
+#   строки - словарное кодирование: массив кодов ("H"/"I") и список различных
+#     значений (автор, издательство, место издания повторяются);
+#   столбец, где почти все значения разные (название), - список строк.
+# Строка собирается в кортеж при обращении: store[i], срезы, итерация - так
+# что хранилище подставляется туда, где раньше был список кортежей.
+
+# NULL в числовых столбцах
+NULL_INT = -2 ** 63
+# Словарь не нужен, если различных значений больше этой доли строк
+UNIQUE_SHARE = 0.5
+# Строк в порции при построении (fetchmany) и обходе
+CHUNK = 10000
+
+
+class _Column:
+    # Построение одного столбца: тип выбирается по значениям и при
+    # необходимости расширяется (целые -> дробные -> словарь).
+    # Коды словаря - порядок вставки в dict: значения - list(codes).
+    __slots__ = ("kind", "data", "codes", "length")
+
+    def __init__(self):
+        self.kind = None        # None (пока только NULL), "q", "d", "codes"
+        self.data = None
+        self.codes = None
+        self.length = 0
+
+    def extend(self, values):
+        # Порция значений столбца; быстрый путь - без разбора по одному значению
+        if self.kind == "q":
+            try:
+                chunk = array.array("q", values)
+            except (TypeError, OverflowError):
+                chunk = None
+            if chunk is not None and NULL_INT not in chunk:
+                self.data.extend(chunk)
+                self.length += len(chunk)
+                return
+        elif self.kind == "codes":
+            codes = self.codes
+            self.data.extend([codes.setdefault(value, len(codes)) for value in values])
+            self.length += len(values)
+            return
+        for value in values:
+            self.append(value)
+
+    def append(self, value):
+        kind = self.kind
+        if kind == "q" and type(value) is int and value != NULL_INT:
+            self.data.append(value)
+        elif kind == "codes":
+            self.data.append(self.codes.setdefault(value, len(self.codes)))
+        elif value is None:
+            if kind is not None:
+                self.data.append(NULL_INT if kind == "q" else math.nan)
+        elif kind == "d" and type(value) in (int, float):
+            self.data.append(value)
+        else:
+            self._widen(value)
+            return self.append(value)
+        self.length += 1
+
+    def _widen(self, value):
+        previous = _decode(*self.finish(), 0, self.length)
+        if type(value) in (int, float) and self.kind in (None, "q"):
+            self.kind = "q" if type(value) is int and value != NULL_INT and self.kind is None else "d"
+            self.data = array.array(self.kind)
+        else:
+            self.kind = "codes"
+            self.data = array.array("I")
+            self.codes = {}
+        self.length = 0
+        for old in previous:
+            self.append(old)
+
+    def finish(self):
+        # (kind, data, values) для RowStore
+        if self.kind is None:
+            return "none", self.length, None
+        if self.kind != "codes":
+            return self.kind, self.data, None
+        values = list(self.codes)
+        if len(values) > UNIQUE_SHARE * self.length:
+            return "list", [values[code] for code in self.data], None
+        if len(values) <= 1 << 16:
+            return "codes", array.array("H", self.data), values
+        return "codes", self.data, values
+
+
+def _getter(kind, data, values):
+    # Функция номер строки -> значение столбца
+    if kind == "q":
+        return lambda i: None if data[i] == NULL_INT else data[i]
+    if kind == "d":
+        return lambda i: None if math.isnan(data[i]) else data[i]
+    if kind == "codes":
+        return lambda i: values[data[i]]
+    if kind == "list":
+        return data.__getitem__
+    return lambda i: None
+
+
+def _decode(kind, data, values, start, stop):
+    # Значения столбца в строках start..stop-1 списком
+    if kind == "none":
+        return [None] * (stop - start)
+    if kind == "list":
+        return data[start:stop]
+    if kind == "codes":
+        return list(map(values.__getitem__, data[start:stop]))
+    chunk = data[start:stop].tolist()
+    if kind == "q":
+        return [None if value == NULL_INT else value for value in chunk] if NULL_INT in chunk else chunk
+    return [None if math.isnan(value) else value for value in chunk]
+
+
+class RowStore:
+    # Неизменяемая последовательность строк-кортежей одинаковой длины
+
+    __slots__ = ("columns", "_getters", "_length")
+
+    def __init__(self, columns, length):
+        # columns - [(kind, data, values)], см. _Column.finish
+        self.columns = columns
+        self._getters = [_getter(*column) for column in columns]
+        self._length = length
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        # chunks - порции строк (списки кортежей)
+        builders = None
+        length = 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if builders is None:
+                builders = [_Column() for _ in chunk[0]]
+            for builder, values in zip(builders, zip(*chunk)):
+                builder.extend(values)
+            length += len(chunk)
+        return cls([builder.finish() for builder in builders or ()], length)
+
+    @classmethod
+    def from_rows(cls, rows, chunk=CHUNK):
+        rows = iter(rows)
+        return cls.from_chunks(iter(lambda: list(itertools.islice(rows, chunk)), []))
+
+    @classmethod
+    def from_cursor(cls, cursor, chunk=CHUNK):
+        # Результат запроса без промежуточного списка всех кортежей
+        return cls.from_chunks(iter(lambda: cursor.fetchmany(chunk), []))
+
+    def __len__(self):
+        return self._length
+
+    def row(self, i):
+        return tuple(get(i) for get in self._getters)
+
+    def rows(self, start=0, stop=None):
+        # Строки start..stop-1: декодирование по столбцам порциями
+        stop = self._length if stop is None else min(stop, self._length)
+        for begin in range(start, stop, CHUNK):
+            end = min(begin + CHUNK, stop)
+            yield from zip(*(_decode(*column, begin, end) for column in self.columns))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step == 1:
+                return list(self.rows(start, stop))
+            return [self.row(i) for i in range(start, stop, step)]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("RowStore index out of range")
+        return self.row(index)
+
+    def __iter__(self):
+        return self.rows()
+
+    def column(self, i):
+        # Значения одного столбца без сборки строк
+        return _decode(*self.columns[i], 0, self._length)
@@ -0,0 +1,154 @@
+import collections
+import string
+import threading
+
+from db.row_store import RowStore
+
+# Полнотекстовый поиск по индексам books_fts / readers_fts (см. init_db.create_schema).
+# Запросы ниже - подзапросы для RecordSource: их параметр (строка MATCH)
+# передаётся через params, результаты упорядочены по релевантности (rank).
+
+# Триграммный токенизатор не находит строки короче трёх символов
+MIN_QUERY_LENGTH = 3
+
+BOOKS_HITS = """(
+    SELECT b.library_id, b.book_id, b.theme_id, b.author, b.title, p.name AS publisher,
+           b.publish_place, b.publish_year, b.quantity, b.publisher_id, f.rank AS rank
+    FROM books_fts f
+    JOIN books b ON b.library_id = f.library_id AND b.book_id = f.book_id
+    LEFT JOIN publishers p ON p.publisher_id = b.publisher_id
+    WHERE books_fts MATCH ?
+)"""
+
+READERS_HITS = """(
+    SELECT r.reader_id, r.full_name, r.address, r.phone, f.rank AS rank
+    FROM readers_fts f
+    JOIN readers r ON r.reader_id = f.rowid
+    WHERE readers_fts MATCH ?
+)"""
+
+
+def match_phrase(text):
+    # Строка пользователя как одна фраза FTS5: без операторов и спецсимволов
+    return '"' + text.replace('"', '""') + '"'
+
+
+# ---------- Живой поиск ----------
+
+# Задержка после последнего нажатия клавиши, мс
+DEBOUNCE_MS = 250
+# Записей в кэше запросов (на все формы)
+CACHE_SIZE = 64
+# Страница результатов поиска больше обычной: уточнение запроса чаще
+# отбирается из полностью закэшированного результата
+RESULT_PAGE_SIZE = 200
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def fold_fts(text):
+    # Триграммный токенизатор не различает регистр (в том числе кириллицы)
+    return text.lower()
+
+
+def fold_like(text):
+    # LIKE в SQLite не различает регистр только для латиницы
+    return text.translate(_ASCII_LOWER)
+
+
+def like_pattern(text):
+    # Подстрока для "... LIKE ? ESCAPE '\\'": % и _ пользователя - обычные символы
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class SearchCache:
+    # Общий для всех форм LRU-кэш: (область, строка поиска) -> (первая страница
+    # результата, весь ли результат на ней). Если новая строка содержит
+    # закэшированную строку с полным результатом, ответ отбирается из него в
+    # памяти: совпадение по подстроке у новой строки есть только там, где оно
+    # было у прежней. Порядок строк при этом остаётся от прежнего запроса.
+    # Любая запись в БД очищает кэш: для каждого соединения, через которое
+    # идёт поиск, сверяются PRAGMA data_version (commit в других соединениях,
+    # других формах и процессах) и total_changes (запись через это же соединение).
+    # Строки хранятся по столбцам (db/row_store.py).
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.hits = self.narrowed = self.misses = 0
+
+    def validate(self, conn):
+        token = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+        with self.lock:
+            if self.seen.get(id(conn)) != token:
+                self.seen[id(conn)] = token
+                self.entries.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get(self, scope, text, fields, fold):
+        # fields - номера столбцов строки, по которым идёт поиск
+        with self.lock:
+            entry = self.entries.get((scope, text))
+            if entry is not None:
+                self.entries.move_to_end((scope, text))
+                self.hits += 1
+                return entry
+            needle = fold(text)
+            base = None
+            for (entry_scope, entry_text), (rows, complete) in self.entries.items():
+                if (entry_scope == scope and complete and fold(entry_text) in needle
+                        and (base is None or len(entry_text) > len(base[0]))):
+                    base = (entry_text, rows)
+            if base is None:
+                self.misses += 1
+                return None
+            self.narrowed += 1
+        # Отбор по столбцам поиска; строки целиком собираются только для совпавших
+        store = base[1]
+        columns = [store.column(i) for i in fields]
+        rows = [store.row(n) for n in range(len(store))
+                if any(column[n] is not None and needle in fold(str(column[n])) for column in columns)]
+        self.put(scope, text, rows, True)
+        return rows, True
+
+    def put(self, scope, text, rows, complete):
+        with self.lock:
+            self.entries[(scope, text)] = (RowStore.from_rows(rows), complete)
+            self.entries.move_to_end((scope, text))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+cache = SearchCache()
+
+
+class CachedSearch:
+    # Поиск через RecordSource с общим кэшем: первая страница результата
+    # берётся из кэша или уточняется в памяти, остальные читаются как обычно.
+    # param(text) - параметр запроса (строка MATCH или шаблон LIKE).
+
+    def __init__(self, source, scope, fields, where_clause="", param=match_phrase, fold=fold_fts):
+        self.source = source
+        self.scope = scope
+        self.fields = [source.columns.index(f) for f in fields]
+        self.where_clause = where_clause
+        self.param = param
+        self.fold = fold
+
+    def run(self, text):
+        # Выполняется в рабочем потоке; возвращает source с первой страницей
+        for conn in self.source.connections():
+            cache.validate(conn)
+        params = (self.param(text),)
+        entry = cache.get(self.scope, text, self.fields, self.fold)
+        if entry is None:
+            self.source.reset(self.where_clause, params)
+            cache.put(self.scope, text, self.source.page, self.source.complete)
+        else:
+            self.source.load(self.where_clause, params, *entry)
+        return self.source
@@ -0,0 +1,453 @@
+import argparse
+import contextlib
+import heapq
+import itertools
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db import circulation, connection, init_db, snapshot, stats, write_queue
+from db.connection import get_connection, immediate
+from db.record_source import PAGE_SIZE, RecordSource
+
+# Раздельное хранение по библиотекам (необязательное). Каталог и выдачи
+# каждой библиотеки лежат в своём файле <база>.shards/library_<id>.db, в общей
+# базе остаются справочники и читатели. У каждого файла своя блокировка записи:
+# выдачи в одной библиотеке не ждут commit в другой.
+# Раскладка включается командой split (python -m db.shards split) и
+# определяется наличием каталога файлов; файл новой библиотеки создаётся при
+# первом обращении. Запросы к одной библиотеке идут в её файл через обычное
+# соединение потока (connection.get_connection), поэтому SQL форм и
+# db.circulation не меняется. Запросы по всем библиотекам (поиск, сводки)
+# выполняются параллельно по файлам, результаты сливаются в порядке ключа.
+# Внешние ключи между файлами SQLite не проверяет: в файле библиотеки их нет,
+# существование читателя проверяет ShardRouter перед выдачей.
+# Справочник издательств - в общей базе, в файле библиотеки - его копия с
+# теми же кодами (наименования для books_fts и books_compat). Копию
+# пополняет запись книги (BooksForm.store_book), изменения справочника
+# переносит sync_publishers.
+# Чтение всей базы (импорт и экспорт, поиск дублей, отчёты) получает
+# соединения файлов библиотек - ShardRouter.connections() или снимки
+# shard_snapshots() - и проходит по ним сам.
+
+# Таблицы (и представление books_compat) файла библиотеки (остальные - только в общей базе)
+SHARD_TABLES = ("books", "subscriptions", "book_id_sequences", "library_stats", "theme_stats",
+                "stats_state", "books_fts", "publishers", "books_compat")
+# Триггеры только общей базы: счётчики справочников (reference_versions) и
+# запись через books_compat - код нового издательства выдаёт общая база
+MAIN_ONLY_TRIGGERS = re.compile(r"_version_after_|^books_compat_")
+# Потоков для параллельных запросов по библиотекам
+FANOUT_WORKERS = 4
+
+_fanout = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="shard")
+_create_lock = threading.Lock()
+
+_SHARD_FILE = re.compile(r"library_(\d+)\.db")
+_FOREIGN_KEY = re.compile(r",\s*FOREIGN KEY\s*\([^)]*\)\s*REFERENCES\s+(\w+)\s*\([^)]*\)[^,\n]*")
+
+
+def shard_dir(db_path):
+    return os.path.splitext(db_path)[0] + ".shards"
+
+
+def shard_path(db_path, library_id):
+    return os.path.join(shard_dir(db_path), f"library_{int(library_id)}.db")
+
+
+# ---------- Схема файла библиотеки ----------
+
+def in_shard(obj_type, name, table):
+    # Есть ли объект схемы init_db в файле библиотеки
+    return table in SHARD_TABLES and not (obj_type == "trigger" and MAIN_ONLY_TRIGGERS.search(name))
+
+
+def shard_table_sql(sql):
+    # CREATE TABLE без внешних ключей на таблицы общей базы
+    return _FOREIGN_KEY.sub(lambda m: m.group(0) if m.group(1) in SHARD_TABLES else "", sql)
+
+
+def _shard_schema():
+    # Определения из init_db (единственный источник схемы) для объектов
+    # SHARD_TABLES, без внешних ключей на таблицы общей базы.
+    # Возвращает (таблицы, индексы, триггеры и представления, настройка rank books_fts).
+    scratch = sqlite3.connect(":memory:")
+    init_db.create_schema(scratch)
+    init_db.create_indexes(scratch)
+    init_db.create_triggers(scratch)
+    init_db.create_views(scratch)
+    objects = [(obj_type, sql) for obj_type, name, table, sql in scratch.execute(
+        "SELECT type, name, tbl_name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY rowid")
+        if in_shard(obj_type, name, table)]
+    rank = scratch.execute("SELECT v FROM books_fts_config WHERE k = 'rank'").fetchone()[0]
+    scratch.close()
+    tables = [shard_table_sql(sql) for obj_type, sql in objects if obj_type == "table"]
+    return tables, [sql for obj_type, sql in objects if obj_type != "table"], rank
+
+
+def create_shard(path, overdue_cutoff=None, triggers=True, publishers=()):
+    # Пустой файл библиотеки; triggers=False - только таблицы (для split:
+    # выдачи копируются без триггера, уменьшающего остаток книги);
+    # publishers - строки справочника общей базы (publisher_id, name, address)
+    tables, others, rank = _shard_schema()
+    conn = connection.connect(path)
+    with immediate(conn):
+        for sql in tables:
+            conn.execute(sql)
+        conn.execute("INSERT INTO books_fts(books_fts, rank) VALUES ('rank', ?)", (rank,))
+        conn.execute("INSERT INTO stats_state (id, overdue_cutoff) VALUES (1, ?)", (overdue_cutoff,))
+        conn.executemany("INSERT INTO publishers (publisher_id, name, address) VALUES (?, ?, ?)", publishers)
+        if triggers:
+            for sql in others:
+                conn.execute(sql)
+    return conn
+
+
+def _finish_shard(conn):
+    # Индексы и триггеры после загрузки данных, затем поиск и сводки
+    _, others, _ = _shard_schema()
+    with immediate(conn):
+        for sql in others:
+            conn.execute(sql)
+    init_db.rebuild_books_search_index(conn)
+    init_db.rebuild_stats(conn)
+
+
+# ---------- Маршрутизация ----------
+
+class ShardedRecordSource(RecordSource):
+    # RecordSource по всем библиотекам: страница читается из каждого файла
+    # тем же запросом (LIMIT page_size), результаты сливаются по ключу.
+    # Ранги FTS5 считаются по словарю каждого файла и сравнимы лишь приближённо.
+
+    def __init__(self, router, table, columns, key, page_size=PAGE_SIZE):
+        super().__init__(table, columns, key, page_size, router.db_path)
+        self.router = router
+
+    def _execute(self, query, params, descending=False):
+        pages = [rows for _, rows in self.router.fan_out(lambda conn: conn.execute(query, params).fetchall())]
+        return list(itertools.islice(heapq.merge(*pages, key=self._row_key, reverse=descending),
+                                     self.page_size))
+
+    def connections(self):
+        return [self.router.connection(library_id) for library_id in self.router.library_ids()]
+
+    def count(self):
+        if self._count is None:
+            query = "SELECT COUNT(*) FROM " + self.table
+            if self.where_clause:
+                query += " WHERE " + self.where_clause
+            self._count = sum(n for _, n in self.router.fan_out(
+                lambda conn: conn.execute(query, self.params).fetchone()[0]))
+        return self._count
+
+
+class ShardRouter:
+    # Куда идут запросы: connection(library_id) - соединение потока с файлом
+    # библиотеки (или с общей базой, если раскладка не включена),
+    # fan_out(func) - func(conn) параллельно во всех библиотеках.
+    # Операции выдачи и сводки - те же, что в db.circulation / db.stats.
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or connection.default_path()
+
+    @property
+    def sharded(self):
+        return os.path.isdir(shard_dir(self.db_path))
+
+    def path(self, library_id=None):
+        # Файл БД библиотеки (общая база, если раскладка не включена)
+        if library_id is None or not self.sharded:
+            return self.db_path
+        path = shard_path(self.db_path, library_id)
+        if not os.path.exists(path):
+            with _create_lock:
+                if not os.path.exists(path):
+                    main = get_connection(self.db_path)
+                    cutoff = main.execute("SELECT overdue_cutoff FROM stats_state").fetchone()[0]
+                    create_shard(path, cutoff, publishers=main.execute(
+                        "SELECT publisher_id, name, address FROM publishers").fetchall()).close()
+        return path
+
+    def connection(self, library_id=None):
+        return get_connection(self.path(library_id))
+
+    def write(self, library_id, func, *args):
+        # func(conn, *args) в файле библиотеки. С очередью записи
+        # (db/write_queue.py) - в её групповом commit, вызывающий ждёт результат;
+        # иначе - на соединении потока (транзакцию открывает сама func)
+        if write_queue.ENABLED:
+            return write_queue.get_write_queue(self.path(library_id)).submit(func, *args).result()
+        return func(self.connection(library_id), *args)
+
+    # ---------- Справочник издательств ----------
+
+    def sync_publishers(self):
+        # Копии справочника в файлах библиотек - как в общей базе (после
+        # изменений в форме издательств). Переименование переиндексирует книги
+        # издательства в books_fts файла (триггер books_fts_publisher); удаляются
+        # только коды, которых нет ни у одной книги файла.
+        if not self.sharded:
+            return
+        rows = get_connection(self.db_path).execute("SELECT publisher_id, name, address FROM publishers").fetchall()
+
+        def sync(conn):
+            with immediate(conn):
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS main_publishers (publisher_id INTEGER PRIMARY KEY, "
+                             "name TEXT, address TEXT)")
+                conn.execute("DELETE FROM main_publishers")
+                conn.executemany("INSERT INTO main_publishers VALUES (?, ?, ?)", rows)
+                conn.execute("""
+                    DELETE FROM publishers
+                    WHERE publisher_id NOT IN (SELECT publisher_id FROM main_publishers)
+                      AND NOT EXISTS (SELECT 1 FROM books b WHERE b.publisher_id = publishers.publisher_id)
+                """)
+                conn.execute("""
+                    INSERT INTO publishers (publisher_id, name, address)
+                    SELECT publisher_id, name, address FROM main_publishers WHERE true
+                    ON CONFLICT(publisher_id) DO UPDATE SET name = excluded.name, address = excluded.address
+                    WHERE name IS NOT excluded.name OR address IS NOT excluded.address
+                """)
+        self.fan_out(sync)
+
+    def publisher_books(self, publisher_id):
+        # Книг издательства во всех библиотеках (внешний ключ общей базы
+        # файлы библиотек не видит - проверка перед удалением)
+        return sum(n for _, n in self.fan_out(lambda conn: conn.execute(
+            "SELECT COUNT(*) FROM books WHERE publisher_id = ?", (publisher_id,)).fetchone()[0]))
+
+    def library_ids(self):
+        return [row[0] for row in get_connection(self.db_path).execute(
+            "SELECT library_id FROM libraries ORDER BY library_id")]
+
+    def connections(self):
+        # [(library_id, соединение потока с файлом библиотеки)]; пусто без раскладки
+        if not self.sharded:
+            return []
+        return [(library_id, self.connection(library_id)) for library_id in self.library_ids()]
+
+    def fan_out(self, func):
+        # [(library_id, func(conn))]; без раскладки - один вызов на общей базе
+        if not self.sharded:
+            return [(None, func(get_connection(self.db_path)))]
+        futures = [(library_id, _fanout.submit(lambda l: func(self.connection(l)), library_id))
+                   for library_id in self.library_ids()]
+        return [(library_id, future.result()) for library_id, future in futures]
+
+    def source(self, table, columns, key, page_size=PAGE_SIZE):
+        if self.sharded:
+            return ShardedRecordSource(self, table, columns, key, page_size)
+        return RecordSource(table, columns, key, page_size, self.db_path)
+
+    # ---------- Выдача ----------
+
+    def _check_reader(self, reader_id):
+        # Вместо внешнего ключа subscriptions -> readers, который не проверяется между файлами
+        if self.sharded and get_connection(self.db_path).execute(
+                "SELECT 1 FROM readers WHERE reader_id = ?", (reader_id,)).fetchone() is None:
+            raise circulation.CirculationError(f"Читатель {reader_id} не найден")
+
+    def issue(self, library_id, book_id, reader_id, advance=0, issue_date=None):
+        self._check_reader(reader_id)
+        return self.write(library_id, circulation.issue, library_id, book_id, reader_id, advance, issue_date)
+
+    def return_book(self, library_id, book_id, reader_id, return_date=None):
+        return self.write(library_id, circulation.return_book, library_id, book_id, reader_id, return_date)
+
+    def renew(self, library_id, book_id, reader_id, renew_date=None):
+        return self.write(library_id, circulation.renew, library_id, book_id, reader_id, renew_date)
+
+    def return_many(self, loans, return_date=None):
+        # Пакет разбивается по библиотекам: своя транзакция в каждом файле
+        if not self.sharded:
+            return self.write(None, circulation.return_many, loans, return_date)
+        return_date = return_date or circulation.now()
+        groups = {}
+        for loan in loans:
+            groups.setdefault(loan[0], []).append(loan)
+        futures = [_fanout.submit(lambda l, group: self.write(l, circulation.return_many, group, return_date),
+                                  library_id, group)
+                   for library_id, group in groups.items()]
+        return sum(future.result() for future in futures)
+
+    def open_loans(self, reader_id):
+        results = self.fan_out(lambda conn: circulation.open_loans(conn, reader_id))
+        return list(heapq.merge(*(rows for _, rows in results), key=lambda row: row[2]))
+
+    def overdue_loans(self, today=None, limit=None):
+        results = self.fan_out(lambda conn: circulation.overdue_loans(conn, today, limit))
+        return list(itertools.islice(heapq.merge(*(rows for _, rows in results), key=lambda row: row[3]),
+                                     limit))
+
+    # ---------- Сводки ----------
+
+    def refresh_overdue(self):
+        # Обслуживание сводок (stats.refresh_overdue) в общей базе и в каждом
+        # файле библиотеки - через писателя; возвращает число обновлённых файлов
+        library_ids = [None] + (self.library_ids() if self.sharded else [])
+        return sum(bool(self.write(library_id, stats.refresh_overdue)) for library_id in library_ids)
+
+    def library_stats(self, library_id=None):
+        if library_id is not None:
+            return stats.library_stats(self.connection(library_id), library_id)
+        merged = {}
+        for _, result in self.fan_out(stats.library_stats):
+            merged.update(result)
+        return dict(sorted(merged.items()))
+
+    def theme_stats(self, theme_id=None):
+        # Книги одной тематики есть во многих библиотеках - счётчики складываются
+        merged = {}
+        for _, result in self.fan_out(lambda conn: stats.theme_stats(conn)):
+            for key, values in result.items():
+                total = merged.setdefault(key, dict.fromkeys(stats.COLUMNS, 0))
+                for column in stats.COLUMNS:
+                    total[column] += values[column]
+        if theme_id is not None:
+            return merged.get(theme_id, dict.fromkeys(stats.COLUMNS, 0))
+        return dict(sorted(merged.items()))
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_router(db_path=None):
+    # Общий маршрутизатор файла БД для форм и операций процесса
+    db_path = db_path or connection.default_path()
+    with _routers_lock:
+        router = _routers.get(db_path)
+        if router is None:
+            router = _routers[db_path] = ShardRouter(db_path)
+        return router
+
+
+# ---------- Снимки файлов библиотек ----------
+
+def shard_snapshots(reads):
+    # Снимки файлов библиотек в режиме снимка общей базы reads (db/snapshot.py):
+    # [(library_id, Snapshot)] по коду библиотеки, пусто без раскладки. Копии
+    # режима "backup" - в каталоге файлов рядом с копией общей базы. Файлы
+    # не создаются: библиотека без файла ещё не получала книг.
+    directory = shard_dir(reads.db_path)
+    if not os.path.isdir(directory):
+        return []
+    if reads.mode == "backup":
+        os.makedirs(shard_dir(reads.snapshot_path), exist_ok=True)
+    library_ids = sorted(int(match.group(1)) for match in map(_SHARD_FILE.fullmatch, os.listdir(directory))
+                         if match)
+    result = []
+    with _snapshots_lock:
+        for library_id in library_ids:
+            key = (shard_path(reads.db_path, library_id), reads.mode)
+            shard = _snapshots.get(key)
+            if shard is None:
+                shard = _snapshots[key] = snapshot.Snapshot(
+                    key[0], reads.mode, reads.refresh_seconds,
+                    shard_path(reads.snapshot_path, library_id), reads.pages)
+            result.append((library_id, shard))
+    return result
+
+
+def snapshot_connections(reads):
+    # [(library_id, Snapshot.connection())] - как ShardRouter.connections() для снимка
+    return [(library_id, shard.connection()) for library_id, shard in shard_snapshots(reads)]
+
+
+@contextlib.contextmanager
+def reading(reads):
+    # reads.reading() и читающие транзакции снимков файлов библиотек:
+    # (соединение общей базы, [(library_id, соединение)]). Транзакции файлов
+    # независимы, как и запись в них: версии разных файлов не согласованы.
+    with contextlib.ExitStack() as stack:
+        conn = stack.enter_context(reads.reading())
+        yield conn, [(library_id, stack.enter_context(shard.reading()))
+                     for library_id, shard in shard_snapshots(reads)]
+
+
+def close_snapshots(reads):
+    # Закрыть снимки файлов библиотек и соединения с ними текущего потока
+    for library_id, shard in shard_snapshots(reads):
+        connection.close_connection(shard.read_path)
+        shard.close()
+        with _snapshots_lock:
+            _snapshots.pop((shard.db_path, shard.mode), None)
+
+
+# ---------- Переход на раздельное хранение ----------
+
+def split(db_path, log=print):
+    # Перенести книги и выдачи каждой библиотеки в её файл. Общая база после
+    # этого хранит только справочники и читателей.
+    directory = shard_dir(db_path)
+    if os.path.isdir(directory):
+        raise RuntimeError(f"Раздельное хранение уже включено: {directory}")
+    os.makedirs(directory + ".tmp", exist_ok=True)
+    conn = connection.connect(db_path)
+    cutoff = conn.execute("SELECT overdue_cutoff FROM stats_state").fetchone()[0]
+    library_ids = [row[0] for row in conn.execute("SELECT library_id FROM libraries ORDER BY library_id")]
+    for library_id in library_ids:
+        path = os.path.join(directory + ".tmp", os.path.basename(shard_path(db_path, library_id)))
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)   # остаток прерванного запуска
+        create_shard(path, cutoff, triggers=False).close()
+        conn.execute("ATTACH DATABASE ? AS shard", (path,))
+        try:
+            with immediate(conn):
+                conn.execute("INSERT INTO shard.publishers SELECT * FROM main.publishers")
+                for table in ("books", "subscriptions", "book_id_sequences"):
+                    conn.execute(f"INSERT INTO shard.{table} SELECT * FROM main.{table} WHERE library_id = ?",
+                                 (library_id,))
+        finally:
+            conn.execute("DETACH DATABASE shard")
+        shard = connection.connect(path)
+        _finish_shard(shard)
+        count = shard.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        shard.close()
+        log(f"  библиотека {library_id}: {count} книг")
+    # Каталог файлов появляется целиком - только после того, как все скопированы
+    os.rename(directory + ".tmp", directory)
+    with immediate(conn):
+        conn.execute("DELETE FROM subscriptions")
+        conn.execute("DELETE FROM books")
+        conn.execute("DELETE FROM book_id_sequences")
+    conn.execute("VACUUM")
+    conn.close()
+    return library_ids
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Раздельное хранение каталога по библиотекам")
+    parser.add_argument("command", choices=("split", "status", "stats"))
+    parser.add_argument("--db", help="файл БД (по умолчанию db/library.db)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_path = args.db or init_db.DB_FILE
+    router = ShardRouter(db_path)
+    if args.command == "split":
+        library_ids = split(db_path)
+        print(f"Библиотек перенесено в {shard_dir(db_path)}: {len(library_ids)}")
+    elif args.command == "status":
+        if not router.sharded:
+            print("Раздельное хранение не включено")
+            return
+        for library_id, count in router.fan_out(lambda conn: conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]):
+            path = shard_path(db_path, library_id)
+            print(f"  {library_id:4} {count:9} книг {os.path.getsize(path) // 1024:9} КБ  {path}")
+    else:
+        for title, result in (("Библиотеки", router.library_stats()), ("Тематики", router.theme_stats())):
+            print(title)
+            print("  ключ " + " ".join(f"{c:>9}" for c in stats.COLUMNS))
+            for key, values in result.items():
+                print(f"  {key:4} " + " ".join(f"{values[c]:9}" for c in stats.COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import contextlib
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+from db import connection
+from db.init_db import DB_FILE
+
+# Снимок базы для отчётов и тяжёлого чтения, чтобы они не мешали записи.
+# "ro"     - соединения только для чтения (URI mode=ro) к самой базе. В режиме
+#            WAL читатель не блокирует писателя, но длинная читающая транзакция
+#            держит WAL: контрольная точка не может его сбросить, и запись
+#            (autocheckpoint выполняется в commit клерка) постепенно замедляется.
+#            Подходит для коротких отчётов и просмотра.
+# "backup" - отдельный файл-копия, обновляемый online backup API. Исходная база
+#            читается только на время копирования, отчёт сколько угодно
+#            долго читает копию. Копия в режиме WAL: открытые на ней отчёты
+#            дочитывают старую версию, пока записывается новая.
+MODE = "ro"
+MODES = ("ro", "backup")
+# Копия обновляется не чаще раза в REFRESH_SECONDS и только если исходная
+# база менялась (None - только вручную, refresh(force=True) или start())
+REFRESH_SECONDS = 300
+# Страниц за шаг копирования. -1 - за один шаг: в WAL это одна читающая
+# транзакция, запись она не задерживает. При копировании порциями изменение
+# базы другим соединением между шагами начинает копирование заново.
+BACKUP_PAGES = -1
+
+
+def read_only_uri(path):
+    return pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+
+
+def snapshot_file(db_path):
+    root, ext = os.path.splitext(db_path)
+    return root + ".snapshot" + (ext or ".db")
+
+
+class Snapshot:
+    # Источник соединений для чтения. connection() - соединение текущего
+    # потока (connection.get_connection по URI mode=ro), в режиме "backup"
+    # перед этим копия обновляется, если пора. reading() - несколько запросов
+    # отчёта в одной читающей транзакции, то есть по одной версии данных.
+
+    def __init__(self, db_path=None, mode=MODE, refresh_seconds=REFRESH_SECONDS,
+                 snapshot_path=None, pages=BACKUP_PAGES):
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим снимка: {mode}")
+        self.db_path = db_path or DB_FILE
+        self.mode = mode
+        self.refresh_seconds = refresh_seconds
+        self.snapshot_path = snapshot_path or snapshot_file(self.db_path)
+        self.pages = pages
+        self.lock = threading.Lock()
+        self.refreshed_at = None     # time.monotonic() последнего обновления
+        self.last_refresh = None     # (секунды, страниц) последнего копирования
+        self._source = None
+        self._token = None
+        self._stop = None
+
+    @property
+    def read_path(self):
+        return read_only_uri(self.db_path if self.mode == "ro" else self.snapshot_path)
+
+    def due(self):
+        if self.mode != "backup":
+            return False
+        if self.refreshed_at is None:
+            return True
+        return self.refresh_seconds is not None and time.monotonic() - self.refreshed_at >= self.refresh_seconds
+
+    def connection(self):
+        if self.due():
+            self.refresh()
+        return connection.get_connection(self.read_path)
+
+    @contextlib.contextmanager
+    def reading(self):
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+    def _changed(self):
+        # data_version меняется, когда базу изменило другое соединение.
+        # Соединение-источник живёт между обновлениями (разные потоки - под lock).
+        if self._source is None:
+            self._source = sqlite3.connect(read_only_uri(self.db_path), uri=True, check_same_thread=False)
+        token = self._source.execute("PRAGMA data_version").fetchone()[0]
+        changed = token != self._token or not os.path.exists(self.snapshot_path)
+        self._token = token
+        return changed
+
+    def refresh(self, force=False):
+        # Обновить копию (режим "backup"); True - если копирование было
+        if self.mode != "backup":
+            return False
+        with self.lock:
+            if not self._changed() and not force:
+                self.refreshed_at = time.monotonic()
+                return False
+            started = time.perf_counter()
+            pages = [0]
+            target = sqlite3.connect(self.snapshot_path)
+            try:
+                if target.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+                    # Новый файл: размер страницы как у источника, иначе backup в WAL невозможен
+                    page_size = self._source.execute("PRAGMA page_size").fetchone()[0]
+                    target.execute(f"PRAGMA page_size = {page_size}")
+                    target.execute("PRAGMA journal_mode = WAL")
+                self._source.backup(target, pages=self.pages,
+                                    progress=lambda status, remaining, total: pages.append(total))
+                # PASSIVE: не ждать отчёты, которые ещё читают прежнюю версию
+                target.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            finally:
+                target.close()
+            self.refreshed_at = time.monotonic()
+            self.last_refresh = (time.perf_counter() - started, pages[-1])
+            return True
+
+    def start(self, interval=None):
+        # Фоновое обновление копии каждые interval (по умолчанию REFRESH_SECONDS) секунд
+        if self.mode != "backup" or self._stop is not None:
+            return
+        interval = interval or self.refresh_seconds or REFRESH_SECONDS
+        self._stop = threading.Event()
+
+        def loop(stop):
+            while not stop.wait(interval):
+                self.refresh()
+        threading.Thread(target=loop, args=(self._stop,), name="snapshot", daemon=True).start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def close(self):
+        self.stop()
+        with self.lock:
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(db_path=None):
+    # Общий снимок файла БД для всех форм и отчётов процесса (режим - MODE)
+    db_path = db_path or connection.default_path()
+    with _snapshots_lock:
+        snapshot = _snapshots.get(db_path)
+        if snapshot is None:
+            snapshot = _snapshots[db_path] = Snapshot(db_path)
+        return snapshot
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Копия базы данных для отчётов")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--out", help="файл копии (по умолчанию <база>.snapshot.db)")
+    parser.add_argument("--pages", type=int, default=BACKUP_PAGES, help="страниц за шаг копирования")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    snapshot = Snapshot(args.db, "backup", snapshot_path=args.out, pages=args.pages)
+    snapshot.refresh(force=True)
+    seconds, pages = snapshot.last_refresh
+    print(f"{snapshot.snapshot_path}: скопировано {pages} страниц за {seconds:.2f} с")
+    snapshot.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import datetime
+
+from db import connection, init_db, snapshot
+from db.circulation import LOAN_DAYS
+from db.connection import immediate
+
+# Сводные счётчики по библиотекам и тематикам (library_stats, theme_stats).
+# Их ведут триггеры books_stats_* и subscriptions_stats_* из init_db, чтение
+# панели статистики - поиск строки по ключу вместо GROUP BY по всей таблице.
+# Просрочку меняет и ход времени: refresh_overdue() сдвигает границу
+# stats_state.overdue_cutoff и пересчитывает только столбец overdue по
+# частичному индексу открытых выдач. Это запись - шаг обслуживания на стороне
+# писателя (запуск приложения и API, ShardRouter.refresh_overdue), а не
+# чтения: чтение сводок ничего не меняет (работает и на снимке mode=ro), а
+# выдачи, ставшие просроченными после сохранённой границы, досчитывает само.
+
+COLUMNS = ("titles", "copies", "available", "on_loan", "overdue")
+
+
+def overdue_cutoff(today=None):
+    # Та же граница, что в circulation.overdue_loans
+    return ((today or datetime.date.today()) - datetime.timedelta(days=LOAN_DAYS)).isoformat()
+
+
+def refresh_overdue(conn, today=None):
+    cutoff = overdue_cutoff(today)
+    if conn.execute("SELECT overdue_cutoff FROM stats_state").fetchone()[0] == cutoff:
+        return False
+    # immediate: внутри транзакции очереди записи (db/write_queue.py) без своего commit
+    with immediate(conn):
+        conn.execute("UPDATE stats_state SET overdue_cutoff = ?", (cutoff,))
+        for table, key_column in init_db.STATS_TABLES:
+            key = "s.library_id" if key_column == "library_id" else "COALESCE(b.theme_id, 0)"
+            conn.execute(f"UPDATE {table} SET overdue = 0 WHERE overdue != 0")
+            conn.execute(f"""
+                UPDATE {table} SET overdue = o.overdue
+                FROM (
+                    SELECT {key} AS key, COUNT(*) AS overdue
+                    FROM subscriptions s
+                    JOIN books b ON b.library_id = s.library_id AND b.book_id = s.book_id
+                    WHERE s.return_date IS NULL AND s.issue_date < ?
+                    GROUP BY 1
+                ) o
+                WHERE {table}.{key_column} = o.key
+            """, (cutoff,))
+    return True
+
+
+def _select(table, key_column):
+    return (f"SELECT {key_column}, titles, available + on_loan, available, on_loan, overdue "
+            f"FROM {table}")
+
+
+def library_stats(conn, library_id=None):
+    # {library_id: {столбец: значение}} или счётчики одной библиотеки
+    return _read(conn, "library_stats", "library_id", library_id)
+
+
+def theme_stats(conn, theme_id=None):
+    # theme_id = 0 - книги без тематики
+    return _read(conn, "theme_stats", "theme_id", theme_id)
+
+
+def _overdue_delta(conn, key_column):
+    # Поправка столбца overdue, если сохранённая граница отстала от сегодняшней:
+    # {ключ: ±число открытых выдач между границами} (индекс idx_subscriptions_open_date)
+    stored = conn.execute("SELECT overdue_cutoff FROM stats_state").fetchone()[0]
+    cutoff = overdue_cutoff()
+    if stored == cutoff:
+        return {}
+    if stored is None:
+        sign, condition, params = 1, "s.issue_date < ?", (cutoff,)
+    elif stored < cutoff:
+        sign, condition, params = 1, "s.issue_date >= ? AND s.issue_date < ?", (stored, cutoff)
+    else:
+        sign, condition, params = -1, "s.issue_date >= ? AND s.issue_date < ?", (cutoff, stored)
+    key = "s.library_id" if key_column == "library_id" else "COALESCE(b.theme_id, 0)"
+    return {row[0]: sign * row[1] for row in conn.execute(f"""
+        SELECT {key}, COUNT(*)
+        FROM subscriptions s
+        JOIN books b ON b.library_id = s.library_id AND b.book_id = s.book_id
+        WHERE s.return_date IS NULL AND {condition}
+        GROUP BY 1
+    """, params)}
+
+
+def _row(row, delta):
+    values = dict(zip(COLUMNS, row[1:]))
+    values["overdue"] += delta.get(row[0], 0)
+    return values
+
+
+def _read(conn, table, key_column, key):
+    # Только чтение: граница просрочки не сдвигается (см. refresh_overdue)
+    delta = _overdue_delta(conn, key_column)
+    if key is not None:
+        row = conn.execute(_select(table, key_column) + f" WHERE {key_column} = ?", (key,)).fetchone()
+        return _row(row or (key,) + (0,) * len(COLUMNS), delta)
+    return {row[0]: _row(row, delta)
+            for row in conn.execute(_select(table, key_column) + f" ORDER BY {key_column}")}
+
+
+def verify(conn):
+    # Расхождения сводных таблиц с пересчётом по данным: [(таблица, ключ, было, должно быть)].
+    # Пустые строки (все счётчики 0) равны отсутствующим.
+    problems = []
+    for table, key_column in init_db.STATS_TABLES:
+        stored = {row[0]: row[1:] for row in conn.execute(
+            f"SELECT {key_column}, titles, available, on_loan, overdue FROM {table}")}
+        actual = {row[0]: row[1:] for row in conn.execute(init_db.stats_query(key_column))}
+        empty = (0, 0, 0, 0)
+        for key in sorted(stored.keys() | actual.keys()):
+            if stored.get(key, empty) != actual.get(key, empty):
+                problems.append((table, key, stored.get(key), actual.get(key)))
+    return problems
+
+
+def rebuild(conn):
+    refresh_overdue(conn)
+    init_db.rebuild_stats(conn)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сводные счётчики по библиотекам и тематикам")
+    parser.add_argument("command", choices=("show", "verify", "rebuild"))
+    parser.add_argument("--db", help="файл БД (по умолчанию db/library.db)")
+    parser.add_argument("--snapshot", choices=snapshot.MODES,
+                        help="verify: проверять снимок базы (db/snapshot.py) в одной читающей транзакции")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = connection.connect(args.db or init_db.DB_FILE)
+    if args.command == "show":
+        for title, stats in (("Библиотеки", library_stats(conn)), ("Тематики", theme_stats(conn))):
+            print(title)
+            print("  ключ " + " ".join(f"{c:>9}" for c in COLUMNS))
+            for key, values in stats.items():
+                print(f"  {key:4} " + " ".join(f"{values[c]:9}" for c in COLUMNS))
+    elif args.command == "verify":
+        refresh_overdue(conn)
+        if args.snapshot:
+            # Полный пересчёт - тяжёлое чтение: на копии или в mode=ro, по одной версии данных
+            reports = snapshot.Snapshot(args.db or init_db.DB_FILE, args.snapshot)
+            with reports.reading() as read_conn:
+                problems = verify(read_conn)
+            reports.close()
+        else:
+            problems = verify(conn)
+        for table, key, stored, actual in problems:
+            print(f"{table} {key}: {stored} != {actual}")
+        print("Расхождений нет." if not problems else f"Расхождений: {len(problems)}")
+        conn.close()
+        raise SystemExit(1 if problems else 0)
+    else:
+        rebuild(conn)
+        print("Сводные таблицы пересчитаны.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db import connection
+
+# Очередь записи с групповым commit (необязательная, ENABLED). Изменения форм,
+# выдачи и API не фиксируются каждое своим commit: поток очереди берёт все
+# операции, накопившиеся, пока шёл прошлый commit (до MAX_OPS штук), и
+# выполняет их одной транзакцией BEGIN IMMEDIATE - одна блокировка записи,
+# одна запись в WAL и (при synchronous = FULL) один fsync на всю группу.
+# MAX_DELAY_MS > 0 - ещё ждать попутчиков до N мс после первой операции:
+# commit реже, но каждое подтверждение приходит позже (клерк, ждущий
+# подтверждения, не успевает поставить следующую запись - см. бенчмарк
+# bench/group_commit.py), поэтому по умолчанию 0.
+#
+# Операция - func(conn, *args): выражения без commit (db.circulation и
+# connection.immediate внутри открытой транзакции commit не делают). Каждая
+# выполняется в своей точке сохранения: ошибка одной откатывает только её.
+# submit() возвращает concurrent.futures.Future - результат или исключение
+# операции; он выставляется после commit группы, т.е. когда изменение уже
+# зафиксировано. В формах future передаётся в QueryExecutor.watch (callback /
+# errback в главном потоке), API и ShardRouter ждут future.result().
+#
+# Надёжность - PRAGMA synchronous соединения очереди:
+#   OFF    - без fsync, при сбое питания база может повредиться;
+#   NORMAL - в режиме WAL fsync только при checkpoint: при сбое питания
+#            теряются последние группы, база цела (как у connection.PRAGMAS);
+#   FULL   - fsync WAL на каждый commit: группа зафиксирована надёжно;
+#   EXTRA  - FULL и ещё fsync каталога.
+
+ENABLED = False
+MAX_DELAY_MS = 0
+MAX_OPS = 200
+SYNCHRONOUS = "NORMAL"
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+_CLOSE = object()
+
+
+class WriteQueue:
+    # Поток записи с собственным соединением для одного файла БД
+
+    def __init__(self, db_path, max_delay_ms=MAX_DELAY_MS, max_ops=MAX_OPS, synchronous=SYNCHRONOUS):
+        if synchronous.upper() not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"synchronous: одно из {', '.join(SYNCHRONOUS_LEVELS)}")
+        self.db_path = db_path
+        self.max_delay = max_delay_ms / 1000
+        self.max_ops = max_ops
+        self.synchronous = synchronous.upper()
+        # Счётчики (bench/group_commit.py)
+        self.operations = 0
+        self.commits = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        future = Future()
+        if self._closed:
+            raise RuntimeError("Очередь записи закрыта")
+        self._queue.put((func, args, future))
+        return future
+
+    def close(self):
+        # Выполнить уже поставленные операции и остановить поток
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_CLOSE)
+            self._thread.join()
+
+    def _collect(self):
+        # Группа: первая операция и всё, что уже в очереди или придёт за max_delay
+        first = self._queue.get()
+        if first is _CLOSE:
+            return None, True
+        group = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(group) < self.max_ops:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is _CLOSE:
+                return group, True
+            group.append(item)
+        return group, False
+
+    def _run(self):
+        conn = connection.connect(self.db_path)
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        try:
+            closing = False
+            while not closing:
+                group, closing = self._collect()
+                if group:
+                    self._commit(conn, [item for item in group if item[2].set_running_or_notify_cancel()])
+        finally:
+            conn.close()
+
+    def _commit(self, conn, group):
+        if not group:
+            return
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, args, future in group:
+                conn.execute("SAVEPOINT operation")
+                try:
+                    results.append((future, func(conn, *args), None))
+                except Exception as e:
+                    if not conn.in_transaction:
+                        # SQLite откатил всю транзакцию (нет места, прерывание) - группа не записана
+                        raise
+                    conn.execute("ROLLBACK TO operation")
+                    results.append((future, None, e))
+                conn.execute("RELEASE operation")
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, _, future in group:
+                future.set_exception(e)
+            return
+        self.operations += len(group)
+        self.commits += 1
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def configure(enabled=True, max_delay_ms=None, max_ops=None, synchronous=None):
+    # Включить очередь для процесса (app.py, db/api.py); параметры - для новых очередей
+    global ENABLED, MAX_DELAY_MS, MAX_OPS, SYNCHRONOUS
+    if synchronous is not None and synchronous.upper() not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f"synchronous: одно из {', '.join(SYNCHRONOUS_LEVELS)}")
+    ENABLED = enabled
+    MAX_DELAY_MS = MAX_DELAY_MS if max_delay_ms is None else max_delay_ms
+    MAX_OPS = MAX_OPS if max_ops is None else max_ops
+    SYNCHRONOUS = SYNCHRONOUS if synchronous is None else synchronous.upper()
+
+
+def get_write_queue(db_path=None):
+    # Одна очередь на файл БД для всего процесса
+    db_path = db_path or connection.default_path()
+    with _queues_lock:
+        write_queue = _queues.get(db_path)
+        if write_queue is None:
+            write_queue = _queues[db_path] = WriteQueue(db_path, MAX_DELAY_MS, MAX_OPS, SYNCHRONOUS)
+        return write_queue
+
+
+def close_all():
+    with _queues_lock:
+        queues = list(_queues.values())
+        _queues.clear()
+    for write_queue in queues:
+        write_queue.close()
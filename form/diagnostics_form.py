@@ -0,0 +1,142 @@
+import json
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.profiler import profiler
+
+DIAGNOSTICS_COLUMNS = (
+    ("calls", "Вызовов", 70), ("total_ms", "Всего, мс", 90), ("mean_ms", "Среднее", 80),
+    ("p95_ms", "p95", 70), ("max_ms", "Макс.", 80), ("rows", "Строк", 80),
+    ("vm_steps", "Шагов VM", 90), ("sql", "Запрос", 420),
+)
+
+REFRESH_MS = 2000
+
+
+class DiagnosticsForm(tk.Frame):
+    # Статистика запросов процесса (db/profiler.py): таблица по убыванию общего
+    # времени, для выбранного запроса - гистограмма и план медленного выполнения.
+    # Открывается по F12 из любой формы (install) и обновляется раз в REFRESH_MS.
+    # С путём к JSON (Profiler.dump) показывает сохранённую статистику.
+
+    def __init__(self, master, dump_path=None):
+        super().__init__(master)
+        self.dump_path = dump_path
+        self.statements = []
+        self.after_id = None
+        self.create_widgets()
+        self.refresh()
+
+    def create_widgets(self):
+        names = [name for name, _, _ in DIAGNOSTICS_COLUMNS]
+        self.tree = ttk.Treeview(self, columns=names, show="headings", height=15, selectmode="browse")
+        for name, heading, width in DIAGNOSTICS_COLUMNS:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, stretch=name == "sql",
+                             anchor="w" if name == "sql" else "e")
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.grid(row=0, column=0, columnspan=4, sticky="nsew")
+        scrollbar.grid(row=0, column=4, sticky="ns")
+        self.tree.bind("<<TreeviewSelect>>", self.show_details)
+
+        self.details = tk.Text(self, height=12, width=100, state="disabled")
+        self.details.grid(row=1, column=0, columnspan=4, sticky="nsew", pady=5)
+
+        btn_frame = tk.Frame(self)
+        btn_frame.grid(row=2, column=0, columnspan=4, pady=5)
+        tk.Button(btn_frame, text="Обновить", command=self.refresh).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Сбросить", command=self.reset).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Сохранить JSON", command=self.save_json).pack(side="left", padx=5)
+
+        self.status_label = tk.Label(self, text="", fg="gray")
+        self.status_label.grid(row=3, column=0, columnspan=4, sticky="w")
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+    def refresh(self):
+        selected = self.tree.selection()
+        selected_sql = self.statements[int(selected[0])]["sql"] if selected else None
+        if self.dump_path is None:
+            snapshot = profiler.snapshot()
+            self.after_id = self.after(REFRESH_MS, self.refresh)
+        else:
+            with open(self.dump_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        self.statements = snapshot["statements"]
+        self.tree.delete(*self.tree.get_children())
+        for i, stats in enumerate(self.statements):
+            values = [stats[name] for name, _, _ in DIAGNOSTICS_COLUMNS]
+            self.tree.insert("", "end", iid=str(i), values=values)
+            if stats["sql"] == selected_sql:
+                self.tree.selection_set(str(i))
+        total = sum(s["total_ms"] for s in self.statements)
+        slow = sum(1 for s in self.statements if s["plan"])
+        self.status_label.config(text=f"С {snapshot['since']}: запросов {len(self.statements)}, "
+                                      f"всего {total:.1f} мс, медленных (> {snapshot['slow_ms']} мс) {slow}")
+
+    def show_details(self, event=None):
+        selection = self.tree.selection()
+        if not selection:
+            return
+        stats = self.statements[int(selection[0])]
+        lines = [stats["sql"], "", f"Выражений SQLite (с триггерами): {stats['sqlite_statements']}",
+                 "Гистограмма:"]
+        lines += [f"  {bucket:>10} {count}" for bucket, count in stats["histogram"].items() if count]
+        if stats["plan"]:
+            lines += ["", "EXPLAIN QUERY PLAN:"] + ["  " + step for step in stats["plan"]]
+        self.details.config(state="normal")
+        self.details.delete("1.0", "end")
+        self.details.insert("1.0", "\n".join(lines))
+        self.details.config(state="disabled")
+
+    def reset(self):
+        if self.dump_path is not None:
+            return
+        profiler.reset()
+        self.after_cancel(self.after_id)
+        self.refresh()
+
+    def save_json(self):
+        path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        try:
+            if self.dump_path is None:
+                profiler.dump(path)
+            else:
+                with open(self.dump_path, encoding="utf-8") as src, open(path, "w", encoding="utf-8") as dst:
+                    dst.write(src.read())
+        except OSError as e:
+            messagebox.showerror("Ошибка", str(e))
+
+    def destroy(self):
+        if self.after_id is not None:
+            self.after_cancel(self.after_id)
+        super().destroy()
+
+
+def open_window(master):
+    window = tk.Toplevel(master)
+    window.title("Диагностика запросов")
+    DiagnosticsForm(window).pack(fill="both", expand=True, padx=10, pady=10)
+    return window
+
+
+def install(root):
+    # F12 в любом окне приложения открывает окно диагностики
+    root.bind_all("<F12>", lambda event: open_window(root))
+
+
+# Блок запуска: просмотр сохранённой статистики - diagnostics_form.py stats.json
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.title("Диагностика запросов")
+    form = DiagnosticsForm(root, sys.argv[1] if len(sys.argv) > 1 else None)
+    form.pack(fill="both", expand=True, padx=10, pady=10)
+    root.mainloop()
@@ -1,19 +1,27 @@
 import tkinter as tk
 from tkinter import messagebox
-import sqlite3
+import os
+import sys
 
-DB_PATH = "../db/library.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.executor import QueryExecutor
+from db.record_source import RecordSource
+from form import diagnostics_form
+from form.record_grid import RecordGrid
+
+LIBRARY_GRID_COLUMNS = (
+    ("name", "Наименование", 220), ("address", "Адрес", 260),
+)
 
 class LibrariesForm(tk.Frame):
     def __init__(self, master):
         super().__init__(master)
-        self.conn = sqlite3.connect(DB_PATH)
-        self.cursor = self.conn.cursor()
-
         self.current_id = None
-        self.libraries = []
-        self.index = 0
+        self.libraries = RecordSource("libraries", ("library_id", "name", "address"), ("name", "library_id"))
 
+        self.grid_visible = False
+        self.executor = QueryExecutor(self, on_busy=self.set_busy)
         self.create_widgets()
         self.load_libraries()
         self.show_record()
@@ -33,6 +41,7 @@ class LibrariesForm(tk.Frame):
         tk.Button(nav_frame, text="<", command=self.prev_record).pack(side="left")
         tk.Button(nav_frame, text=">", command=self.next_record).pack(side="left")
         tk.Button(nav_frame, text=">>", command=self.last_record).pack(side="left")
+        tk.Button(nav_frame, text="Таблица", command=self.toggle_grid).pack(side="left", padx=10)
 
         btn_frame = tk.Frame(self)
         btn_frame.grid(row=3, column=0, columnspan=4, pady=10)
@@ -48,22 +57,56 @@ class LibrariesForm(tk.Frame):
         tk.Button(search_frame, text="Найти", command=self.search).pack(side="left")
         tk.Button(search_frame, text="Сбросить фильтр", command=self.load_libraries).pack(side="left", padx=10)
 
+        self.status_label = tk.Label(self, text="", fg="gray")
+        self.status_label.grid(row=5, column=0, columnspan=4, sticky="w")
+
+        self.grid_view = RecordGrid(self, self.executor, LIBRARY_GRID_COLUMNS, self.grid_selected)
+        self.grid_view.grid(row=6, column=0, columnspan=4, sticky="nsew", pady=5)
+        self.grid_view.grid_remove()
+
+    def toggle_grid(self):
+        self.grid_visible = not self.grid_visible
+        if self.grid_visible:
+            self.grid_view.grid()
+            self.grid_view.show_source(self.libraries)
+        else:
+            self.grid_view.grid_remove()
+
+    def grid_selected(self, row):
+        # Строка, выбранная в таблице, становится текущей записью формы
+        self.executor.submit(self.libraries.seek, row, callback=self.moved, errback=self.show_error)
+
+    def set_busy(self, busy):
+        self.status_label.config(text="Выполняется запрос..." if busy else "")
+        self.config(cursor="watch" if busy else "")
+
+    def show_error(self, error):
+        messagebox.showerror("Ошибка", str(error))
+
+    def show_db_error(self, error):
+        messagebox.showerror("Ошибка базы данных", str(error))
+
+    def open_source(self, source, where_clause="", params=()):
+        # Первая страница читается в фоне; новый поиск отменяет незавершённый
+        def opened(_):
+            self.libraries = source
+            self.show_record()
+            if self.grid_visible:
+                self.grid_view.show_source(source)
+        self.executor.submit(source.reset, where_clause, params,
+                             callback=opened, errback=self.show_error, tag="load")
+
     def load_libraries(self, where_clause="", params=()):
-        query = "SELECT library_id, name, address FROM libraries"
-        if where_clause:
-            query += " WHERE " + where_clause
-        query += " ORDER BY name"
-        self.cursor.execute(query, params)
-        self.libraries = self.cursor.fetchall()
-        self.index = 0
-        self.show_record()
+        self.open_source(self.libraries, where_clause, params)
 
     def show_record(self):
-        if not self.libraries:
+        record = self.libraries.current()
+        if self.grid_visible:
+            self.grid_view.select_record(record)
+        if record is None:
             self.clear_entries()
             self.current_id = None
             return
-        record = self.libraries[self.index]
         self.current_id = record[0]
         self.entry_name.delete(0, tk.END)
         self.entry_name.insert(0, record[1])
@@ -74,25 +117,25 @@ class LibrariesForm(tk.Frame):
         self.entry_name.delete(0, tk.END)
         self.entry_address.delete(0, tk.END)
 
-    def first_record(self):
-        if self.libraries:
-            self.index = 0
+    def navigate(self, move):
+        # Переход на границе страницы читает следующую страницу из БД
+        self.executor.submit(move, callback=self.moved, errback=self.show_error)
+
+    def moved(self, moved):
+        if moved:
             self.show_record()
 
+    def first_record(self):
+        self.navigate(self.libraries.first)
+
     def last_record(self):
-        if self.libraries:
-            self.index = len(self.libraries) - 1
-            self.show_record()
+        self.navigate(self.libraries.last)
 
     def next_record(self):
-        if self.libraries and self.index < len(self.libraries) - 1:
-            self.index += 1
-            self.show_record()
+        self.navigate(self.libraries.next)
 
     def prev_record(self):
-        if self.libraries and self.index > 0:
-            self.index -= 1
-            self.show_record()
+        self.navigate(self.libraries.prev)
 
     def add_record(self):
         self.clear_entries()
@@ -106,20 +149,23 @@ class LibrariesForm(tk.Frame):
             messagebox.showerror("Ошибка", "Наименование не может быть пустым.")
             return
 
-        try:
-            if self.current_id is None:
-                self.cursor.execute(
-                    "INSERT INTO libraries (name, address) VALUES (?, ?)",
-                    (name, address))
-            else:
-                self.cursor.execute(
-                    "UPDATE libraries SET name=?, address=? WHERE library_id=?",
-                    (name, address, self.current_id))
-            self.conn.commit()
-            self.load_libraries()
-            messagebox.showinfo("Успех", "Данные сохранены.")
-        except sqlite3.IntegrityError as e:
-            messagebox.showerror("Ошибка базы данных", str(e))
+        self.executor.submit_write(self.write_library, self.current_id, (name, address),
+                                   callback=self.saved, errback=self.show_db_error)
+
+    def write_library(self, conn, current_id, values):
+        # Выражения без commit: транзакция - QueryExecutor.submit_write
+        if current_id is None:
+            conn.execute(
+                "INSERT INTO libraries (name, address) VALUES (?, ?)",
+                values)
+        else:
+            conn.execute(
+                "UPDATE libraries SET name=?, address=? WHERE library_id=?",
+                values + (current_id,))
+
+    def saved(self, _):
+        self.load_libraries()
+        messagebox.showinfo("Успех", "Данные сохранены.")
 
     def delete_record(self):
         if self.current_id is None:
@@ -127,9 +173,15 @@ class LibrariesForm(tk.Frame):
             return
 
         if messagebox.askyesno("Подтверждение", "Удалить текущую запись?"):
-            self.cursor.execute("DELETE FROM libraries WHERE library_id=?", (self.current_id,))
-            self.conn.commit()
-            self.load_libraries()
+            # IntegrityError - запись используется в других таблицах (foreign_keys = ON)
+            self.executor.submit_write(self.remove_library, self.current_id,
+                                       callback=self.deleted, errback=self.show_db_error)
+
+    def remove_library(self, conn, current_id):
+        conn.execute("DELETE FROM libraries WHERE library_id=?", (current_id,))
+
+    def deleted(self, _):
+        self.load_libraries()
 
     def search(self):
         name = self.search_name.get().strip()
@@ -143,6 +195,7 @@ class LibrariesForm(tk.Frame):
 if __name__ == "__main__":
     root = tk.Tk()
     root.title("Библиотеки")
+    diagnostics_form.install(root)
     form = LibrariesForm(root)
     form.pack(padx=10, pady=10)
     root.mainloop()
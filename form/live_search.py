@@ -0,0 +1,43 @@
+from db import search
+
+
+class LiveSearch:
+    # Поиск по мере ввода: on_change(text, explicit) вызывается через
+    # DEBOUNCE_MS после последнего изменения текста в поле (серия нажатий -
+    # один запрос) или сразу по Enter / кнопке "Найти" (explicit=True).
+
+    def __init__(self, entry, on_change, delay=search.DEBOUNCE_MS):
+        self.entry = entry
+        self.on_change = on_change
+        self.delay = delay
+        self.pending = None
+        self.last_text = None
+        entry.bind("<KeyRelease>", self.changed)
+        entry.bind("<Return>", self.submit)
+
+    def changed(self, event=None):
+        if self.pending is not None:
+            self.entry.after_cancel(self.pending)
+        self.pending = self.entry.after(self.delay, self.fire)
+
+    def submit(self, event=None):
+        self.fire(explicit=True)
+
+    def fire(self, explicit=False):
+        if self.pending is not None:
+            self.entry.after_cancel(self.pending)
+            self.pending = None
+        text = self.entry.get().strip()
+        # Стрелки, Shift и т.п. тоже дают KeyRelease - без изменения текста не искать
+        if text == self.last_text and not explicit:
+            return
+        self.last_text = text
+        self.on_change(text, explicit)
+
+    def clear(self):
+        # Сброс фильтра: очистить поле без нового поиска
+        if self.pending is not None:
+            self.entry.after_cancel(self.pending)
+            self.pending = None
+        self.entry.delete(0, "end")
+        self.last_text = ""
@@ -0,0 +1,223 @@
+import tkinter as tk
+from tkinter import messagebox
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import shards
+from db.executor import QueryExecutor
+from db.record_source import RecordSource
+from form import diagnostics_form
+from form.record_grid import RecordGrid
+
+PUBLISHER_GRID_COLUMNS = (
+    ("name", "Наименование", 220), ("address", "Адрес", 260),
+)
+
+# Справочник издательств: книги ссылаются на него по publisher_id. При
+# раздельном хранении (db/shards.py) в файлах библиотек - копии справочника,
+# после изменений они обновляются (ShardRouter.sync_publishers).
+
+class PublishersForm(tk.Frame):
+    def __init__(self, master):
+        super().__init__(master)
+        self.current_id = None
+        self.publishers = RecordSource("publishers", ("publisher_id", "name", "address"), ("name", "publisher_id"))
+        self.router = shards.get_router()
+
+        self.grid_visible = False
+        self.executor = QueryExecutor(self, on_busy=self.set_busy)
+        self.create_widgets()
+        self.load_publishers()
+        self.show_record()
+
+    def create_widgets(self):
+        tk.Label(self, text="Наименование:").grid(row=0, column=0, sticky="e")
+        self.entry_name = tk.Entry(self, width=40)
+        self.entry_name.grid(row=0, column=1, columnspan=3, sticky="w")
+
+        tk.Label(self, text="Адрес:").grid(row=1, column=0, sticky="e")
+        self.entry_address = tk.Entry(self, width=40)
+        self.entry_address.grid(row=1, column=1, columnspan=3, sticky="w")
+
+        nav_frame = tk.Frame(self)
+        nav_frame.grid(row=2, column=0, columnspan=4, pady=10)
+        tk.Button(nav_frame, text="<<", command=self.first_record).pack(side="left")
+        tk.Button(nav_frame, text="<", command=self.prev_record).pack(side="left")
+        tk.Button(nav_frame, text=">", command=self.next_record).pack(side="left")
+        tk.Button(nav_frame, text=">>", command=self.last_record).pack(side="left")
+        tk.Button(nav_frame, text="Таблица", command=self.toggle_grid).pack(side="left", padx=10)
+
+        btn_frame = tk.Frame(self)
+        btn_frame.grid(row=3, column=0, columnspan=4, pady=10)
+        tk.Button(btn_frame, text="Добавить", command=self.add_record).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Сохранить", command=self.save_record).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Удалить", command=self.delete_record).pack(side="left", padx=5)
+
+        search_frame = tk.Frame(self)
+        search_frame.grid(row=4, column=0, columnspan=4, pady=10)
+        tk.Label(search_frame, text="Поиск по наименованию:").pack(side="left")
+        self.search_name = tk.Entry(search_frame, width=20)
+        self.search_name.pack(side="left", padx=5)
+        tk.Button(search_frame, text="Найти", command=self.search).pack(side="left")
+        tk.Button(search_frame, text="Сбросить фильтр", command=self.load_publishers).pack(side="left", padx=10)
+
+        self.status_label = tk.Label(self, text="", fg="gray")
+        self.status_label.grid(row=5, column=0, columnspan=4, sticky="w")
+
+        self.grid_view = RecordGrid(self, self.executor, PUBLISHER_GRID_COLUMNS, self.grid_selected)
+        self.grid_view.grid(row=6, column=0, columnspan=4, sticky="nsew", pady=5)
+        self.grid_view.grid_remove()
+
+    def toggle_grid(self):
+        self.grid_visible = not self.grid_visible
+        if self.grid_visible:
+            self.grid_view.grid()
+            self.grid_view.show_source(self.publishers)
+        else:
+            self.grid_view.grid_remove()
+
+    def grid_selected(self, row):
+        # Строка, выбранная в таблице, становится текущей записью формы
+        self.executor.submit(self.publishers.seek, row, callback=self.moved, errback=self.show_error)
+
+    def set_busy(self, busy):
+        self.status_label.config(text="Выполняется запрос..." if busy else "")
+        self.config(cursor="watch" if busy else "")
+
+    def show_error(self, error):
+        messagebox.showerror("Ошибка", str(error))
+
+    def show_db_error(self, error):
+        messagebox.showerror("Ошибка базы данных", str(error))
+
+    def open_source(self, source, where_clause="", params=()):
+        # Первая страница читается в фоне; новый поиск отменяет незавершённый
+        def opened(_):
+            self.publishers = source
+            self.show_record()
+            if self.grid_visible:
+                self.grid_view.show_source(source)
+        self.executor.submit(source.reset, where_clause, params,
+                             callback=opened, errback=self.show_error, tag="load")
+
+    def load_publishers(self, where_clause="", params=()):
+        self.open_source(self.publishers, where_clause, params)
+
+    def show_record(self):
+        record = self.publishers.current()
+        if self.grid_visible:
+            self.grid_view.select_record(record)
+        if record is None:
+            self.clear_entries()
+            self.current_id = None
+            return
+        self.current_id = record[0]
+        self.entry_name.delete(0, tk.END)
+        self.entry_name.insert(0, record[1])
+        self.entry_address.delete(0, tk.END)
+        self.entry_address.insert(0, record[2] or "")
+
+    def clear_entries(self):
+        self.entry_name.delete(0, tk.END)
+        self.entry_address.delete(0, tk.END)
+
+    def navigate(self, move):
+        # Переход на границе страницы читает следующую страницу из БД
+        self.executor.submit(move, callback=self.moved, errback=self.show_error)
+
+    def moved(self, moved):
+        if moved:
+            self.show_record()
+
+    def first_record(self):
+        self.navigate(self.publishers.first)
+
+    def last_record(self):
+        self.navigate(self.publishers.last)
+
+    def next_record(self):
+        self.navigate(self.publishers.next)
+
+    def prev_record(self):
+        self.navigate(self.publishers.prev)
+
+    def add_record(self):
+        self.clear_entries()
+        self.current_id = None
+
+    def save_record(self):
+        name = self.entry_name.get().strip()
+        address = self.entry_address.get().strip()
+
+        if not name:
+            messagebox.showerror("Ошибка", "Наименование не может быть пустым.")
+            return
+
+        self.executor.submit_write(self.write_publisher, self.current_id, (name, address or None),
+                                   callback=self.saved, errback=self.show_db_error)
+
+    def write_publisher(self, conn, current_id, values):
+        # Выражения без commit: транзакция - QueryExecutor.submit_write.
+        # Переименование переиндексирует книги издательства (триггер books_fts_publisher)
+        if current_id is None:
+            conn.execute(
+                "INSERT INTO publishers (name, address) VALUES (?, ?)",
+                values)
+        else:
+            conn.execute(
+                "UPDATE publishers SET name=?, address=? WHERE publisher_id=?",
+                values + (current_id,))
+
+    def saved(self, _):
+        self.synced()
+        messagebox.showinfo("Успех", "Данные сохранены.")
+
+    def synced(self):
+        # Копии справочника в файлах библиотек - в фоне, затем список
+        self.executor.submit(self.router.sync_publishers, callback=lambda _: self.load_publishers(),
+                             errback=self.show_db_error)
+
+    def delete_record(self):
+        if self.current_id is None:
+            messagebox.showwarning("Внимание", "Нет записи для удаления.")
+            return
+
+        if messagebox.askyesno("Подтверждение", "Удалить текущую запись?"):
+            # Книги проверяются во всех файлах библиотек: внешний ключ общей
+            # базы (foreign_keys = ON) видит только её собственную таблицу books
+            current_id = self.current_id
+            self.executor.submit(self.router.publisher_books, current_id,
+                                 callback=lambda books: self.remove_checked(current_id, books),
+                                 errback=self.show_db_error)
+
+    def remove_checked(self, current_id, books):
+        if books:
+            messagebox.showerror("Ошибка", f"Издательство указано у книг: {books}. Удаление невозможно.")
+            return
+        self.executor.submit_write(self.remove_publisher, current_id,
+                                   callback=self.deleted, errback=self.show_db_error)
+
+    def remove_publisher(self, conn, current_id):
+        conn.execute("DELETE FROM publishers WHERE publisher_id=?", (current_id,))
+
+    def deleted(self, _):
+        self.synced()
+
+    def search(self):
+        name = self.search_name.get().strip()
+        if name:
+            where = "name LIKE ?"
+            param = ('%' + name + '%',)
+            self.load_publishers(where, param)
+        else:
+            self.load_publishers()
+
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.title("Издательства")
+    diagnostics_form.install(root)
+    form = PublishersForm(root)
+    form.pack(padx=10, pady=10)
+    root.mainloop()
@@ -1,19 +1,36 @@
 import tkinter as tk
 from tkinter import messagebox
-import sqlite3
+import os
+import sys
 
-DB_PATH = "../db/library.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import dedup, search, snapshot
+from db.connection import get_connection
+from db.executor import QueryExecutor
+from db.record_source import RecordSource
+from form.live_search import LiveSearch
+from form import diagnostics_form
+from form.record_grid import RecordGrid
+
+READER_COLUMNS = ("reader_id", "full_name", "address", "phone")
+
+READER_GRID_COLUMNS = (
+    ("full_name", "ФИО", 220), ("address", "Адрес", 220), ("phone", "Телефон", 120),
+)
 
 class ReadersForm(tk.Frame):
     def __init__(self, master):
         super().__init__(master)
-        self.conn = sqlite3.connect(DB_PATH)
-        self.cursor = self.conn.cursor()
-
         self.current_id = None
-        self.readers = []
-        self.index = 0
-
+        self.all_readers = RecordSource("readers", READER_COLUMNS, ("full_name", "reader_id"))
+        self.found_readers = RecordSource(search.READERS_HITS, READER_COLUMNS + ("rank",), ("rank", "reader_id"),
+                                          page_size=search.RESULT_PAGE_SIZE)
+        self.reader_search = search.CachedSearch(self.found_readers, "readers", ("full_name", "address"))
+        self.readers = self.all_readers
+
+        self.grid_visible = False
+        self.executor = QueryExecutor(self, on_busy=self.set_busy)
         self.create_widgets()
         self.load_readers()
         self.show_record()
@@ -37,6 +54,7 @@ class ReadersForm(tk.Frame):
         tk.Button(nav_frame, text="<", command=self.prev_record).pack(side="left")
         tk.Button(nav_frame, text=">", command=self.next_record).pack(side="left")
         tk.Button(nav_frame, text=">>", command=self.last_record).pack(side="left")
+        tk.Button(nav_frame, text="Таблица", command=self.toggle_grid).pack(side="left", padx=10)
 
         btn_frame = tk.Frame(self)
         btn_frame.grid(row=4, column=0, columnspan=4, pady=10)
@@ -46,28 +64,65 @@ class ReadersForm(tk.Frame):
 
         search_frame = tk.Frame(self)
         search_frame.grid(row=5, column=0, columnspan=4, pady=10)
-        tk.Label(search_frame, text="Поиск по ФИО:").pack(side="left")
+        tk.Label(search_frame, text="Поиск (ФИО, адрес):").pack(side="left")
         self.search_name = tk.Entry(search_frame, width=20)
         self.search_name.pack(side="left", padx=5)
-        tk.Button(search_frame, text="Найти", command=self.search).pack(side="left")
-        tk.Button(search_frame, text="Сбросить фильтр", command=self.load_readers).pack(side="left", padx=10)
+        self.live_search = LiveSearch(self.search_name, self.search)
+        tk.Button(search_frame, text="Найти", command=self.live_search.submit).pack(side="left")
+        tk.Button(search_frame, text="Сбросить фильтр", command=self.reset_filter).pack(side="left", padx=10)
+
+        self.status_label = tk.Label(self, text="", fg="gray")
+        self.status_label.grid(row=6, column=0, columnspan=4, sticky="w")
+
+        self.grid_view = RecordGrid(self, self.executor, READER_GRID_COLUMNS, self.grid_selected,
+                                    connect=snapshot.get_snapshot().connection)
+        self.grid_view.grid(row=7, column=0, columnspan=4, sticky="nsew", pady=5)
+        self.grid_view.grid_remove()
+
+    def toggle_grid(self):
+        self.grid_visible = not self.grid_visible
+        if self.grid_visible:
+            self.grid_view.grid()
+            self.grid_view.show_source(self.readers)
+        else:
+            self.grid_view.grid_remove()
 
-    def load_readers(self, where_clause="", params=()):
-        query = "SELECT reader_id, full_name, address, phone FROM readers"
-        if where_clause:
-            query += " WHERE " + where_clause
-        query += " ORDER BY full_name"
-        self.cursor.execute(query, params)
-        self.readers = self.cursor.fetchall()
-        self.index = 0
+    def grid_selected(self, row):
+        # Строка, выбранная в таблице, становится текущей записью формы
+        self.executor.submit(self.readers.seek, row, callback=self.moved, errback=self.show_error)
+
+    def set_busy(self, busy):
+        self.status_label.config(text="Выполняется запрос..." if busy else "")
+        self.config(cursor="watch" if busy else "")
+
+    def show_error(self, error):
+        messagebox.showerror("Ошибка", str(error))
+
+    def show_db_error(self, error):
+        messagebox.showerror("Ошибка базы данных", str(error))
+
+    def open_source(self, source, where_clause="", params=()):
+        # Первая страница читается в фоне; новый поиск отменяет незавершённый
+        self.executor.submit(source.reset, where_clause, params,
+                             callback=lambda _: self.opened(source), errback=self.show_error, tag="load")
+
+    def opened(self, source):
+        self.readers = source
         self.show_record()
+        if self.grid_visible:
+            self.grid_view.show_source(source)
+
+    def load_readers(self, where_clause="", params=()):
+        self.open_source(self.all_readers, where_clause, params)
 
     def show_record(self):
-        if not self.readers:
+        record = self.readers.current()
+        if self.grid_visible:
+            self.grid_view.select_record(record)
+        if record is None:
             self.clear_entries()
             self.current_id = None
             return
-        record = self.readers[self.index]
         self.current_id = record[0]
         self.entry_name.delete(0, tk.END)
         self.entry_name.insert(0, record[1])
@@ -81,25 +136,25 @@ class ReadersForm(tk.Frame):
         self.entry_address.delete(0, tk.END)
         self.entry_phone.delete(0, tk.END)
 
-    def first_record(self):
-        if self.readers:
-            self.index = 0
+    def navigate(self, move):
+        # Переход на границе страницы читает следующую страницу из БД
+        self.executor.submit(move, callback=self.moved, errback=self.show_error)
+
+    def moved(self, moved):
+        if moved:
             self.show_record()
 
+    def first_record(self):
+        self.navigate(self.readers.first)
+
     def last_record(self):
-        if self.readers:
-            self.index = len(self.readers) - 1
-            self.show_record()
+        self.navigate(self.readers.last)
 
     def next_record(self):
-        if self.readers and self.index < len(self.readers) - 1:
-            self.index += 1
-            self.show_record()
+        self.navigate(self.readers.next)
 
     def prev_record(self):
-        if self.readers and self.index > 0:
-            self.index -= 1
-            self.show_record()
+        self.navigate(self.readers.prev)
 
     def add_record(self):
         self.clear_entries()
@@ -114,20 +169,35 @@ class ReadersForm(tk.Frame):
             messagebox.showerror("Ошибка", "ФИО не может быть пустым.")
             return
 
-        try:
-            if self.current_id is None:
-                self.cursor.execute(
-                    "INSERT INTO readers (full_name, address, phone) VALUES (?, ?, ?)",
-                    (name, address, phone))
-            else:
-                self.cursor.execute(
-                    "UPDATE readers SET full_name=?, address=?, phone=? WHERE reader_id=?",
-                    (name, address, phone, self.current_id))
-            self.conn.commit()
-            self.load_readers()
-            messagebox.showinfo("Успех", "Данные сохранены.")
-        except sqlite3.IntegrityError as e:
-            messagebox.showerror("Ошибка базы данных", str(e))
+        # Сначала - похожие читатели (db/dedup.py), запись - после подтверждения
+        current_id = self.current_id
+        self.executor.submit(lambda: dedup.similar_readers(get_connection(), name, address, phone,
+                                                           exclude=current_id),
+                             callback=lambda found: self.store_checked(current_id, (name, address, phone), found),
+                             errback=self.show_db_error, tag="dedup")
+
+    def store_checked(self, current_id, values, found):
+        if found and not messagebox.askyesno("Возможный дубль", "Похожие читатели:\n\n" + "\n".join(
+                f"{reader_id}: {full_name}, {address or '-'}, {phone or '-'}, сходство {score:.2f}"
+                for score, reader_id, full_name, address, phone in found) + "\n\nВсё равно сохранить?"):
+            return
+        self.executor.submit_write(self.write_reader, current_id, values,
+                                   callback=self.saved, errback=self.show_db_error)
+
+    def write_reader(self, conn, current_id, values):
+        # Выражения без commit: транзакция - QueryExecutor.submit_write
+        if current_id is None:
+            conn.execute(
+                "INSERT INTO readers (full_name, address, phone) VALUES (?, ?, ?)",
+                values)
+        else:
+            conn.execute(
+                "UPDATE readers SET full_name=?, address=?, phone=? WHERE reader_id=?",
+                values + (current_id,))
+
+    def saved(self, _):
+        self.load_readers()
+        messagebox.showinfo("Успех", "Данные сохранены.")
 
     def delete_record(self):
         if self.current_id is None:
@@ -135,22 +205,34 @@ class ReadersForm(tk.Frame):
             return
 
         if messagebox.askyesno("Подтверждение", "Удалить текущую запись?"):
-            self.cursor.execute("DELETE FROM readers WHERE reader_id=?", (self.current_id,))
-            self.conn.commit()
-            self.load_readers()
+            # IntegrityError - запись используется в других таблицах (foreign_keys = ON)
+            self.executor.submit_write(self.remove_reader, self.current_id,
+                                       callback=self.deleted, errback=self.show_db_error)
 
-    def search(self):
-        name = self.search_name.get().strip()
-        if name:
-            where = "full_name LIKE ?"
-            param = ('%' + name + '%',)
-            self.load_readers(where, param)
-        else:
+    def remove_reader(self, conn, current_id):
+        conn.execute("DELETE FROM readers WHERE reader_id=?", (current_id,))
+
+    def deleted(self, _):
+        self.load_readers()
+
+    def search(self, name, explicit=False):
+        # Вызывается LiveSearch по мере ввода; короткая строка - LIKE только по Enter
+        if len(name) >= search.MIN_QUERY_LENGTH:
+            self.executor.submit(self.reader_search.run, name,
+                                 callback=self.opened, errback=self.show_error, tag="load")
+        elif name and explicit:
+            self.load_readers("full_name LIKE ? ESCAPE '\\'", (search.like_pattern(name),))
+        elif not name:
             self.load_readers()
 
+    def reset_filter(self):
+        self.live_search.clear()
+        self.load_readers()
+
 if __name__ == "__main__":
     root = tk.Tk()
     root.title("Читатели")
+    diagnostics_form.install(root)
     form = ReadersForm(root)
     form.pack(padx=10, pady=10)
     root.mainloop()
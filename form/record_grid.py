@@ -0,0 +1,287 @@
+import collections
+from tkinter import ttk
+
+from db.connection import get_connection
+from db.row_store import RowStore
+
+VISIBLE_ROWS = 15
+PAGE_SIZE = 100
+CACHED_PAGES = 20
+
+
+class RecordGrid(ttk.Frame):
+    # Табличный режим формы с виртуальной прокруткой.
+    # В Treeview всегда только видимые строки (VISIBLE_ROWS); данные читаются
+    # из БД страницами по PAGE_SIZE по мере прокрутки и кэшируются (CACHED_PAGES).
+    # Следующая страница берётся по ключу последней строки предыдущей,
+    # OFFSET - только при прыжке ползунком. Страницы кэша хранятся по столбцам
+    # (db/row_store.py). Сортировка щелчком по заголовку выполняется в SQLite
+    # (ORDER BY), а не в Python.
+    # Источник (таблица, фильтр) берётся у RecordSource формы - show_source().
+    # connect() даёт соединение рабочего потока: по умолчанию основная база,
+    # для тяжёлого просмотра - снимок (db/snapshot.py, Snapshot.connection).
+    # multiple - выбор нескольких строк (Ctrl/Shift) для пакетных операций:
+    # отмеченные строки (marked) сохраняются при прокрутке, on_mark(число) -
+    # при каждом изменении отметки.
+
+    def __init__(self, master, executor, shown, on_select, connect=get_connection,
+                 multiple=False, on_mark=None):
+        super().__init__(master)
+        self.executor = executor
+        self.connect = connect
+        self.multiple = multiple
+        self.on_mark = on_mark
+        self.columns = ()
+        self.shown = [name for name, _, _ in shown]
+        self.on_select = on_select
+
+        self.table = None
+        self.where_clause = ""
+        self.params = ()
+        self.key = ()
+        self.key_idx = []
+        self.sort_column = None
+        self.descending = False
+        self.total = 0
+        self.offset = 0
+        self.generation = 0
+        self.pages = collections.OrderedDict()
+        self.visible = []
+        self.selected_key = None
+        self.marked = {}  # ключ -> строка
+        self.clear_hidden = False
+
+        self.tree = ttk.Treeview(self, columns=self.shown, show="headings", height=VISIBLE_ROWS,
+                                 selectmode="extended" if multiple else "browse")
+        for name, heading, width in shown:
+            self.tree.heading(name, text=heading, command=lambda c=name: self.sort_by(c))
+            self.tree.column(name, width=width, stretch=name == self.shown[-1])
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scroll)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.columnconfigure(0, weight=1)
+
+        self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+        # Щелчок без Ctrl/Shift снимает и отметки строк, прокрученных за край
+        self.tree.bind("<ButtonPress-1>", lambda e: setattr(self, "clear_hidden", not e.state & 0x0005))
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_rows(-1 if e.delta > 0 else 1))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_rows(-1))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_rows(1))
+
+    # ---------- Источник и сортировка ----------
+
+    def show_source(self, source):
+        self.table = source.table
+        self.columns = source.columns
+        self.where_clause = source.where_clause
+        self.params = source.params
+        self.key = source.key
+        self.key_idx = source.key_idx
+        self.set_marked({})
+        self.sort_column = None
+        self.descending = False
+        for name in self.shown:
+            self.tree.heading(name, text=self.tree.heading(name, "text").rstrip(" ▲▼"))
+        self.reload()
+
+    def sort_by(self, column):
+        if self.sort_column == column:
+            self.descending = not self.descending
+        else:
+            self.sort_column = column
+            self.descending = False
+        arrow = " ▼" if self.descending else " ▲"
+        for name in self.shown:
+            text = self.tree.heading(name, "text").rstrip(" ▲▼")
+            self.tree.heading(name, text=text + (arrow if name == column else ""))
+        self.reload()
+
+    def order_columns(self):
+        # Ключ источника дописывается к столбцу сортировки, чтобы порядок был однозначным
+        if self.sort_column is None:
+            return list(self.key)
+        return [self.sort_column] + [k for k in self.key if k != self.sort_column]
+
+    def reload(self):
+        if self.table is None:
+            return
+        self.generation += 1
+        self.pages.clear()
+        self.offset = 0
+        spec = (self.table, self.where_clause, self.params)
+        self.executor.submit(self.count_rows, spec, callback=self.counted(self.generation),
+                             tag="grid-count")
+
+    def count_rows(self, spec):
+        # Выполняется в рабочем потоке
+        table, where_clause, params = spec
+        query = "SELECT COUNT(*) FROM " + table
+        if where_clause:
+            query += " WHERE " + where_clause
+        return self.connect().execute(query, params).fetchone()[0]
+
+    def counted(self, generation):
+        def apply(total):
+            if generation == self.generation:
+                self.total = total
+                self.show_offset()
+        return apply
+
+    # ---------- Чтение страниц ----------
+
+    def fetch_pages(self, spec, wanted):
+        # Выполняется в рабочем потоке. wanted - [(номер страницы, последняя строка
+        # предыдущей страницы или None)]; без опорной строки - LIMIT/OFFSET.
+        table, where_clause, params, order, descending = spec
+        order_idx = [self.columns.index(c) for c in order]
+        # NULL - в начале в обоих направлениях: после опорной строки с непустым
+        # значением NULL уже не встретятся, и сравнение по ключу их не теряет
+        direction = " DESC NULLS FIRST" if descending else ""
+        op = "<" if descending else ">"
+        conn = self.connect()
+        result = {}
+        for page_no, anchor in wanted:
+            if anchor is None and page_no - 1 in result and result[page_no - 1]:
+                anchor = result[page_no - 1][-1]
+            conditions = ["(" + where_clause + ")"] if where_clause else []
+            extra = []
+            anchor_values = None if anchor is None else [anchor[i] for i in order_idx]
+            if anchor_values is not None and None not in anchor_values:
+                conditions.append("(" + ", ".join(order) + ") " + op + " (" + ", ".join("?" * len(order)) + ")")
+                extra = anchor_values
+                offset = 0
+            else:
+                offset = page_no * PAGE_SIZE
+            query = "SELECT " + ", ".join(self.columns) + " FROM " + table
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += " ORDER BY " + ", ".join(c + direction for c in order) + " LIMIT ? OFFSET ?"
+            result[page_no] = RowStore.from_cursor(
+                conn.execute(query, tuple(params) + tuple(extra) + (PAGE_SIZE, offset)))
+        return result
+
+    def show_offset(self):
+        last = min(self.offset + VISIBLE_ROWS, self.total)
+        needed = range(self.offset // PAGE_SIZE, max(last - 1, self.offset) // PAGE_SIZE + 1)
+        missing = [p for p in needed if p not in self.pages]
+        if not missing or not self.total:
+            self.render()
+            return
+        wanted = []
+        for page_no in missing:
+            previous = self.pages.get(page_no - 1)
+            wanted.append((page_no, previous[-1] if previous else None))
+        spec = (self.table, self.where_clause, self.params, self.order_columns(), self.descending)
+        self.executor.submit(self.fetch_pages, spec, wanted, callback=self.fetched(self.generation),
+                             tag="grid")
+
+    def fetched(self, generation):
+        def apply(pages):
+            if generation != self.generation:
+                return
+            for page_no, rows in pages.items():
+                self.pages[page_no] = rows
+                self.pages.move_to_end(page_no)
+            while len(self.pages) > CACHED_PAGES:
+                self.pages.popitem(last=False)
+            self.render()
+        return apply
+
+    def render(self):
+        self.visible = []
+        for index in range(self.offset, min(self.offset + VISIBLE_ROWS, self.total)):
+            page = self.pages.get(index // PAGE_SIZE)
+            if page is None or index % PAGE_SIZE >= len(page):
+                break
+            self.visible.append(page[index % PAGE_SIZE])
+        self.tree.delete(*self.tree.get_children())
+        positions = [self.columns.index(name) for name in self.shown]
+        for i, row in enumerate(self.visible):
+            values = ["" if row[p] is None else row[p] for p in positions]
+            self.tree.insert("", "end", iid=str(i), values=values)
+            key = self.row_key(row)
+            if key == self.selected_key or key in self.marked:
+                self.tree.selection_add(str(i))
+        if self.total:
+            self.scrollbar.set(self.offset / self.total, min(1.0, (self.offset + VISIBLE_ROWS) / self.total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    # ---------- Прокрутка и выбор ----------
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.move_to(int(float(amount) * self.total))
+        elif unit == "pages":
+            self.scroll_rows(int(amount) * VISIBLE_ROWS)
+        else:
+            self.scroll_rows(int(amount))
+
+    def scroll_rows(self, rows):
+        self.move_to(self.offset + rows)
+
+    def move_to(self, offset):
+        offset = max(0, min(offset, self.total - VISIBLE_ROWS))
+        if offset != self.offset:
+            self.offset = offset
+            self.show_offset()
+
+    def row_key(self, row):
+        return tuple(row[i] for i in self.key_idx)
+
+    def on_tree_select(self, event):
+        selection = self.tree.selection()
+        if self.multiple:
+            # Отметка невидимых строк не меняется, видимых - по выделению в Treeview
+            visible_keys = {self.row_key(visible) for visible in self.visible}
+            marked = {} if self.clear_hidden else {key: row for key, row in self.marked.items()
+                                                   if key not in visible_keys}
+            self.clear_hidden = False
+            marked.update((self.row_key(self.visible[int(i)]), self.visible[int(i)])
+                          for i in selection if int(i) < len(self.visible))
+            self.set_marked(marked)
+            focus = self.tree.focus()
+            selection = (focus,) if focus in selection else ()
+        if not selection:
+            return
+        row = self.visible[int(selection[0])]
+        key = self.row_key(row)
+        if key != self.selected_key:
+            self.selected_key = key
+            self.on_select(row)
+
+    def select_record(self, row):
+        # Синхронизация с формой: подсветить запись, если она видна
+        self.selected_key = None if row is None else self.row_key(row)
+        if self.selected_key in self.marked:
+            return
+        for i, visible in enumerate(self.visible):
+            if self.row_key(visible) == self.selected_key:
+                self.tree.selection_set(str(i))
+                return
+        self.tree.selection_remove(*self.tree.selection())
+
+    # ---------- Пакетные операции ----------
+
+    def set_marked(self, marked):
+        changed = marked.keys() != self.marked.keys()
+        self.marked = marked
+        if changed and self.on_mark:
+            self.on_mark(len(marked))
+
+    def replace_rows(self, patch):
+        # Изменённые строки подставляются в кэш страниц без чтения из БД
+        for page_no, rows in self.pages.items():
+            self.pages[page_no] = RowStore.from_rows(patch(row) for row in rows)
+        self.set_marked({key: patch(row) for key, row in self.marked.items()})
+        self.render()
+
+    def remove_rows(self, removed, count):
+        # count строк удалено: следующие страницы сдвигаются, поэтому кэш
+        # сбрасывается и перечитываются только видимые страницы, без COUNT(*)
+        self.total = max(0, self.total - count)
+        self.generation += 1
+        self.pages.clear()
+        self.set_marked({key: row for key, row in self.marked.items() if not removed(row)})
+        self.offset = max(0, min(self.offset, self.total - VISIBLE_ROWS))
+        self.show_offset()
@@ -0,0 +1,196 @@
+import datetime
+import time
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import reports, shards, snapshot
+from db.executor import QueryExecutor
+from form import diagnostics_form
+
+REPORTS = (
+    ("Просроченные выдачи", "overdue"),
+    ("История читателя", "history"),
+    ("Динамика выдач", "trends"),
+    ("Дубли книг", "books"),
+    ("Дубли читателей", "readers"),
+)
+TREND_KEYS = (("по библиотекам", "library"), ("по тематикам", "theme"))
+BUCKETS = (("по дням", "day"), ("по неделям", "week"), ("по месяцам", "month"))
+
+# Строк за одно чтение и всего в окне: дальше - только выгрузка в файл
+BATCH_ROWS = 500
+MAX_ROWS = 20000
+
+
+class ReportForm(tk.Frame):
+    # Окно отчётов db/reports.py. Строки читаются из снимка базы в рабочем
+    # потоке порциями по BATCH_ROWS и добавляются в таблицу по мере чтения,
+    # окно не ждёт конца запроса. Полный отчёт - "Сохранить CSV/JSON".
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.report = None
+        self.batches = None  # генератор reports.stream (живёт в рабочем потоке)
+        self.generation = 0
+        self.shown = 0
+        self.started = None
+        self.executor = QueryExecutor(self, on_busy=self.set_busy)
+        self.create_widgets()
+
+    def create_widgets(self):
+        options = tk.Frame(self)
+        options.grid(row=0, column=0, columnspan=2, sticky="w")
+        self.report_cb = ttk.Combobox(options, state="readonly", width=22,
+                                      values=[title for title, _ in REPORTS])
+        self.report_cb.current(0)
+        self.report_cb.pack(side="left")
+        tk.Label(options, text="На дату:").pack(side="left", padx=(10, 0))
+        self.entry_today = tk.Entry(options, width=11)
+        self.entry_today.insert(0, datetime.date.today().isoformat())
+        self.entry_today.pack(side="left")
+        tk.Label(options, text="Библиотека:").pack(side="left", padx=(10, 0))
+        self.entry_library = tk.Entry(options, width=6)
+        self.entry_library.pack(side="left")
+        tk.Label(options, text="Читатель:").pack(side="left", padx=(10, 0))
+        self.entry_reader = tk.Entry(options, width=8)
+        self.entry_reader.pack(side="left")
+
+        trends = tk.Frame(self)
+        trends.grid(row=1, column=0, columnspan=2, sticky="w", pady=5)
+        tk.Label(trends, text="Динамика:").pack(side="left")
+        self.by_cb = ttk.Combobox(trends, state="readonly", width=16, values=[t for t, _ in TREND_KEYS])
+        self.by_cb.current(0)
+        self.by_cb.pack(side="left")
+        self.bucket_cb = ttk.Combobox(trends, state="readonly", width=12, values=[t for t, _ in BUCKETS])
+        self.bucket_cb.current(2)
+        self.bucket_cb.pack(side="left", padx=5)
+        tk.Label(trends, text="с").pack(side="left")
+        self.entry_from = tk.Entry(trends, width=11)
+        self.entry_from.pack(side="left")
+        tk.Label(trends, text="по").pack(side="left")
+        self.entry_to = tk.Entry(trends, width=11)
+        self.entry_to.pack(side="left")
+
+        btn_frame = tk.Frame(self)
+        btn_frame.grid(row=2, column=0, columnspan=2, sticky="w", pady=5)
+        tk.Button(btn_frame, text="Построить", command=self.build_report).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Сохранить CSV", command=lambda: self.save("csv")).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Сохранить JSON", command=lambda: self.save("json")).pack(side="left", padx=5)
+
+        self.tree = ttk.Treeview(self, show="headings", height=20)
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.grid(row=3, column=0, sticky="nsew")
+        scrollbar.grid(row=3, column=1, sticky="ns")
+
+        self.status_label = tk.Label(self, text="", fg="gray")
+        self.status_label.grid(row=4, column=0, columnspan=2, sticky="w")
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(3, weight=1)
+
+    def set_busy(self, busy):
+        self.config(cursor="watch" if busy else "")
+
+    def make_report(self):
+        # Отчёт по полям формы; ValueError - при ошибке ввода
+        kind = REPORTS[self.report_cb.current()][1]
+        today = datetime.date.fromisoformat(self.entry_today.get().strip())
+        if kind == "overdue":
+            library = self.entry_library.get().strip()
+            return reports.overdue_report(today, int(library) if library else None)
+        if kind == "history":
+            return reports.history_report(int(self.entry_reader.get().strip()), today)
+        if kind in ("books", "readers"):
+            library = self.entry_library.get().strip()
+            return reports.duplicates_report(kind, library_id=int(library) if library and kind == "books" else None)
+        dates = []
+        for entry in (self.entry_from, self.entry_to):
+            text = entry.get().strip()
+            dates.append(datetime.date.fromisoformat(text).isoformat() if text else None)
+        return reports.trends_report(TREND_KEYS[self.by_cb.current()][1], BUCKETS[self.bucket_cb.current()][1],
+                                     *dates)
+
+    def build_report(self):
+        try:
+            report = self.make_report()
+        except ValueError:
+            messagebox.showerror("Ошибка", "Проверьте даты (ГГГГ-ММ-ДД) и коды библиотеки и читателя")
+            return
+        self.report = report
+        self.generation += 1
+        self.shown = 0
+        self.started = time.perf_counter()
+        self.tree.delete(*self.tree.get_children())
+        self.tree.configure(columns=report.columns)
+        for name in report.columns:
+            self.tree.heading(name, text=name)
+            self.tree.column(name, width=90, stretch=True)
+        self.status_label.config(text=report.title + ": выполняется...")
+        self.executor.submit(self.open_stream, report, callback=self.add_rows(self.generation),
+                             errback=self.show_db_error, tag="report")
+
+    # Выполняются в рабочем потоке (у QueryExecutor он один - курсор не меняет поток)
+
+    def open_stream(self, report):
+        if self.batches is not None:
+            self.batches.close()
+        reads = snapshot.get_snapshot()
+        self.batches = reports.stream(reads.connection(), report, BATCH_ROWS, shards.snapshot_connections(reads))
+        return next(self.batches, [])
+
+    def next_batch(self):
+        return next(self.batches, [])
+
+    def add_rows(self, generation):
+        def apply(rows):
+            if generation != self.generation:
+                return
+            for row in rows:
+                self.tree.insert("", "end", values=["" if value is None else value for value in row])
+            self.shown += len(rows)
+            seconds = time.perf_counter() - self.started
+            more = len(rows) == BATCH_ROWS
+            if more and self.shown < MAX_ROWS:
+                self.executor.submit(self.next_batch, callback=self.add_rows(generation),
+                                     errback=self.show_db_error, tag="report")
+                text = f"{self.report.title}: {self.shown} строк..."
+            elif more:
+                text = f"{self.report.title}: показаны первые {self.shown} строк, полностью - в файле"
+            else:
+                text = f"{self.report.title}: {self.shown} строк за {seconds:.2f} с"
+            self.status_label.config(text=text)
+        return apply
+
+    def save(self, fmt):
+        if self.report is None:
+            self.build_report()
+            if self.report is None:
+                return
+        path = filedialog.asksaveasfilename(defaultextension="." + fmt, filetypes=[(fmt.upper(), "*." + fmt)])
+        if not path:
+            return
+        report = self.report
+        reads = snapshot.get_snapshot()
+        self.executor.submit(lambda: reports.write(reads.connection(), report, path, fmt,
+                                                   files=shards.snapshot_connections(reads)),
+                             callback=lambda count: self.status_label.config(
+                                 text=f"{report.title}: {count} строк сохранено в {path}"),
+                             errback=self.show_db_error)
+
+    def show_db_error(self, error):
+        messagebox.showerror("Ошибка базы данных", str(error))
+
+
+# Блок запуска
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.title("Отчёты")
+    diagnostics_form.install(root)
+    form = ReportForm(root)
+    form.pack(fill="both", expand=True, padx=10, pady=10)
+    root.mainloop()
@@ -1,19 +1,32 @@
 import tkinter as tk
 from tkinter import messagebox
-import sqlite3
+import os
+import sys
 
-DB_PATH = "../db/library.db"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import search
+from db.executor import QueryExecutor
+from db.record_source import RecordSource
+from form.live_search import LiveSearch
+from form import diagnostics_form
+from form.record_grid import RecordGrid
+
+THEME_GRID_COLUMNS = (
+    ("name", "Наименование", 300),
+)
 
 class ThemesForm(tk.Frame):
     def __init__(self, master):
         super().__init__(master)
-        self.conn = sqlite3.connect(DB_PATH)
-        self.cursor = self.conn.cursor()
-
-        self.themes = []
-        self.index = 0
+        self.themes = RecordSource("themes", ("theme_id", "name"), ("name", "theme_id"))
+        # Тематик мало: поиск по подстроке через LIKE с первой буквы
+        self.theme_search = search.CachedSearch(self.themes, "themes", ("name",), "name LIKE ? ESCAPE '\\'",
+                                                param=search.like_pattern, fold=search.fold_like)
         self.current_id = None
 
+        self.grid_visible = False
+        self.executor = QueryExecutor(self, on_busy=self.set_busy)
         self.create_widgets()
         self.load_themes()
         self.show_record()
@@ -29,6 +42,7 @@ class ThemesForm(tk.Frame):
         tk.Button(nav_frame, text="<", command=self.prev_record).pack(side="left")
         tk.Button(nav_frame, text=">", command=self.next_record).pack(side="left")
         tk.Button(nav_frame, text=">>", command=self.last_record).pack(side="left")
+        tk.Button(nav_frame, text="Таблица", command=self.toggle_grid).pack(side="left", padx=10)
 
         btn_frame = tk.Frame(self)
         btn_frame.grid(row=2, column=0, columnspan=4, pady=10)
@@ -41,25 +55,61 @@ class ThemesForm(tk.Frame):
         tk.Label(search_frame, text="Поиск по наименованию:").pack(side="left")
         self.search_name = tk.Entry(search_frame, width=20)
         self.search_name.pack(side="left", padx=5)
-        tk.Button(search_frame, text="Найти", command=self.search).pack(side="left")
-        tk.Button(search_frame, text="Сбросить фильтр", command=self.load_themes).pack(side="left", padx=10)
+        self.live_search = LiveSearch(self.search_name, self.search)
+        tk.Button(search_frame, text="Найти", command=self.live_search.submit).pack(side="left")
+        tk.Button(search_frame, text="Сбросить фильтр", command=self.reset_filter).pack(side="left", padx=10)
+
+        self.status_label = tk.Label(self, text="", fg="gray")
+        self.status_label.grid(row=4, column=0, columnspan=4, sticky="w")
+
+        self.grid_view = RecordGrid(self, self.executor, THEME_GRID_COLUMNS, self.grid_selected)
+        self.grid_view.grid(row=5, column=0, columnspan=4, sticky="nsew", pady=5)
+        self.grid_view.grid_remove()
+
+    def toggle_grid(self):
+        self.grid_visible = not self.grid_visible
+        if self.grid_visible:
+            self.grid_view.grid()
+            self.grid_view.show_source(self.themes)
+        else:
+            self.grid_view.grid_remove()
 
-    def load_themes(self, where_clause="", params=()):
-        query = "SELECT theme_id, name FROM themes"
-        if where_clause:
-            query += " WHERE " + where_clause
-        query += " ORDER BY name"
-        self.cursor.execute(query, params)
-        self.themes = self.cursor.fetchall()
-        self.index = 0
+    def grid_selected(self, row):
+        # Строка, выбранная в таблице, становится текущей записью формы
+        self.executor.submit(self.themes.seek, row, callback=self.moved, errback=self.show_error)
+
+    def set_busy(self, busy):
+        self.status_label.config(text="Выполняется запрос..." if busy else "")
+        self.config(cursor="watch" if busy else "")
+
+    def show_error(self, error):
+        messagebox.showerror("Ошибка", str(error))
+
+    def show_db_error(self, error):
+        messagebox.showerror("Ошибка базы данных", str(error))
+
+    def open_source(self, source, where_clause="", params=()):
+        # Первая страница читается в фоне; новый поиск отменяет незавершённый
+        self.executor.submit(source.reset, where_clause, params,
+                             callback=lambda _: self.opened(source), errback=self.show_error, tag="load")
+
+    def opened(self, source):
+        self.themes = source
         self.show_record()
+        if self.grid_visible:
+            self.grid_view.show_source(source)
+
+    def load_themes(self, where_clause="", params=()):
+        self.open_source(self.themes, where_clause, params)
 
     def show_record(self):
-        if not self.themes:
+        record = self.themes.current()
+        if self.grid_visible:
+            self.grid_view.select_record(record)
+        if record is None:
             self.clear_entries()
             self.current_id = None
             return
-        record = self.themes[self.index]
         self.current_id = record[0]
         self.entry_name.delete(0, tk.END)
         self.entry_name.insert(0, record[1])
@@ -67,25 +117,25 @@ class ThemesForm(tk.Frame):
     def clear_entries(self):
         self.entry_name.delete(0, tk.END)
 
-    def first_record(self):
-        if self.themes:
-            self.index = 0
+    def navigate(self, move):
+        # Переход на границе страницы читает следующую страницу из БД
+        self.executor.submit(move, callback=self.moved, errback=self.show_error)
+
+    def moved(self, moved):
+        if moved:
             self.show_record()
 
+    def first_record(self):
+        self.navigate(self.themes.first)
+
     def last_record(self):
-        if self.themes:
-            self.index = len(self.themes) - 1
-            self.show_record()
+        self.navigate(self.themes.last)
 
     def next_record(self):
-        if self.themes and self.index < len(self.themes) - 1:
-            self.index += 1
-            self.show_record()
+        self.navigate(self.themes.next)
 
     def prev_record(self):
-        if self.themes and self.index > 0:
-            self.index -= 1
-            self.show_record()
+        self.navigate(self.themes.prev)
 
     def add_record(self):
         self.clear_entries()
@@ -98,20 +148,23 @@ class ThemesForm(tk.Frame):
             messagebox.showerror("Ошибка", "Наименование тематики не может быть пустым.")
             return
 
-        try:
-            if self.current_id is None:
-                self.cursor.execute(
-                    "INSERT INTO themes (name) VALUES (?)",
-                    (name,))
-            else:
-                self.cursor.execute(
-                    "UPDATE themes SET name=? WHERE theme_id=?",
-                    (name, self.current_id))
-            self.conn.commit()
-            self.load_themes()
-            messagebox.showinfo("Успех", "Данные сохранены.")
-        except sqlite3.IntegrityError as e:
-            messagebox.showerror("Ошибка базы данных", str(e))
+        self.executor.submit_write(self.write_theme, self.current_id, (name,),
+                                   callback=self.saved, errback=self.show_db_error)
+
+    def write_theme(self, conn, current_id, values):
+        # Выражения без commit: транзакция - QueryExecutor.submit_write
+        if current_id is None:
+            conn.execute(
+                "INSERT INTO themes (name) VALUES (?)",
+                values)
+        else:
+            conn.execute(
+                "UPDATE themes SET name=? WHERE theme_id=?",
+                values + (current_id,))
+
+    def saved(self, _):
+        self.load_themes()
+        messagebox.showinfo("Успех", "Данные сохранены.")
 
     def delete_record(self):
         if self.current_id is None:
@@ -119,22 +172,32 @@ class ThemesForm(tk.Frame):
             return
 
         if messagebox.askyesno("Подтверждение", "Удалить текущую запись?"):
-            self.cursor.execute("DELETE FROM themes WHERE theme_id=?", (self.current_id,))
-            self.conn.commit()
-            self.load_themes()
+            # IntegrityError - запись используется в других таблицах (foreign_keys = ON)
+            self.executor.submit_write(self.remove_theme, self.current_id,
+                                       callback=self.deleted, errback=self.show_db_error)
 
-    def search(self):
-        name = self.search_name.get().strip()
+    def remove_theme(self, conn, current_id):
+        conn.execute("DELETE FROM themes WHERE theme_id=?", (current_id,))
+
+    def deleted(self, _):
+        self.load_themes()
+
+    def search(self, name, explicit=False):
+        # Вызывается LiveSearch по мере ввода
         if name:
-            where = "name LIKE ?"
-            param = ('%' + name + '%',)
-            self.load_themes(where, param)
+            self.executor.submit(self.theme_search.run, name,
+                                 callback=self.opened, errback=self.show_error, tag="load")
         else:
             self.load_themes()
 
+    def reset_filter(self):
+        self.live_search.clear()
+        self.load_themes()
+
 if __name__ == "__main__":
     root = tk.Tk()
     root.title("Тематики")
+    diagnostics_form.install(root)
     form = ThemesForm(root)
     form.pack(padx=10, pady=10)
     root.mainloop()
@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from bench import datagen
+from db import connection
+
+
+class DatabaseTestCase(unittest.TestCase):
+    # База bench.datagen на весь класс (BOOKS книг) во временном каталоге;
+    # тест, который меняет базу так, что это заметят соседние, берёт copy()
+    BOOKS = 200
+
+    @classmethod
+    def setUpClass(cls):
+        connection.PROFILING = False
+        cls.temp_dir = tempfile.TemporaryDirectory(prefix=cls.__name__.lower() + "_")
+        cls.db_path = cls.temp_path("library.db")
+        datagen.generate(cls.db_path, cls.BOOKS, log=lambda _: None)
+
+    @classmethod
+    def tearDownClass(cls):
+        connection.close_connection(cls.db_path)
+        cls.temp_dir.cleanup()
+
+    @classmethod
+    def temp_path(cls, name):
+        return os.path.join(cls.temp_dir.name, name)
+
+    @classmethod
+    def copy(cls, name, source=None):
+        # Копия базы класса (backup: вместе со страницами из WAL)
+        path = cls.temp_path(name)
+        src, dst = sqlite3.connect(source or cls.db_path), sqlite3.connect(path)
+        try:
+            src.backup(dst)
+        finally:
+            src.close()
+            dst.close()
+        return path
@@ -0,0 +1,124 @@
+import asyncio
+import unittest
+
+from db.api import ApiServer, LibraryApi, encode_cursor
+from tests.base import DatabaseTestCase
+
+
+class CursorTest(DatabaseTestCase):
+    # Курсор страницы /books: не список или список не той длины - 400, а не обрыв соединения
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.api = LibraryApi(cls.db_path, readers=1)
+        cls.server = ApiServer(cls.api)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.api.close()
+        super().tearDownClass()
+
+    def get(self, target):
+        status, result, _ = asyncio.run(self.server.dispatch("GET", target, {}, b""))
+        return status, result
+
+    def test_valid_cursor(self):
+        status, first = self.get("/books?limit=5")
+        self.assertEqual(status, 200)
+        status, second = self.get(f"/books?limit=5&after={first['next']}")
+        self.assertEqual(status, 200)
+        self.assertEqual(len(second["items"]), 5)
+        self.assertNotEqual(first["items"][0], second["items"][0])
+
+    def test_not_list_cursor(self):
+        # base64 от JSON 5
+        status, result = self.get("/books?after=NQ==")
+        self.assertEqual(status, 400)
+        self.assertIn("курсор", result["error"])
+
+    def test_wrong_length_cursor(self):
+        status, result = self.get("/books?after=" + encode_cursor(["Книга", 1]))
+        self.assertEqual(status, 400)
+        self.assertIn("курсор", result["error"])
+
+    def test_unbindable_cursor(self):
+        # Список и объект - не значения параметров SQLite: 400, а не 500 при связывании
+        status, result = self.get("/books?after=" + encode_cursor([[1], {}, 1]))
+        self.assertEqual(status, 400)
+        self.assertIn("курсор", result["error"])
+
+    def test_handler_error(self):
+        # Необработанное исключение обработчика - ответ 500
+        def broken(query):
+            raise TypeError("сбой")
+        self.api.library_stats, saved = broken, self.api.library_stats
+        try:
+            status, result = self.get("/stats/libraries")
+        finally:
+            self.api.library_stats = saved
+        self.assertEqual(status, 500)
+        self.assertIn("сбой", result["error"])
+
+
+class _Writer:
+    # Запись ответа handle() в буфер вместо сокета
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class RequestTest(DatabaseTestCase):
+    # Разбор запроса в ApiServer.handle: ошибка в строке запроса или в заголовках - 400 и закрытие
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.api = LibraryApi(cls.db_path, readers=1)
+        cls.server = ApiServer(cls.api)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.api.close()
+        super().tearDownClass()
+
+    def handle(self, request):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(request)
+            reader.feed_eof()
+            writer = _Writer()
+            await self.server.handle(reader, writer)
+            return writer
+        writer = asyncio.run(run())
+        self.assertTrue(writer.closed)
+        return writer.data.decode("utf-8")
+
+    def test_valid_request(self):
+        response = self.handle(b"GET /stats/libraries HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertTrue(response.startswith("HTTP/1.1 200 "))
+
+    def test_malformed_request_line(self):
+        response = self.handle(b"GARBAGE\r\n\r\n")
+        self.assertTrue(response.startswith("HTTP/1.1 400 "))
+        self.assertIn("Connection: close", response)
+
+    def test_bad_content_length(self):
+        for length in (b"abc", b"-5"):
+            response = self.handle(b"POST /loans HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n{}")
+            self.assertTrue(response.startswith("HTTP/1.1 400 "), response)
+            self.assertIn("Content-Length", response)
+            self.assertIn("Connection: close", response)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from db import batch, connection
+from db.connection import immediate
+from tests.base import DatabaseTestCase
+
+
+class BatchTest(DatabaseTestCase):
+    # Пакетные операции и их отмена: после undo книги, остатки и выдачи - как до пакета
+
+    def setUp(self):
+        self.conn = connection.connect(self.copy(f"{self._testMethodName}.db"))
+        # Книги с выдачами - и открытыми, и закрытыми, - и одна без выдач
+        self.keys = [tuple(key) for key in self.conn.execute("""
+            SELECT library_id, book_id FROM books b
+            WHERE EXISTS (SELECT 1 FROM subscriptions s
+                          WHERE s.library_id = b.library_id AND s.book_id = b.book_id)
+            ORDER BY library_id, book_id LIMIT 5
+        """)]
+        self.keys.append(tuple(self.conn.execute("""
+            SELECT library_id, book_id FROM books b
+            WHERE NOT EXISTS (SELECT 1 FROM subscriptions s
+                              WHERE s.library_id = b.library_id AND s.book_id = b.book_id)
+            LIMIT 1
+        """).fetchone()))
+
+    def tearDown(self):
+        self.conn.close()
+
+    def state(self):
+        books = {key: self.conn.execute(
+            f"SELECT {', '.join(batch.BOOK_FIELDS)} FROM books WHERE library_id = ? AND book_id = ?",
+            key).fetchone() for key in self.keys}
+        loans = {key: self.conn.execute(
+            f"SELECT {', '.join(batch.LOAN_FIELDS)} FROM subscriptions WHERE library_id = ? AND book_id = ?"
+            " ORDER BY reader_id, issue_date", key).fetchall() for key in self.keys}
+        return books, loans
+
+    def run_batch(self, func, *args):
+        with immediate(self.conn):
+            return func(self.conn, *args)
+
+    def test_delete_undo(self):
+        before = self.state()
+        self.assertTrue(any(loan[4] is None for loans in before[1].values() for loan in loans))
+        self.assertTrue(any(loan[4] is not None for loans in before[1].values() for loan in loans))
+        deleted, last = self.run_batch(batch.delete_books, self.keys)
+        self.assertEqual(deleted, self.keys)
+        self.assertEqual(self.state(), ({key: None for key in self.keys}, {key: [] for key in self.keys}))
+        rows = self.run_batch(batch.undo, last)
+        self.assertEqual(len(rows), len(self.keys))
+        # Остаток не уменьшен повторно восстановленными выдачами
+        self.assertEqual(self.state(), before)
+
+    def test_theme_undo(self):
+        before = self.state()
+        theme_id = self.conn.execute("SELECT MAX(theme_id) FROM themes").fetchone()[0]
+        rows, last = self.run_batch(batch.set_theme, self.keys, theme_id)
+        self.assertEqual({row[2] for row in rows}, {theme_id})
+        self.run_batch(batch.undo, last)
+        self.assertEqual(self.state(), before)
+
+    def test_quantity_undo(self):
+        before = self.state()
+        rows, last = self.run_batch(batch.set_quantity, self.keys, None, 3)
+        self.assertEqual([row[8] for row in rows], [before[0][key][8] + 3 for key in self.keys])
+        self.run_batch(batch.undo, last)
+        self.assertEqual(self.state(), before)
+
+    def test_rejected_batch_rolls_back(self):
+        # Отрицательный остаток у одной книги - не меняется ни одна
+        self.conn.execute("UPDATE books SET quantity = 0 WHERE library_id = ? AND book_id = ?", self.keys[-1])
+        self.conn.commit()
+        before = self.state()
+        with self.assertRaises(Exception):
+            self.run_batch(batch.set_quantity, self.keys, None, -1)
+        self.assertEqual(self.state(), before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from books_form import BooksForm
+from db import connection
+from db.connection import immediate
+from tests.base import DatabaseTestCase
+
+
+class StoreBookTest(DatabaseTestCase):
+    # Запись книги формы: новая книга с кодом, введённым вручную, и изменение
+    BOOKS = 100
+
+    def setUp(self):
+        self.conn = connection.connect(self.db_path)
+        self.library_id, self.book_id = self.conn.execute(
+            "SELECT library_id, book_id FROM books ORDER BY library_id, book_id LIMIT 1").fetchone()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def values(self, book_id, title="Новая книга"):
+        return (None, "Автор", title, None, None, 2001, 1, self.library_id, book_id)
+
+    def store(self, values, is_new):
+        with immediate(self.conn):
+            return BooksForm.store_book(self.conn, values, is_new)
+
+    def title(self, book_id):
+        row = self.conn.execute("SELECT title FROM books WHERE library_id=? AND book_id=?",
+                                (self.library_id, book_id)).fetchone()
+        return row and row[0]
+
+    def test_new_book_with_taken_id(self):
+        before = self.title(self.book_id)
+        with self.assertRaisesRegex(ValueError, "уже занят"):
+            self.store(self.values(self.book_id), True)
+        self.assertEqual(self.title(self.book_id), before)
+
+    def test_new_book_with_free_id(self):
+        free_id = self.conn.execute("SELECT MAX(book_id) + 1000 FROM books WHERE library_id=?",
+                                    (self.library_id,)).fetchone()[0]
+        self.assertEqual(self.store(self.values(free_id), True), free_id)
+        self.assertEqual(self.title(free_id), "Новая книга")
+
+    def test_new_book_with_allocated_id(self):
+        book_id = self.store(self.values(None), True)
+        self.assertEqual(self.title(book_id), "Новая книга")
+
+    def test_update_existing_book(self):
+        self.assertEqual(self.store(self.values(self.book_id, "Изменённая"), False), self.book_id)
+        self.assertEqual(self.title(self.book_id), "Изменённая")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import datetime
+import unittest
+
+from db import circulation, connection
+from tests.base import DatabaseTestCase
+
+
+class CirculationTest(DatabaseTestCase):
+    # Выдача, возврат и продление: остаток книги, записи subscriptions, залог
+
+    def setUp(self):
+        self.conn = connection.connect(self.copy(f"{self._testMethodName}.db"))
+        self.library_id, self.book_id = self.conn.execute(
+            "SELECT library_id, book_id FROM books ORDER BY library_id, book_id LIMIT 1").fetchone()
+        with self.conn:
+            # Новый читатель: в сгенерированной базе у читателей уже есть выдачи
+            self.reader_id = self.conn.execute(
+                "INSERT INTO readers (full_name, address) VALUES ('Тестов Т.Т.', '')").lastrowid
+            self.conn.execute("UPDATE books SET quantity = 2 WHERE library_id = ? AND book_id = ?",
+                              (self.library_id, self.book_id))
+
+    def tearDown(self):
+        self.conn.close()
+
+    def quantity(self):
+        return self.conn.execute("SELECT quantity FROM books WHERE library_id = ? AND book_id = ?",
+                                 (self.library_id, self.book_id)).fetchone()[0]
+
+    def loans(self):
+        # Выдачи книги читателю по порядку: (issue_date, return_date, advance)
+        return self.conn.execute("""
+            SELECT issue_date, return_date, advance FROM subscriptions
+            WHERE library_id = ? AND book_id = ? AND reader_id = ?
+            ORDER BY issue_date
+        """, (self.library_id, self.book_id, self.reader_id)).fetchall()
+
+    def issue(self, advance=0, issue_date=None):
+        return circulation.issue(self.conn, self.library_id, self.book_id, self.reader_id, advance, issue_date)
+
+    def test_issue_and_return(self):
+        issue_date = self.issue(150)
+        self.assertEqual(self.quantity(), 1)
+        self.assertIn((self.library_id, self.book_id, issue_date, 150),
+                      circulation.open_loans(self.conn, self.reader_id))
+        self.assertEqual(circulation.return_book(self.conn, self.library_id, self.book_id, self.reader_id),
+                         issue_date)
+        self.assertEqual(self.quantity(), 2)
+        self.assertIsNotNone(self.loans()[-1][1])
+
+    def test_issue_without_stock(self):
+        self.issue(issue_date="2024-01-10T10:00:00.000")
+        self.issue(issue_date="2024-01-11T10:00:00.000")
+        self.assertEqual(self.quantity(), 0)
+        with self.assertRaisesRegex(circulation.CirculationError, "Нет свободных"):
+            self.issue()
+        with self.assertRaisesRegex(circulation.CirculationError, "не найдена"):
+            circulation.issue(self.conn, self.library_id, -1, self.reader_id)
+        self.assertEqual(len(self.loans()), 2)
+
+    def test_return_without_loan(self):
+        with self.assertRaisesRegex(circulation.CirculationError, "нет книги"):
+            circulation.return_book(self.conn, self.library_id, self.book_id, self.reader_id)
+        self.assertEqual(self.quantity(), 2)
+
+    def test_renew_keeps_advance(self):
+        issue_date = self.issue(200, "2024-01-10T10:00:00.000")
+        renew_date = circulation.renew(self.conn, self.library_id, self.book_id, self.reader_id,
+                                       "2024-02-01T10:00:00.000")
+        self.assertEqual(self.loans(), [(issue_date, renew_date, 200), (renew_date, None, 200)])
+        self.assertEqual(self.quantity(), 1)
+
+    def test_return_many(self):
+        self.issue(issue_date="2024-01-10T10:00:00.000")
+        self.issue(issue_date="2024-01-11T10:00:00.000")
+        loans = [(self.library_id, self.book_id, self.reader_id)] * 3 + [(self.library_id, -1, self.reader_id)]
+        # Две открытые выдачи закрываются, третья строка пакета и несуществующая книга - пропускаются
+        self.assertEqual(circulation.return_many(self.conn, loans, "2024-02-01T10:00:00.000"), 2)
+        self.assertEqual([loan[1] for loan in self.loans()], ["2024-02-01T10:00:00.000"] * 2)
+        self.assertEqual(self.quantity(), 2)
+
+    def test_overdue_loans(self):
+        today = datetime.date(2030, 1, 1)
+        old = (today - datetime.timedelta(days=circulation.LOAN_DAYS + 1)).isoformat() + "T10:00:00.000"
+        recent = (today - datetime.timedelta(days=1)).isoformat() + "T10:00:00.000"
+        self.issue(issue_date=old)
+        self.issue(issue_date=recent)
+        overdue = circulation.overdue_loans(self.conn, today)
+        self.assertIn((self.library_id, self.book_id, self.reader_id, old), overdue)
+        self.assertNotIn((self.library_id, self.book_id, self.reader_id, recent), overdue)
+        self.assertEqual([row[3] for row in overdue], sorted(row[3] for row in overdue))
+        self.assertEqual(circulation.overdue_loans(self.conn, today, limit=1), overdue[:1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from array import array
+
+from db import dedup
+
+
+class PairsTest(unittest.TestCase):
+    # Пары кандидатов в блоке полосы: большой блок делится по другим полосам
+
+    SIZE = dedup.MAX_BUCKET + 10
+
+    def test_small_bucket_all_pairs(self):
+        run = list(range(dedup.MAX_BUCKET))
+        self.assertEqual(len(set(dedup._pairs(run, []))), len(run) * (len(run) - 1) // 2)
+
+    def test_large_bucket_split_on_next_key(self):
+        # Первая и последняя записи совпадают и в следующей полосе - пара
+        # проверяется, как бы далеко друг от друга они ни стояли
+        key = array("q", range(self.SIZE))
+        key[-1] = key[0]
+        pairs = set(dedup._pairs(list(range(self.SIZE)), [key]))
+        self.assertEqual(pairs, {(0, self.SIZE - 1)})
+
+    def test_large_bucket_same_signature(self):
+        # Совпадение во всех полосах: каждая запись - в паре с первой
+        keys = [array("q", [7] * self.SIZE) for _ in range(2)]
+        pairs = sorted(dedup._pairs(list(range(self.SIZE)), keys))
+        self.assertEqual(pairs, [(0, i) for i in range(1, self.SIZE)])
+
+
+class FindDuplicatesTest(unittest.TestCase):
+
+    def test_large_group(self):
+        # Больше MAX_BUCKET изданий одной книги (разные издательства): одна группа
+        size = dedup.MAX_BUCKET * 2
+        records = [((1, n), 1, dedup.book_fields("Толстой Л. Н.", "Анна Каренина", f"Издательство {n}"),
+                    f"exact {n}", "") for n in range(size)]
+        records.append(((1, size), 1, dedup.book_fields("Пушкин А. С.", "Евгений Онегин", ""), "other", ""))
+        clusters = dedup.find_duplicates(records, dedup.BOOK_WEIGHTS)
+        self.assertEqual([sorted(ref for ref, _, _ in cluster) for cluster in clusters],
+                         [[(1, n) for n in range(size)]])
+
+    def test_libraries_kept_apart(self):
+        records = [((library, 1), library, dedup.book_fields("Толстой Л. Н.", "Анна Каренина", ""),
+                    f"exact {library}", "") for library in (1, 2)]
+        self.assertEqual(dedup.find_duplicates(records, dedup.BOOK_WEIGHTS), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
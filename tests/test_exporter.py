@@ -0,0 +1,49 @@
+import csv
+import unittest
+
+from db import connection, exporter
+from tests.base import DatabaseTestCase
+
+
+class FilterTest(DatabaseTestCase):
+    # Фильтры выгрузки по подстроке: % и _ пользователя - обычные символы
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        conn = connection.connect(cls.db_path)
+        library_id = conn.execute("SELECT MIN(library_id) FROM libraries").fetchone()[0]
+        with conn:
+            conn.executemany("INSERT INTO books (library_id, book_id, author, title) VALUES (?, ?, 'Автор', ?)",
+                             [(library_id, 900001, "Скидка 50% навсегда"), (library_id, 900002, "Скидка 500 навсегда")])
+            conn.executemany("INSERT INTO readers (full_name, address) VALUES (?, '')",
+                             [("Петров_Пётр",), ("ПетровXПётр",)])
+        conn.close()
+
+    def setUp(self):
+        self.conn = connection.connect(self.db_path)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def export(self, table, **filters):
+        path = self.temp_path(f"{self._testMethodName}.csv")
+        count = exporter.export_table(self.conn, table, path, **filters)
+        with open(path, encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), count)
+        return rows
+
+    def test_percent_in_title(self):
+        self.assertEqual([row["title"] for row in self.export("books", title="50%")], ["Скидка 50% навсегда"])
+
+    def test_underscore_in_full_name(self):
+        self.assertEqual([row["full_name"] for row in self.export("readers", full_name="в_П")], ["Петров_Пётр"])
+
+    def test_plain_substring(self):
+        titles = {row["title"] for row in self.export("books", title="Скидка 50")}
+        self.assertEqual(titles, {"Скидка 50% навсегда", "Скидка 500 навсегда"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+
+from db import connection, importer
+from tests.base import DatabaseTestCase
+
+MRK = """=LDR  00000nam  2200000 i 4500
+=100  1\\$aТолстой, Л. Н.,
+=245  10$aВойна и мир :$bроман /
+=260  \\\\$aМосква :$bЭксмо,$cc2015.
+=650  \\7$aРоман
+=650  \\7$aИстория
+=852  \\\\$aЦентральная$p77$t3
+
+=245  10$aБез автора.
+=852  \\\\$aЦентральная
+"""
+
+CSV = """library, title ,author,publisher,publish_year,quantity,
+Центральная,  Анна Каренина ,Толстой Л. Н.,,1878,,лишнее
+"""
+
+
+class ReaderTest(DatabaseTestCase):
+    # Разбор входных файлов: записи - словари полей books
+
+    BOOKS = 0
+
+    def write(self, name, text):
+        path = self.temp_path(name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_read_csv(self):
+        rows = list(importer.read_csv(self.write("books.csv", CSV)))
+        # Пробелы вокруг заголовков и значений убираются, столбцы без заголовка - тоже
+        self.assertEqual(rows, [{"library": "Центральная", "title": "Анна Каренина", "author": "Толстой Л. Н.",
+                                 "publisher": "", "publish_year": "1878", "quantity": ""}])
+
+    def test_read_mrk(self):
+        first, second = importer.read_rows(self.write("books.mrk", MRK), "mrk")
+        self.assertEqual(first, {
+            "author": "Толстой, Л. Н.", "title": "Война и мир: роман", "publish_place": "Москва",
+            "publisher": "Эксмо", "publish_year": "2015", "theme": "Роман",
+            "library": "Центральная", "book_id": "77", "quantity": "3"})
+        # Запись без 100/260: только то, что в ней есть; кода и количества нет
+        self.assertEqual(second, {"title": "Без автора", "library": "Центральная", "book_id": None, "quantity": None})
+
+
+class ImportBooksTest(DatabaseTestCase):
+    # Загрузка books: справочники, коды книг, пересборка индексов
+
+    BOOKS = 300
+
+    def setUp(self):
+        self.conn = connection.connect(self.copy(f"{self._testMethodName}.db"))
+
+    def tearDown(self):
+        self.conn.close()
+
+    def schema(self):
+        return set(self.conn.execute(
+            "SELECT type, name FROM sqlite_master WHERE tbl_name = 'books' AND type IN ('index', 'trigger')"))
+
+    def rows(self, count, library="Новая библиотека"):
+        return [{"library": library, "title": f"Импорт {n}", "author": "Автор", "theme": "Новая тематика",
+                 "publisher": "Новое издательство", "publish_year": "2001", "quantity": "2"}
+                for n in range(count)]
+
+    def test_new_references_and_ids(self):
+        stats = importer.import_books(self.conn, self.rows(5), batch_size=2)
+        self.assertEqual(stats.rows, 5)
+        library_id = self.conn.execute("SELECT library_id FROM libraries WHERE name = 'Новая библиотека'").fetchone()[0]
+        self.assertEqual([row[0] for row in self.conn.execute(
+            "SELECT book_id FROM books WHERE library_id = ? ORDER BY book_id", (library_id,))], [1, 2, 3, 4, 5])
+        # Следующий код - за зарезервированным блоком
+        self.assertEqual(self.conn.execute("SELECT next_id FROM book_id_sequences WHERE library_id = ?",
+                                           (library_id,)).fetchone()[0], 1 + importer.BOOK_ID_BLOCK)
+
+    def test_failed_batch_rolls_back_references(self):
+        # Ошибка в пачке откатывает и добавленные ею справочники, и резерв кодов
+        rows = self.rows(2)
+        rows[1]["title"] = None
+        libraries = self.conn.execute("SELECT COUNT(*) FROM libraries").fetchone()[0]
+        with self.assertRaises(Exception):
+            importer.import_books(self.conn, rows)
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM libraries").fetchone()[0], libraries)
+        self.assertIsNone(self.conn.execute("SELECT 1 FROM themes WHERE name = 'Новая тематика'").fetchone())
+        self.assertIsNone(self.conn.execute("SELECT 1 FROM book_id_sequences WHERE library_id > ?",
+                                            (libraries,)).fetchone())
+
+    def test_rebuild_indexes(self):
+        schema = self.schema()
+        during = []
+        library = self.conn.execute("SELECT name FROM libraries ORDER BY library_id LIMIT 1").fetchone()[0]
+
+        def rows():
+            # Схема books во время загрузки: удалённое не видно, нужное поиску дублей - на месте
+            during.append(self.schema())
+            yield from self.rows(3, library)
+        importer.import_books(self.conn, rows(), rebuild_indexes=True)
+        self.assertLess(during[0], schema)
+        for name in importer.KEPT_BOOKS_INDEXES:
+            self.assertIn(("index", name), during[0])
+        self.assertFalse(any(name.startswith(("books_fts_", "books_stats_")) for _, name in during[0]))
+        # После загрузки - всё снова на месте, поиск и сводки учитывают новые книги
+        self.assertEqual(self.schema(), schema)
+        self.assertEqual(self.conn.execute(
+            "SELECT COUNT(*) FROM books_fts WHERE books_fts MATCH 'Импорт'").fetchone()[0], 3)
+        self.assertEqual(self.conn.execute("SELECT SUM(titles) FROM library_stats").fetchone()[0],
+                         self.conn.execute("SELECT COUNT(*) FROM books").fetchone()[0])
+
+    def test_rebuild_indexes_restored_after_error(self):
+        schema = self.schema()
+        rows = self.rows(2)
+        rows[1]["title"] = None
+        with self.assertRaises(Exception):
+            importer.import_books(self.conn, rows, rebuild_indexes=True)
+        self.assertEqual(self.schema(), schema)
+
+
+if __name__ == "__main__":
+    unittest.main()
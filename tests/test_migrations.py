@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+
+from bench import publishers
+from db import connection, migrations
+from tests.base import DatabaseTestCase
+
+
+class PublisherMigrationTest(DatabaseTestCase):
+    # Миграции 1 и 3 на базе старой схемы: издательство - текст в books
+    BOOKS = 300
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        conn = connection.connect(cls.db_path)
+        publishers.denormalize(conn)
+        # Как до миграции 3: лишние пробелы в тексте и в полнотекстовом индексе
+        with conn:
+            conn.execute("UPDATE books SET publisher = ' ' || publisher || ' ' WHERE book_id % 3 = 0")
+            conn.execute("""
+                UPDATE books_fts SET publisher = (
+                    SELECT b.publisher FROM books b
+                    WHERE b.library_id = books_fts.library_id AND b.book_id = books_fts.book_id)
+            """)
+        conn.close()
+
+    def setUp(self):
+        self.path = self.copy(f"{self._testMethodName}.db")
+        self.conn = connection.connect(self.path)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def books_sql(self):
+        return self.conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'books'").fetchone()[0]
+
+    def test_migration_1_keeps_publisher_text(self):
+        # Версия 0: CHECK с strftime('now'), которую исправляет миграция 1
+        self.conn.execute("PRAGMA writable_schema = ON")
+        self.conn.execute("""
+            UPDATE sqlite_master SET sql = replace(sql, 'publish_year <= 2100', 'publish_year <= strftime(''%Y'', ''now'')')
+            WHERE type = 'table' AND name = 'books'
+        """)
+        self.conn.execute("PRAGMA writable_schema = OFF")
+        self.conn.execute("PRAGMA user_version = 0")
+        self.conn.commit()
+        self.conn.close()
+        self.conn = connection.connect(self.path)
+        self.assertIn("publish_year <= strftime", self.books_sql())
+
+        migrations.migrate(self.conn, target=1, log=lambda _: None)
+        self.assertEqual(self.conn.execute("PRAGMA user_version").fetchone()[0], 1)
+        self.assertIn("publish_year <= 2100", self.books_sql())
+        columns = migrations._columns(self.conn, "books")
+        self.assertIn("publisher", columns)
+        self.assertNotIn("publisher_id", columns)
+
+    def test_migration_3_rebuilds_search_index(self):
+        migrations.migrate(self.conn, log=lambda _: None)
+        self.assertEqual(self.conn.execute("PRAGMA user_version").fetchone()[0], 3)
+        stale = self.conn.execute("""
+            SELECT COUNT(*) FROM books_fts f
+            JOIN books b ON b.library_id = f.library_id AND b.book_id = f.book_id
+            LEFT JOIN publishers p ON p.publisher_id = b.publisher_id
+            WHERE f.publisher IS NOT p.name
+        """).fetchone()[0]
+        self.assertEqual(stale, 0)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM books_fts").fetchone()[0],
+                         self.conn.execute("SELECT COUNT(*) FROM books").fetchone()[0])
+
+
+
+class RebuildTableTest(unittest.TestCase):
+    # Порционная перестройка: изменения других соединений между порциями
+    # переносят временные триггеры
+
+    ROWS = 100
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory(prefix="rebuild_")
+        self.path = os.path.join(self.temp_dir.name, "rebuild.db")
+        self.conn = connection.connect(self.path)
+        with self.conn:
+            self.conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX idx_items_name ON items (name)")
+            self.conn.executemany("INSERT INTO items VALUES (?, ?)",
+                                  ((n, f"item {n}") for n in range(1, self.ROWS + 1)))
+        self.other = connection.connect(self.path)
+
+    def tearDown(self):
+        self.other.close()
+        self.conn.close()
+        self.temp_dir.cleanup()
+
+    def test_changes_during_copy(self):
+        calls = []
+
+        def log(message):
+            # После первой порции (строки 1..10 уже скопированы) пишет другое соединение
+            calls.append(message)
+            if len(calls) == 1:
+                with self.other:
+                    self.other.execute("UPDATE items SET name = 'renamed' WHERE id = 5")
+                    self.other.execute("DELETE FROM items WHERE id = 6")
+                    self.other.execute("UPDATE items SET name = 'later' WHERE id = 50")
+                    self.other.execute("DELETE FROM items WHERE id = 51")
+                    self.other.execute("INSERT INTO items VALUES (1000, 'new')")
+
+        migrations.rebuild_table(
+            self.conn, "items", "CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL, size INTEGER)",
+            ("id",), migrations.Step(7, 10, log), values={"size": "length({row}.name)"})
+        self.assertGreater(len(calls), 2)
+        rows = {key: (name, size) for key, name, size in self.conn.execute("SELECT id, name, size FROM items")}
+        expected = {n: (f"item {n}", len(f"item {n}")) for n in range(1, self.ROWS + 1) if n not in (6, 51)}
+        expected.update({5: ("renamed", 7), 50: ("later", 5), 1000: ("new", 3)})
+        self.assertEqual(rows, expected)
+        # Индекс создан заново, временных триггеров и копии нет, версия - шага
+        self.assertEqual(set(self.conn.execute("SELECT type, name FROM sqlite_master")),
+                         {("table", "items"), ("index", "idx_items_name")})
+        self.assertEqual(migrations.current_version(self.conn), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import threading
+import unittest
+
+from db import record_source
+from db.record_source import RecordSource
+from tests.base import DatabaseTestCase
+
+COLUMNS = ("library_id", "book_id", "title")
+KEY = ("title", "library_id", "book_id")
+
+
+class RecordSourceTest(DatabaseTestCase):
+    # Постраничное чтение по ключу; page_after не меняет отбор источника
+
+    def source(self):
+        return RecordSource("books", COLUMNS, KEY, page_size=5, db_path=self.db_path)
+
+    def test_pages_follow_key_order(self):
+        source = self.source()
+        source.reset("library_id = ?", (1,))
+        rows = []
+        while True:
+            rows.append(source.current())
+            if not source.next():
+                break
+        self.assertEqual(len(rows), source.count())
+        self.assertEqual(rows, sorted(rows, key=lambda row: (row[2], row[0], row[1])))
+        self.assertTrue(all(row[0] == 1 for row in rows))
+
+    def test_page_after_keeps_filter(self):
+        source = self.source()
+        source.reset("library_id = ?", (1,))
+        first = source.page_after("library_id = ?", (2,))
+        self.assertTrue(first and all(row[0] == 2 for row in first))
+        second = source.page_after("library_id = ?", (2,), [first[-1][2], first[-1][0], first[-1][1]])
+        self.assertTrue(second and all(row[0] == 2 for row in second))
+        self.assertEqual((source.where_clause, source.params), ("library_id = ?", (1,)))
+
+    def test_prefetch_uses_filter_at_submit(self):
+        # Фоновое чтение следующей страницы ждёт; тем временем - запрос page_after
+        # с другим отбором. Следующая страница - по отбору источника.
+        release = threading.Event()
+        record_source._prefetcher.submit(release.wait)
+        source = self.source()
+        try:
+            source.reset("library_id = ?", (1,))
+            source.page_after("library_id = ?", (2,))
+        finally:
+            release.set()
+        for _ in range(source.page_size):
+            self.assertTrue(source.next())
+        self.assertEqual(source.current()[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import datetime
+import unittest
+
+from db import connection, reports, shards
+from tests.base import DatabaseTestCase
+
+
+class ShardedReportsTest(DatabaseTestCase):
+    # Отчёт по файлам библиотек (после split) - те же строки, что по общей базе
+
+    BOOKS = 400
+    TODAY = datetime.date(2030, 1, 1)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        conn = connection.connect(cls.db_path)
+        first, second = [row[0] for row in conn.execute(
+            "SELECT library_id FROM libraries ORDER BY library_id LIMIT 2")]
+        with conn:
+            # Дубли: одна книга в двух библиотеках, читатель с двумя записями телефона
+            conn.executemany("INSERT INTO books (library_id, book_id, author, title, quantity) "
+                             "VALUES (?, 900001, ?, ?, 5)",
+                             [(first, "Толстой Л.Н.", "Анна Каренина"), (second, "толстой л. н.", "АННА КАРЕНИНА")])
+            reader_ids = [conn.execute("INSERT INTO readers (full_name, address, phone) VALUES (?, '', ?)",
+                                       row).lastrowid
+                          for row in (("Иванов Иван", "8 (900) 123-45-67"), ("Иванов И.", "+79001234567"))]
+            conn.executemany("INSERT INTO subscriptions (library_id, book_id, reader_id, issue_date) "
+                             "VALUES (?, 900001, ?, '2029-01-01 10:00:00')",
+                             [(first, reader_ids[0]), (second, reader_ids[0]), (second, reader_ids[1])])
+        conn.close()
+        cls.sharded_path = cls.copy("sharded.db")
+        shards.split(cls.sharded_path, log=lambda _: None)
+        cls.router = shards.ShardRouter(cls.sharded_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        for library_id in cls.router.library_ids():
+            connection.close_connection(shards.shard_path(cls.sharded_path, library_id))
+        connection.close_connection(cls.sharded_path)
+        super().tearDownClass()
+
+    def rows(self, report):
+        # (строки по общей базе, строки по файлам библиотек)
+        plain = [row for rows in reports.stream(connection.get_connection(self.db_path), report) for row in rows]
+        sharded = [row for rows in reports.stream(connection.get_connection(self.sharded_path), report,
+                                                  files=self.router.connections()) for row in rows]
+        return plain, sharded
+
+    def assertSameRows(self, report):
+        plain, sharded = self.rows(report)
+        self.assertTrue(plain)
+        self.assertEqual(sharded, plain)
+
+    def test_overdue(self):
+        self.assertSameRows(reports.overdue_report(self.TODAY))
+        library_id = self.router.library_ids()[0]
+        self.assertSameRows(reports.overdue_report(self.TODAY, library_id))
+
+    def test_history(self):
+        reader_id = connection.get_connection(self.db_path).execute(
+            "SELECT reader_id FROM subscriptions GROUP BY reader_id ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        self.assertSameRows(reports.history_report(reader_id, self.TODAY))
+
+    def test_trends(self):
+        for by in reports.TREND_KEYS:
+            self.assertSameRows(reports.trends_report(by, "month"))
+
+    def test_duplicates(self):
+        # Номера групп зависят от порядка записей - сравниваются группы целиком
+        for kind in ("books", "readers"):
+            plain, sharded = self.rows(reports.duplicates_report(kind, threshold=0.3))
+
+            def clusters(rows):
+                groups = {}
+                for row in rows:
+                    groups.setdefault(row[0], []).append(row[1:])
+                return sorted(groups.values())
+            self.assertTrue(plain)
+            self.assertEqual(clusters(sharded), clusters(plain))
+
+
+if __name__ == "__main__":
+    unittest.main()
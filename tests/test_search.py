@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+from db import connection, search
+
+ROWS = [(1, "Толстой Л. Н.", "Война и мир"), (2, "Толстой А. Н.", "Хождение по мукам"),
+        (3, "Достоевский Ф. М.", "Идиот"), (4, None, "Толстой и Достоевский")]
+
+
+class SearchCacheTest(unittest.TestCase):
+    # Уточнение запроса из полного закэшированного результата и сброс кэша при записи
+
+    def setUp(self):
+        self.cache = search.SearchCache(max_entries=4)
+
+    def get(self, text, scope="books"):
+        return self.cache.get(scope, text, [1, 2], search.fold_fts)
+
+    def test_narrowing(self):
+        self.cache.put("books", "толст", ROWS, True)
+        rows, complete = self.get("ТОЛСТОЙ Л")
+        self.assertEqual(rows, [ROWS[0]])
+        self.assertTrue(complete)
+        self.assertEqual((self.cache.hits, self.cache.narrowed, self.cache.misses), (0, 1, 0))
+        # Уточнённый результат тоже в кэше (строки - по столбцам, db/row_store.py)
+        self.assertEqual(list(self.get("ТОЛСТОЙ Л")[0].rows()), [ROWS[0]])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_narrowing_keeps_order(self):
+        self.cache.put("books", "то", ROWS[::-1], True)
+        self.assertEqual(self.get("толстой")[0], [ROWS[3], ROWS[1], ROWS[0]])
+
+    def test_no_narrowing_from_partial_or_other_scope(self):
+        # Неполный результат (первая страница) и другая область не годятся
+        self.cache.put("books", "толст", ROWS[:1], False)
+        self.cache.put("readers", "толст", ROWS, True)
+        self.assertIsNone(self.get("толстой"))
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_lru_limit(self):
+        for n in range(5):
+            self.cache.put("books", f"запрос {n}", ROWS, True)
+        self.assertEqual(len(self.cache.entries), 4)
+        self.assertNotIn(("books", "запрос 0"), self.cache.entries)
+
+
+class ValidateTest(unittest.TestCase):
+    # Кэш сверяется с каждым соединением поиска: commit другого соединения
+    # (data_version) и запись через это же (total_changes) очищают его
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory(prefix="search_")
+        self.path = os.path.join(self.temp_dir.name, "search.db")
+        self.conn = connection.connect(self.path)
+        self.other = connection.connect(self.path)
+        with self.conn:
+            self.conn.execute("CREATE TABLE t (x)")
+        self.cache = search.SearchCache()
+        self.cache.validate(self.conn)
+        self.cache.validate(self.other)
+        self.cache.put("books", "толст", ROWS, True)
+
+    def tearDown(self):
+        self.other.close()
+        self.conn.close()
+        self.temp_dir.cleanup()
+
+    def test_unchanged(self):
+        self.cache.validate(self.conn)
+        self.cache.validate(self.other)
+        self.assertEqual(len(self.cache.entries), 1)
+
+    def test_commit_in_other_connection(self):
+        with self.other:
+            self.other.execute("INSERT INTO t VALUES (1)")
+        self.cache.validate(self.conn)
+        self.assertEqual(self.cache.entries, {})
+
+    def test_write_through_same_connection(self):
+        # data_version не меняется от записи своим соединением - ловит total_changes
+        with self.conn:
+            self.conn.execute("INSERT INTO t VALUES (1)")
+        self.assertEqual(self.conn.execute("PRAGMA data_version").fetchone()[0], self.cache.seen[id(self.conn)][0])
+        self.cache.validate(self.conn)
+        self.assertEqual(self.cache.entries, {})
+
+    def test_new_connection(self):
+        # Первая сверка соединения, которого кэш ещё не видел, тоже очищает его
+        third = connection.connect(self.path)
+        try:
+            self.cache.validate(third)
+        finally:
+            third.close()
+        self.assertEqual(self.cache.entries, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import csv
+import os
+import unittest
+
+from db import connection, dedup, exporter, importer, shards, snapshot
+from tests.base import DatabaseTestCase
+
+
+class ShardedTest(DatabaseTestCase):
+    # Чтение и загрузка после split: книги и выдачи - в файлах библиотек,
+    # в общей базе их больше нет
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        conn = connection.connect(cls.db_path)
+        cls.books = conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+        cls.loans = conn.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0]
+        conn.close()
+
+    def setUp(self):
+        self.path = self.copy(f"{self._testMethodName}.db")
+        shards.split(self.path, log=lambda _: None)
+        self.router = shards.ShardRouter(self.path)
+        self.conn = connection.connect(self.path)
+
+    def tearDown(self):
+        self.conn.close()
+        for library_id, _ in self.router.connections():
+            connection.close_connection(shards.shard_path(self.path, library_id))
+        connection.close_connection(self.path)
+
+    def export(self, table, files, **filters):
+        path = self.temp_path(f"{self._testMethodName}.csv")
+        count = exporter.export_table(self.conn, table, path, files=files, **filters)
+        with open(path, encoding="utf-8", newline="") as f:
+            self.assertEqual(len(list(csv.DictReader(f))), count)
+        return count
+
+    def test_export(self):
+        files = self.router.connections()
+        self.assertEqual(self.export("books", files), self.books)
+        self.assertEqual(self.export("subscriptions", files), self.loans)
+        library_id, shard = files[0]
+        self.assertEqual(self.export("books", files, library_id=library_id),
+                         shard.execute("SELECT COUNT(*) FROM books").fetchone()[0])
+        # Читатели - в общей базе
+        self.assertEqual(self.export("readers", files),
+                         self.conn.execute("SELECT COUNT(*) FROM readers").fetchone()[0])
+
+    def test_snapshot_reading(self):
+        for mode in snapshot.MODES:
+            reads = snapshot.Snapshot(self.path, mode, snapshot_path=self.temp_path(f"{mode}.snapshot.db"))
+            with shards.reading(reads) as (conn, files):
+                self.assertEqual([library_id for library_id, _ in files], self.router.library_ids())
+                self.assertEqual(sum(source.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+                                     for _, source in files), self.books)
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM books").fetchone()[0], 0)
+            shards.close_snapshots(reads)
+            connection.close_connection(reads.read_path)
+            reads.close()
+
+    def test_dedup_records(self):
+        files = self.router.connections()
+        self.assertEqual(len(list(dedup.shard_book_records(self.conn, files))), self.books)
+        self.assertEqual(list(dedup.book_records(self.conn)), [])
+
+    def test_import_books(self):
+        rows = [{"library": "Новая библиотека", "title": f"Импорт {n}", "author": "Автор",
+                 "publisher": "Новое издательство", "publish_year": "2001"} for n in range(3)]
+        library_id, shard = self.router.connections()[0]
+        rows.append({"library_id": str(library_id), "title": "В старую библиотеку", "author": "Автор",
+                     "publisher": "Новое издательство"})
+        stats = importer.import_books(self.conn, rows, batch_size=2, rebuild_indexes=True, router=self.router)
+        self.assertEqual(stats.rows, 4)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM books").fetchone()[0], 0)
+        new_id = self.conn.execute("SELECT library_id FROM libraries WHERE name = 'Новая библиотека'").fetchone()[0]
+        self.assertTrue(os.path.exists(shards.shard_path(self.path, new_id)))
+        new = self.router.connection(new_id)
+        self.assertEqual([row[0] for row in new.execute("SELECT book_id FROM books ORDER BY book_id")], [1, 2, 3])
+        # Копия издательства и поиск - в файле библиотеки
+        self.assertEqual(shard.execute("""
+            SELECT p.name FROM books b JOIN publishers p ON p.publisher_id = b.publisher_id
+            WHERE b.title = 'В старую библиотеку'
+        """).fetchone()[0], "Новое издательство")
+        self.assertEqual(shard.execute(
+            "SELECT COUNT(*) FROM books_fts WHERE books_fts MATCH 'старую'").fetchone()[0], 1)
+        # Индексы и триггеры файла восстановлены
+        self.assertEqual(set(shard.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'books'")),
+                         set(new.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'books'")))
+
+
+if __name__ == "__main__":
+    unittest.main()
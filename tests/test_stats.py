@@ -0,0 +1,45 @@
+import unittest
+
+from db import connection, stats
+from tests.base import DatabaseTestCase
+
+
+class OverdueTest(DatabaseTestCase):
+    # Чтение сводок не пишет в базу и досчитывает просрочку при отставшей границе
+    BOOKS = 500
+
+    def setUp(self):
+        self.conn = connection.connect(self.db_path)
+        stats.refresh_overdue(self.conn)
+        self.expected = (stats.library_stats(self.conn), stats.theme_stats(self.conn))
+        # Давняя сохранённая граница: часть открытых выдач просрочена позже неё
+        with self.conn:
+            self.conn.execute("UPDATE stats_state SET overdue_cutoff = '2023-06-01'")
+        stats.init_db.rebuild_stats(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_read_with_stale_cutoff(self):
+        stale = self.conn.execute("SELECT overdue_cutoff FROM stats_state").fetchone()[0]
+        self.assertTrue(stats._overdue_delta(self.conn, "library_id"))
+        self.assertEqual((stats.library_stats(self.conn), stats.theme_stats(self.conn)), self.expected)
+        self.assertEqual(stats.library_stats(self.conn, 1), self.expected[0][1])
+        self.assertEqual(self.conn.execute("SELECT overdue_cutoff FROM stats_state").fetchone()[0], stale)
+
+    def test_read_only_connection(self):
+        read_only = connection.connect(f"file:{self.db_path}?mode=ro")
+        try:
+            self.assertEqual(stats.library_stats(read_only), self.expected[0])
+        finally:
+            read_only.close()
+
+    def test_refresh(self):
+        self.assertTrue(stats.refresh_overdue(self.conn))
+        self.assertFalse(stats.refresh_overdue(self.conn))
+        self.assertEqual(stats.verify(self.conn), [])
+        self.assertEqual(stats.library_stats(self.conn), self.expected[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from db import connection, write_queue
+
+
+class WriteQueueTest(unittest.TestCase):
+    # Групповой commit: ошибка одной операции откатывает только её точку сохранения
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory(prefix="write_queue_")
+        self.path = os.path.join(self.temp_dir.name, "queue.db")
+        self.conn = connection.connect(self.path)
+        with self.conn:
+            self.conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+        self.queue = write_queue.WriteQueue(self.path)
+
+    def tearDown(self):
+        self.queue.close()
+        self.conn.close()
+        self.temp_dir.cleanup()
+
+    def names(self):
+        return [row[0] for row in self.conn.execute("SELECT name FROM items ORDER BY id")]
+
+    def group(self, *operations):
+        # Операции одной группой: поток очереди занят, пока они не поставлены
+        started, release = threading.Event(), threading.Event()
+        blocker = self.queue.submit(lambda conn: (started.set(), release.wait()))
+        started.wait()
+        futures = [self.queue.submit(func, *args) for func, *args in operations]
+        release.set()
+        blocker.result()
+        return futures
+
+    @staticmethod
+    def insert(conn, name):
+        return conn.execute("INSERT INTO items (name) VALUES (?)", (name,)).lastrowid
+
+    @staticmethod
+    def insert_and_fail(conn, name):
+        conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+        raise ValueError("отказ операции")
+
+    def test_failed_operation_rolled_back(self):
+        first, failed, last = self.group((self.insert, "первая"), (self.insert_and_fail, "откат"),
+                                         (self.insert, "последняя"))
+        self.assertEqual(first.result(), 1)
+        with self.assertRaises(ValueError):
+            failed.result()
+        self.assertEqual(last.result(), 2)
+        self.assertEqual(self.names(), ["первая", "последняя"])
+        # Блокирующая операция - своя группа, остальные три - одним commit
+        self.assertEqual((self.queue.operations, self.queue.commits), (4, 2))
+
+    def test_constraint_error(self):
+        # Ошибка SQLite (NOT NULL) - тоже только у своей операции
+        ok, failed = self.group((self.insert, "есть"), (self.insert, None))
+        self.assertEqual(ok.result(), 1)
+        with self.assertRaises(Exception):
+            failed.result()
+        self.assertEqual(self.names(), ["есть"])
+
+    def test_result_after_commit(self):
+        # Результат выставлен, когда изменение уже видно другим соединениям
+        future = self.queue.submit(self.insert, "видно")
+        future.result()
+        self.assertEqual(self.names(), ["видно"])
+
+    def test_closed(self):
+        self.queue.close()
+        with self.assertRaises(RuntimeError):
+            self.queue.submit(self.insert, "поздно")
+
+
+if __name__ == "__main__":
+    unittest.main()